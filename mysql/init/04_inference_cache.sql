@@ -0,0 +1,60 @@
+-- 推論結果キャッシュと、その無効化に使うレース単位のデータ版数
+
+USE horse_race_db;
+
+-- 1. レース単位のデータ版数
+-- race_result に行が書き込まれる（クローラー・パッチスクリプト・インポート）たびに該当レースの revision を進める。
+-- 推論キャッシュは保存時の revision と現在値を比較し、対象レースに書き込みがあった場合のみ無効化する。
+CREATE TABLE IF NOT EXISTS race_data_revision (
+    race_event_id VARCHAR(50) PRIMARY KEY,
+    revision BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- ※ 一括ロード（import_kaggle.py --bulk）はセッション変数 @skip_revision_trigger を立てて行ごとの更新を止め、
+--    マージ後に対象レースの revision を集合演算でまとめて進める。
+DROP TRIGGER IF EXISTS trg_race_result_revision_insert;
+DROP TRIGGER IF EXISTS trg_race_result_revision_update;
+DROP TRIGGER IF EXISTS trg_race_result_revision_delete;
+
+DELIMITER //
+
+CREATE TRIGGER trg_race_result_revision_insert AFTER INSERT ON race_result
+FOR EACH ROW
+BEGIN
+    IF @skip_revision_trigger IS NULL THEN
+        INSERT INTO race_data_revision (race_event_id, revision) VALUES (NEW.race_event_id, 1)
+        ON DUPLICATE KEY UPDATE revision = revision + 1;
+    END IF;
+END//
+
+CREATE TRIGGER trg_race_result_revision_update AFTER UPDATE ON race_result
+FOR EACH ROW
+BEGIN
+    IF @skip_revision_trigger IS NULL THEN
+        INSERT INTO race_data_revision (race_event_id, revision) VALUES (NEW.race_event_id, 1)
+        ON DUPLICATE KEY UPDATE revision = revision + 1;
+    END IF;
+END//
+
+CREATE TRIGGER trg_race_result_revision_delete AFTER DELETE ON race_result
+FOR EACH ROW
+BEGIN
+    IF @skip_revision_trigger IS NULL THEN
+        INSERT INTO race_data_revision (race_event_id, revision) VALUES (OLD.race_event_id, 1)
+        ON DUPLICATE KEY UPDATE revision = revision + 1;
+    END IF;
+END//
+
+DELIMITER ;
+
+-- 2. 推論結果キャッシュ（APIの再起動・複数ワーカー間で共有する永続層）
+-- cache_key = sha256(過去スコープの race_event_id 集合 + 条件カタログのバージョン)
+CREATE TABLE IF NOT EXISTS inference_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    catalogue_version VARCHAR(64) NOT NULL,
+    race_event_ids TEXT NOT NULL,
+    revisions JSON NOT NULL,
+    payload LONGTEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
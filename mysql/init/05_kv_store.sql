@@ -0,0 +1,16 @@
+-- APIのセッション・出馬表キャッシュ用ストア（MySQLバックエンド）
+-- 複数のuvicornワーカー間での共有と、再起動時の保持のために使う
+
+USE horse_race_db;
+
+CREATE TABLE IF NOT EXISTS kv_store (
+    namespace VARCHAR(50) NOT NULL,
+    store_key VARCHAR(191) NOT NULL,
+    value LONGTEXT NOT NULL,
+    nbytes INT NOT NULL,
+    expires_at DATETIME(6) NULL,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    PRIMARY KEY (namespace, store_key),
+    INDEX idx_kv_expires (namespace, expires_at),
+    INDEX idx_kv_updated (namespace, updated_at)
+);
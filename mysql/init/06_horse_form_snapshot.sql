@@ -0,0 +1,20 @@
+-- 直近5走特徴量のスナップショット（分析時の再計算を避けるための実体化テーブル）
+-- (horse_id, as_of_race_event_id) ごとに「そのレースより前の直近5走」から算出した特徴量を保持する。
+-- 一括構築・差分更新は src/scripts/form_snapshot.py を参照（インポート・パッチ・クローラーの書き込み後に更新する）
+-- ※ 初期化SQLは新規ボリュームにしか流れないため、既存DBではこのファイルを手動で適用してから form_snapshot.py で一括構築する
+--    （未作成の間は分析が race_result から直近5走を計算し、差分更新はスキップされる）
+
+USE horse_race_db;
+
+CREATE TABLE IF NOT EXISTS horse_form_snapshot (
+    horse_id VARCHAR(50) NOT NULL,
+    as_of_race_event_id VARCHAR(50) NOT NULL,
+    as_of_date DATE,
+    recent_highest_grade VARCHAR(20) NOT NULL,
+    recent_top3_count INT NOT NULL,
+    recent_avg_rank_bin VARCHAR(20) NOT NULL,
+    has_dirt_1600_exp TINYINT(1) NOT NULL,
+    has_tokyo_exp TINYINT(1) NOT NULL,
+    PRIMARY KEY (horse_id, as_of_race_event_id),
+    INDEX idx_form_as_of (as_of_race_event_id)
+);
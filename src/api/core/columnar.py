@@ -0,0 +1,150 @@
+from typing import List, Dict, Any, Iterable, Optional
+import numpy as np
+from src.api.core.models import HorseBaseResult, RaceData, AnalysisScope
+
+
+class ColumnarFrame:
+    """
+    HorseBaseResult のリストを列指向（フィールドごとの型付き配列）に変換したもの。
+    推論・スコアリングのホットパスで pydantic の属性アクセスを避け、条件判定をベクトル演算で行うために使う。
+    ※ 欠損(None)は数値列では NaN、カテゴリ列ではコード -1 で表現する。
+    """
+
+    # 数値として比較に使う列（None は NaN）
+    NUMERIC_FIELDS = (
+        "rank", "frame", "odds", "popularity", "carried_weight",
+        "horse_weight", "last_3f", "age_at_race", "birth_year", "recent_top3_count",
+    )
+    # 真偽値の列
+    BOOL_FIELDS = ("has_dirt_1600_exp", "has_tokyo_exp")
+    # ビン文字列や性別などのカテゴリ列（コード化して保持）
+    CATEGORICAL_FIELDS = (
+        "sex", "horse_weight_bin", "last_3f_bin", "recent_highest_grade", "recent_avg_rank_bin",
+    )
+
+    def __init__(self, horses: List[HorseBaseResult], year_idx: Optional[Iterable[int]] = None,
+                 years: Optional[List[int]] = None, race_event_ids: Optional[List[str]] = None):
+        # 出力用の識別子のみ文字列のまま保持する
+        self.horse_ids: List[str] = [h.horse_id for h in horses]
+        self.names: List[str] = [h.name for h in horses]
+
+        self.numeric: Dict[str, np.ndarray] = {
+            f: np.array([np.nan if getattr(h, f) is None else getattr(h, f) for h in horses], dtype=np.float64)
+            for f in self.NUMERIC_FIELDS
+        }
+        self.flags: Dict[str, np.ndarray] = {
+            f: np.array([bool(getattr(h, f)) for h in horses], dtype=bool) for f in self.BOOL_FIELDS
+        }
+
+        self.categories: Dict[str, List[str]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for f in self.CATEGORICAL_FIELDS:
+            cats: Dict[str, int] = {}
+            codes = np.empty(len(horses), dtype=np.int16)
+            for n, h in enumerate(horses):
+                v = getattr(h, f)
+                codes[n] = -1 if v is None else cats.setdefault(v, len(cats))
+            self.categories[f] = list(cats)
+            self.codes[f] = codes
+
+        # 年インデックス（過去データの場合のみ。出馬表では全馬0）
+        self.year_idx = np.zeros(len(horses), dtype=np.intp) if year_idx is None else np.fromiter(year_idx, dtype=np.intp, count=len(horses))
+        self.years: List[int] = years or []
+        self.race_event_ids: List[str] = race_event_ids or []
+        # 条件 key → 該当フラグ（条件カタログによる評価結果をフレーム単位で再利用する）
+        self.condition_masks: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_history(cls, history: List[RaceData]) -> "ColumnarFrame":
+        """過去レース群（年ごとのRaceData）から、年インデックス付きの列表現を作る"""
+        horses = [h for race in history for h in race.results]
+        year_idx = (y for y, race in enumerate(history) for _ in race.results)
+        return cls(
+            horses,
+            year_idx=year_idx,
+            years=[race.year for race in history],
+            race_event_ids=[race.race_event_id for race in history],
+        )
+
+    @classmethod
+    def from_entries(cls, entries: List[HorseBaseResult]) -> "ColumnarFrame":
+        """出馬表（今年の出走馬）から列表現を作る"""
+        return cls(entries)
+
+    def with_scenarios(self, overrides: Dict[str, np.ndarray]) -> "ColumnarFrame":
+        """
+        数値列を (シナリオ数 x 頭数) の仮定値で差し替えたフレームを、全シナリオ分縦に連結して作る（what-if用）。
+        差し替えない列はシナリオ数だけ複製し、year_idx にはシナリオ番号を入れる。
+        """
+        n_horses = len(self)
+        shapes = {np.shape(v) for v in overrides.values()}
+        if len(shapes) != 1 or len(next(iter(shapes))) != 2 or next(iter(shapes))[1] != n_horses:
+            raise ValueError(f"シナリオは (シナリオ数 x {n_horses}頭) の同じ形で指定してください: {shapes}")
+        n_scenarios = next(iter(shapes))[0]
+
+        frame = ColumnarFrame.__new__(ColumnarFrame)
+        frame.horse_ids = self.horse_ids * n_scenarios
+        frame.names = self.names * n_scenarios
+        frame.numeric = {
+            f: (np.asarray(overrides[f], dtype=np.float64).ravel() if f in overrides else np.tile(a, n_scenarios))
+            for f, a in self.numeric.items()
+        }
+        frame.flags = {f: np.tile(a, n_scenarios) for f, a in self.flags.items()}
+        frame.categories = self.categories
+        frame.codes = {f: np.tile(a, n_scenarios) for f, a in self.codes.items()}
+        frame.year_idx = np.repeat(np.arange(n_scenarios, dtype=np.intp), n_horses)
+        frame.years = list(range(n_scenarios))
+        frame.race_event_ids = []
+        frame.condition_masks = {}
+        return frame
+
+    def __len__(self) -> int:
+        return len(self.horse_ids)
+
+    @property
+    def n_years(self) -> int:
+        return len(self.years)
+
+    @property
+    def top3(self) -> np.ndarray:
+        """3着内フラグ（着順欠損・0は対象外）"""
+        rank = self.numeric["rank"]
+        return (rank >= 1) & (rank <= 3)
+
+    @property
+    def nbytes(self) -> int:
+        """型付き配列部分のメモリ使用量（バイト）"""
+        arrays = list(self.numeric.values()) + list(self.flags.values()) + list(self.codes.values()) + [self.year_idx]
+        return sum(a.nbytes for a in arrays)
+
+    # --- 条件判定用のベクトル演算ヘルパー ---
+
+    def num(self, field: str) -> np.ndarray:
+        return self.numeric[field]
+
+    def flag(self, field: str) -> np.ndarray:
+        return self.flags[field]
+
+    def isin(self, field: str, values: Iterable[str]) -> np.ndarray:
+        """カテゴリ列が values のいずれかに一致するか"""
+        lookup = {c: n for n, c in enumerate(self.categories[field])}
+        wanted = [lookup[v] for v in values if v in lookup]
+        return np.isin(self.codes[field], wanted)
+
+    def between(self, field: str, lo: float, hi: float) -> np.ndarray:
+        """lo <= 値 <= hi（0・欠損は該当なしとして扱う）"""
+        x = self.numeric[field]
+        return (x != 0) & (x >= lo) & (x <= hi)
+
+
+class ColumnarScope:
+    """AnalysisScope を一度だけ列表現に変換して保持する"""
+
+    def __init__(self, scope: AnalysisScope):
+        self.target_race_id = scope.target_race_id
+        self.history = ColumnarFrame.from_history(scope.historical_races)
+        self.entries = ColumnarFrame.from_entries(scope.current_entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self.history.nbytes + self.entries.nbytes
@@ -10,11 +10,19 @@ DB_CONFIG = {
     "charset": "utf8mb4"
 }
 
+# プールの接続数。APIのDB用・ネットワーク用スレッドプール（main.py）の各スレッドが同時に1本ずつ使い、
+# さらに同期エンドポイント（チャット・メトリクス）がストアへ接続する分の余裕を持たせる。
+# ※ mysql.connector のプールは最大32接続
+DB_POOL_SIZE = min(int(os.getenv(
+    "DB_POOL_SIZE",
+    str(int(os.getenv("ANALYZE_DB_WORKERS", "4")) + int(os.getenv("ANALYZE_NETWORK_WORKERS", "4")) + 4)
+)), 32)
+
 # 起動時にプールを作成
 try:
     db_pool = MySQLConnectionPool(
         pool_name="mypool",
-        pool_size=5,
+        pool_size=DB_POOL_SIZE,
         **DB_CONFIG
     )
 except Exception as e:
@@ -22,7 +30,7 @@ except Exception as e:
     DB_CONFIG["host"] = "localhost"
     db_pool = MySQLConnectionPool(
         pool_name="mypool",
-        pool_size=5,
+        pool_size=DB_POOL_SIZE,
         **DB_CONFIG
     )
 
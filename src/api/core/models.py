@@ -6,32 +6,32 @@ class HorseBaseResult(BaseModel):
     race_event_id: str
     horse_id: str
     name: str
-    rank: Optional[int]
-    frame: Optional[int]
-    odds: Optional[float]
-    popularity: Optional[int]
-    carried_weight: Optional[float]
-    horse_weight: Optional[int]
-    last_3f: Optional[int]
+    rank: Optional[int] = None
+    frame: Optional[int] = None
+    odds: Optional[float] = None
+    popularity: Optional[int] = None
+    carried_weight: Optional[float] = None
+    horse_weight: Optional[int] = None
+    last_3f: Optional[int] = None
     
     # 馬属性
-    sex: Optional[str]
-    birth_year: Optional[int]
-    sire: Optional[str]
-    dam: Optional[str]
-    damsire: Optional[str]
+    sex: Optional[str] = None
+    birth_year: Optional[int] = None
+    sire: Optional[str] = None
+    dam: Optional[str] = None
+    damsire: Optional[str] = None
 
     # このレース時の設定年齢
-    age_at_race: Optional[int]
+    age_at_race: Optional[int] = None
     
     # 派生特徴量（前処理後）
-    horse_weight_bin: Optional[str]
-    last_3f_bin: Optional[str]
+    horse_weight_bin: Optional[str] = None
+    last_3f_bin: Optional[str] = None
 
     # 直近5走特徴量
-    recent_highest_grade: Optional[str]
+    recent_highest_grade: Optional[str] = None
     recent_top3_count: int = 0
-    recent_avg_rank_bin: Optional[str]
+    recent_avg_rank_bin: Optional[str] = None
     has_dirt_1600_exp: bool = False
     has_tokyo_exp: bool = False
 
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    同一キーの処理の同時実行を1本にまとめる（リクエスト合流）。
+    先着の呼び出しだけが処理を起動し、実行中に同じキーで来た呼び出しは完了を待って同じ結果（または例外）を受け取る。
+    ※ 処理本体は独立したTaskとして動かすため、先着のリクエストが切断されても後続の待機者には結果が届く。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0 # 実際に処理を起動した回数
+        self.joined = 0  # 実行中の処理に合流した回数
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+            self.started += 1
+        else:
+            self.joined += 1
+        # 呼び出し元のキャンセルが共有中の処理に波及しないよう shield して待つ
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 待機者が全員キャンセルされた場合でも「未回収の例外」警告を出さない
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class KeyValueStore(ABC):
+    """
+    セッション・出馬表キャッシュ用のキーバリューストアの共通インターフェース。
+    値はJSONにシリアライズ可能なものに限る（バックエンド間で挙動を揃えるため）。
+    ※ get で得た値を変更した場合は set し直すこと（MySQLバックエンドは常にコピーを返す）。
+    """
+
+    def __init__(self, namespace: str, max_entries: int, max_bytes: int, ttl_seconds: Optional[float]):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "backend": self.backend_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+    @staticmethod
+    def _nbytes(encoded: str) -> int:
+        """エントリのバイト数（UTF-8にエンコードしたJSON表現の長さで計上）"""
+        return len(encoded.encode("utf-8"))
+
+
+class InMemoryStore(KeyValueStore):
+    """プロセス内のLRU＋TTLストア（件数・総バイト数の上限を超えたら古いものから追い出す）"""
+
+    backend_name = "memory"
+
+    def __init__(self, namespace: str, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = None):
+        super().__init__(namespace, max_entries, max_bytes, ttl_seconds)
+        # key -> (value, expires_at, nbytes)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        nbytes = self._nbytes(self._encode(value))
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, nbytes)
+            self._bytes += nbytes
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = super().metrics()
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+    def _remove(self, key: str):
+        _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def _evict(self):
+        """期限切れを掃除した上で、件数・バイト数の上限に収まるまでLRU順に追い出す"""
+        now = time.time()
+        for key in [k for k, (_, exp, _) in self._entries.items() if exp is not None and exp <= now]:
+            self._remove(key)
+            self.expirations += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+
+class MySQLStore(KeyValueStore):
+    """
+    MySQLの kv_store テーブルを使うストア。複数のuvicornワーカーで共有でき、再起動でも消えない。
+    ※ 上限超過分・期限切れ分の削除は一定回数の set ごとにまとめて行う。
+    """
+
+    backend_name = "mysql"
+    PURGE_EVERY = 50
+
+    def __init__(self, namespace: str, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = None):
+        super().__init__(namespace, max_entries, max_bytes, ttl_seconds)
+        self._sets_since_purge = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _connect():
+        # APIの接続プールを共有する（インポート時にDB接続が走るため遅延インポート）
+        from src.api.core.database import get_db_connection
+        return get_db_connection()
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT value FROM kv_store
+                WHERE namespace = %s AND store_key = %s
+                  AND (expires_at IS NULL OR expires_at > NOW(6))
+            """, (self.namespace, key))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        encoded = self._encode(value)
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                REPLACE INTO kv_store (namespace, store_key, value, nbytes, expires_at)
+                VALUES (%s, %s, %s, %s, IF(%s IS NULL, NULL, NOW(6) + INTERVAL %s SECOND))
+            """, (self.namespace, key, encoded, self._nbytes(encoded), self.ttl_seconds, self.ttl_seconds))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+        with self._lock:
+            self._sets_since_purge += 1
+            purge = self._sets_since_purge >= self.PURGE_EVERY
+            if purge:
+                self._sets_since_purge = 0
+        if purge:
+            self.purge()
+
+    def delete(self, key: str):
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM kv_store WHERE namespace = %s AND store_key = %s", (self.namespace, key))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def purge(self):
+        """期限切れの削除と、件数・バイト数上限を超えた古いエントリの削除"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "DELETE FROM kv_store WHERE namespace = %s AND expires_at IS NOT NULL AND expires_at <= NOW(6)",
+                (self.namespace,)
+            )
+            self.expirations += cursor.rowcount
+            # 新しい順に累積件数・累積バイト数を数え、上限を超えた位置より古いものを削除する
+            cursor.execute("""
+                DELETE kv FROM kv_store kv
+                JOIN (
+                    SELECT store_key FROM (
+                        SELECT
+                            store_key,
+                            ROW_NUMBER() OVER (ORDER BY updated_at DESC) AS rn,
+                            SUM(nbytes) OVER (ORDER BY updated_at DESC ROWS UNBOUNDED PRECEDING) AS cum_bytes
+                        FROM kv_store
+                        WHERE namespace = %s
+                    ) ranked
+                    WHERE rn > %s OR cum_bytes > %s
+                ) old ON kv.namespace = %s AND kv.store_key = old.store_key
+            """, (self.namespace, self.max_entries, self.max_bytes, self.namespace))
+            self.evictions += cursor.rowcount
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        stats = super().metrics()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM kv_store
+                    WHERE namespace = %s AND (expires_at IS NULL OR expires_at > NOW(6))
+                """, (self.namespace,))
+                entries, nbytes = cursor.fetchone()
+            finally:
+                cursor.close()
+                conn.close()
+            stats["entries"] = int(entries)
+            stats["bytes"] = int(nbytes)
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+
+def create_store(namespace: str, max_entries: int, max_bytes: int, ttl_seconds: Optional[float]) -> KeyValueStore:
+    """
+    環境変数でバックエンドを選んでストアを生成する。
+    {NAMESPACE}_STORE_BACKEND（例: SESSION_STORE_BACKEND）→ KV_STORE_BACKEND → memory の順で参照する。
+    """
+    backend = os.getenv(f"{namespace.upper()}_STORE_BACKEND", os.getenv("KV_STORE_BACKEND", "memory"))
+    if backend == "mysql":
+        return MySQLStore(namespace, max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    return InMemoryStore(namespace, max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
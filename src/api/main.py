@@ -1,19 +1,30 @@
 import os
 import sys
+import json
 import uuid
-from typing import List, Dict, Any
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Tuple
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 # srcディレクトリへのパスを追加して解決
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 from src.api.services.analyzer import AnalyzerService
 from src.api.services.inference import InferenceService
+from src.api.services.inference_cache import InferenceCache
+from src.api.services.condition_counts import ConditionCountTable, ConditionCountStore
 from src.api.services.validator import ValidatorService, ValidationException
 from src.api.services.ai_service import AIService
 from src.scripts.scrape_race_card import RaceCardScraper, get_virtual_entries
-from src.api.core.models import HorseBaseResult
+from src.api.core.models import HorseBaseResult, AnalysisScope
+from src.api.core.columnar import ColumnarFrame
+from src.api.core.singleflight import SingleFlight
+from src.api.core.store import create_store
 
 app = FastAPI(title="Horse Race Analyzer API")
 
@@ -29,14 +40,28 @@ class AnalyzeRequest(BaseModel):
     race_event_id: str
     target_date: str
 
+class BatchAnalyzeRequest(BaseModel):
+    races: List[AnalyzeRequest]
+
 class ChatRequest(BaseModel):
     session_id: str
     message: str
 
-# メモリ上のモックDB（本番ではDBの session テーブル等に保存）
-MOCK_SESSION_DB = {}
-# 出馬表データキャッシュ（1回限りのアクセス保証）
-RACE_CARD_CACHE = {}
+# 分析セッションの保存先（件数・バイト数・TTLで上限管理。SESSION_STORE_BACKEND=mysql でワーカー間共有）
+SESSION_STORE = create_store(
+    "session",
+    max_entries=int(os.getenv("SESSION_STORE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.getenv("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600))),
+)
+# 出馬表データキャッシュ（TTL内は1回限りのアクセス保証。期限切れ後はオッズ更新のため再取得）
+RACE_CARD_TTL_SECONDS = float(os.getenv("RACE_CARD_TTL_SECONDS", "600"))
+RACE_CARD_STORE = create_store(
+    "race_card",
+    max_entries=int(os.getenv("RACE_CARD_STORE_MAX_ENTRIES", "200")),
+    max_bytes=int(os.getenv("RACE_CARD_STORE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl_seconds=RACE_CARD_TTL_SECONDS,
+)
 
 # Services initialization
 analyzer_service = AnalyzerService()
@@ -44,108 +69,285 @@ inference_service = InferenceService()
 validator_service = ValidatorService()
 ai_service = AIService()
 scraper = RaceCardScraper()
+inference_cache = InferenceCache(InferenceService.CATALOGUE_VERSION)
+# 過去スコープごとの条件別・年別件数表（新しい年の追加・過去年の修正は差分更新で推論する）
+count_tables = ConditionCountStore(int(os.getenv("INFERENCE_COUNT_TABLES", "8")))
 
-@app.post("/api/analyze")
-def analyze_race(req: AnalyzeRequest):
-    try:
-        # 1. Scope (RAG)
+# ブロッキング処理を実行する有界スレッドプール
+# DB・推論系とネットワーク系（出馬表スクレイピング・LLM呼び出し）を分け、
+# クローラーの長いスリープ（5〜20秒）がDB処理やイベントループを占有しないようにする
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ANALYZE_DB_WORKERS", "4")), thread_name_prefix="analyze-db"
+)
+NETWORK_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ANALYZE_NETWORK_WORKERS", "4")), thread_name_prefix="analyze-net"
+)
+
+# 一括分析での推論（CPU処理）をレース間で並列に実行するプロセスプール
+# ※ スレッドプールと併用するため fork ではなく spawn で起動する
+INFERENCE_PROCESS_EXECUTOR = ProcessPoolExecutor(
+    max_workers=int(os.getenv("ANALYZE_PROCESS_WORKERS", "2")),
+    mp_context=multiprocessing.get_context("spawn"),
+)
+
+# 同一キーの同時実行を1本にまとめる（出馬表取得 / 分析全体）
+RACE_CARD_FLIGHTS = SingleFlight()
+ANALYZE_FLIGHTS = SingleFlight()
+
+def analysis_key(req: AnalyzeRequest, history_event_ids: List[str]) -> Tuple:
+    """分析の合流キー。過去スコープ（レース集合）が違えば同じレース・日付でも別の計算として扱う"""
+    return (req.race_event_id, req.target_date, tuple(history_event_ids))
+
+async def run_blocking(executor: ThreadPoolExecutor, func, *args):
+    """同期関数をスレッドプールで実行し、完了をイベントループ上で待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+def infer_with_count_table(historical_races: List[Any], revisions: Optional[Dict[str, int]]) -> Optional[Dict[str, Any]]:
+    """
+    重なるスコープの件数表があれば、追加・修正・除外されたレースの件数だけ差し替えて採用条件を再導出する。
+    版数が取れない（修正を検知できない）場合や、使える件数表がない場合は None。
+    """
+    if revisions is None:
+        return None
+    table = count_tables.nearest([race.race_event_id for race in historical_races])
+    if table is None:
+        return None
+    updated, removed = table.sync(historical_races, revisions)
+    print(f"[Analyze API] Incremental inference: {len(updated)} races upserted, {len(removed)} removed.")
+    count_tables.remember(table)
+    return InferenceService.run_inference_from_counts(table)
+
+def load_inference(req: AnalyzeRequest) -> Dict[str, Any]:
+    """1. Scope (RAG) & 2. Inference（DB・CPU処理）"""
+    # 過去スコープ（レース集合）に書き込みがなければ、前回の推論結果をキャッシュから再利用する
+    history_event_ids = AnalyzerService.get_historical_event_ids()
+    revisions, cached = inference_cache.lookup(history_event_ids)
+    if cached is None:
         scope = AnalyzerService.build_analysis_scope(req.race_event_id, req.target_date)
         ValidatorService.validate_scope(scope)
-        
-        # 2. Inference & Evaluation
-        inference_results = InferenceService.run_inference(scope.historical_races)
-        adopted_conds = inference_results["adopted_conditions"]
-        ValidatorService.validate_inference_results(scope.historical_races, adopted_conds)
-        
-        # 3. 本番出馬表（今年の出走馬）のスクレイピング取得（キャッシュ機構による1回のみアクセス保証）
-        # リクエストされた race_event_id が未出走レースと想定
-        if req.race_event_id in RACE_CARD_CACHE:
-            print(f"[Analyze API] Using cached race card for {req.race_event_id}...")
-            real_entries = RACE_CARD_CACHE[req.race_event_id]
-        else:
-            print(f"[Analyze API] Scraping real race card for {req.race_event_id}...")
-            real_entries = scraper.fetch_current_race_card(req.race_event_id)
-            if not real_entries:
-                print("[Analyze API] Could not fetch real entries. Using virtual fallback entries.")
-                real_entries = get_virtual_entries() # テスト用ダミー
-            # 結果をキャッシュに保存
-            RACE_CARD_CACHE[req.race_event_id] = real_entries
-
-        # 4. スコアリングの前処理（事実ベースでの合致条件洗い出し）
-        # プログラム依存のスコアリングは行わず、事実データのみを作る
-        entries_with_facts = []
-        for real_horse in real_entries:
-            # DBなどから詳細を引いてHorseBaseResultを組み立てるのが本当だが、
-            # ここでは簡単なダミーHorseBaseResultを組み立ててInferenceチェックを通す
-            # (※ 簡略化：本来はscraper結果とDB履歴を結合する処理が必要)
-            horse_obj = HorseBaseResult(
-                race_event_id=req.race_event_id,
-                horse_id=real_horse["horse_id"], 
-                name=real_horse["horse_name"], 
-                frame=real_horse["frame_number"], 
-                carried_weight=real_horse["weight_carried"], 
-                odds=real_horse["odds"],
-                popularity=real_horse["popularity"]
+        results = infer_with_count_table(scope.historical_races, revisions)
+        if results is None:
+            table = ConditionCountTable.from_history(scope.historical_races, revisions)
+            if revisions is not None:
+                count_tables.remember(table)
+            results = InferenceService.run_inference_from_counts(table)
+        ValidatorService.validate_inference_results(scope.historical_races, results["adopted_conditions"])
+        cached = {"history_count": len(scope.historical_races), "inference_results": results}
+        if revisions is not None:
+            inference_cache.put(history_event_ids, revisions, cached)
+    else:
+        print(f"[Analyze API] Using cached inference results for {len(history_event_ids)} historical races.")
+    # キャッシュ経由の結果もガードレール検証は必ず通す（軽量な再計算チェックのみ）
+    ValidatorService.validate_inference_results(history_event_ids, cached["inference_results"]["adopted_conditions"])
+    return cached
+
+async def load_scope_inference(scope: AnalysisScope) -> Dict[str, Any]:
+    """一括分析用: 構築済みスコープの推論をプロセスプールで行う（推論キャッシュ・件数表は単体分析と共有）"""
+    ValidatorService.validate_scope(scope)
+    history_event_ids = [race.race_event_id for race in scope.historical_races]
+    revisions, cached = await run_blocking(DB_EXECUTOR, inference_cache.lookup, history_event_ids)
+    if cached is None:
+        results = await run_blocking(DB_EXECUTOR, infer_with_count_table, scope.historical_races, revisions)
+        if results is None:
+            # プロセス間の受け渡しは pydantic モデルではなく列表現（numpy配列）で行う
+            frame = ColumnarFrame.from_history(scope.historical_races)
+            loop = asyncio.get_running_loop()
+            # 件数表の構築（行列積による集計）をプロセスプールで行い、採用条件の導出は親プロセスで行う
+            table = await loop.run_in_executor(
+                INFERENCE_PROCESS_EXECUTOR, functools.partial(ConditionCountTable.from_history, frame, revisions)
             )
-            
-            matched = []
-            # Inferenceが作った条件のうち、この馬に当てはまるかチェック (簡易版)
-            for cond in adopted_conds:
-                # eval_func 相当が必要だが現状 InferenceService は関数インスタンスを返さないため
-                # 今回は事実レポートとして条件上位を便宜上当てはめるモック処理
-                if len(matched) < 2: 
-                   matched.append(cond)
-
-            entries_with_facts.append({
-                "horse_id": real_horse["horse_id"],
-                "name": real_horse["horse_name"],
-                "frame": real_horse["frame_number"],
-                "odds": real_horse["odds"],
-                "matched_conditions": matched
-            })
-
-        # 5. AI統合レイヤーへの引き渡し（推論と解釈・スコアリング）
-        print("[Analyze API] Passing facts to AI Service...")
-        ai_result = ai_service.evaluate_entries(entries_with_facts)
-
-        # 6. APIレスポンス用の組み立て
-        session_id = str(uuid.uuid4())
-        ai_insights = ai_result["ai_reasoning"]
-        scored_horses = ai_result["rankings"]
-
-        session_data = {
-            "race_event_id": req.race_event_id,
-            "scope": {
-                "history_count": len(scope.historical_races),
-                "current_count": len(real_entries)
-            },
-            "trends": inference_results["adopted_conditions"][:5],
-            "evaluations": scored_horses,
-            "ai_insights": ai_insights,
-            "chat_history": []
-        }
-        
-        MOCK_SESSION_DB[session_id] = session_data
+            if revisions is not None:
+                count_tables.remember(table)
+            results = InferenceService.run_inference_from_counts(table)
+        ValidatorService.validate_inference_results(scope.historical_races, results["adopted_conditions"])
+        cached = {"history_count": len(scope.historical_races), "inference_results": results}
+        if revisions is not None:
+            await run_blocking(DB_EXECUTOR, inference_cache.put, history_event_ids, revisions, cached)
+    else:
+        print(f"[Analyze API] Using cached inference results for {len(history_event_ids)} historical races.")
+    ValidatorService.validate_inference_results(history_event_ids, cached["inference_results"]["adopted_conditions"])
+    return cached
+
+def load_race_card(race_event_id: str) -> List[Dict[str, Any]]:
+    """3. 本番出馬表（今年の出走馬）のスクレイピング取得（キャッシュ機構による1回のみアクセス保証）"""
+    # リクエストされた race_event_id が未出走レースと想定
+    cached_entries = RACE_CARD_STORE.get(race_event_id)
+    if cached_entries is not None:
+        print(f"[Analyze API] Using cached race card for {race_event_id}...")
+        return cached_entries
+
+    print(f"[Analyze API] Scraping real race card for {race_event_id}...")
+    real_entries = scraper.fetch_current_race_card(race_event_id, max_age=RACE_CARD_TTL_SECONDS)
+    if not real_entries:
+        print("[Analyze API] Could not fetch real entries. Using virtual fallback entries.")
+        real_entries = get_virtual_entries() # テスト用ダミー
+    # 結果をキャッシュに保存
+    RACE_CARD_STORE.set(race_event_id, real_entries)
+    return real_entries
+
+def build_entries_with_facts(race_event_id: str, real_entries: List[Dict[str, Any]], adopted_conds: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """4. スコアリングの前処理（事実ベースでの合致条件洗い出し）"""
+    # プログラム依存のスコアリングは行わず、事実データのみを作る
+    entries_with_facts = []
+    for real_horse in real_entries:
+        # DBなどから詳細を引いてHorseBaseResultを組み立てるのが本当だが、
+        # ここでは簡単なダミーHorseBaseResultを組み立ててInferenceチェックを通す
+        # (※ 簡略化：本来はscraper結果とDB履歴を結合する処理が必要)
+        horse_obj = HorseBaseResult(
+            race_event_id=race_event_id,
+            horse_id=real_horse["horse_id"], 
+            name=real_horse["horse_name"], 
+            frame=real_horse["frame_number"], 
+            carried_weight=real_horse["weight_carried"], 
+            odds=real_horse["odds"],
+            popularity=real_horse["popularity"]
+        )
         
-        return {
-            "status": "success",
-            "session_id": session_id,
-            "data": {
-                "race_info": f"フェブラリーS 分析完了 (該当条件: {len(inference_results['adopted_conditions'])}個)",
-                "ai_reasoning": ai_insights,
-                "horse_results": scored_horses
-            }
+        matched = []
+        # Inferenceが作った条件のうち、この馬に当てはまるかチェック (簡易版)
+        for cond in adopted_conds:
+            # eval_func 相当が必要だが現状 InferenceService は関数インスタンスを返さないため
+            # 今回は事実レポートとして条件上位を便宜上当てはめるモック処理
+            if len(matched) < 2: 
+               matched.append(cond)
+
+        entries_with_facts.append({
+            "horse_id": real_horse["horse_id"],
+            "name": real_horse["horse_name"],
+            "frame": real_horse["frame_number"],
+            "odds": real_horse["odds"],
+            "matched_conditions": matched
+        })
+    return entries_with_facts
+
+async def fetch_race_card_once(race_event_id: str) -> List[Dict[str, Any]]:
+    """同一レースの出馬表取得を合流させ、同時アクセスでもスクレイピングは1回だけにする"""
+    return await RACE_CARD_FLIGHTS.run(
+        race_event_id, lambda: run_blocking(NETWORK_EXECUTOR, load_race_card, race_event_id)
+    )
+
+async def compute_analysis(req: AnalyzeRequest,
+                           inference_loader: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """
+    1〜5の分析本体（セッション発行前まで）。同一の analysis_key では結果を共有する。
+    inference_loader を渡した場合は 1〜2 をそれで置き換える（一括分析で構築済みのスコープを使う場合）。
+    """
+    inference = inference_loader() if inference_loader else run_blocking(DB_EXECUTOR, load_inference, req)
+    # 過去データ＋推論（DB）と出馬表取得（スクレイピング）は互いに依存しないため並行実行する
+    cached, real_entries = await asyncio.gather(
+        inference,
+        fetch_race_card_once(req.race_event_id),
+    )
+    adopted_conds = cached["inference_results"]["adopted_conditions"]
+
+    entries_with_facts = build_entries_with_facts(req.race_event_id, real_entries, adopted_conds)
+
+    # 5. AI統合レイヤーへの引き渡し（推論と解釈・スコアリング）
+    print("[Analyze API] Passing facts to AI Service...")
+    ai_result = await run_blocking(NETWORK_EXECUTOR, ai_service.evaluate_entries, entries_with_facts)
+    return {"cached": cached, "real_entries": real_entries, "ai_result": ai_result}
+
+def build_analysis_response(req: AnalyzeRequest, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """6. セッションを発行し、APIレスポンスを組み立てる（セッションはリクエストごとに発行）"""
+    cached = analysis["cached"]
+    real_entries = analysis["real_entries"]
+    ai_result = analysis["ai_result"]
+    inference_results = cached["inference_results"]
+
+    session_id = str(uuid.uuid4())
+    ai_insights = ai_result["ai_reasoning"]
+    scored_horses = ai_result["rankings"]
+
+    session_data = {
+        "race_event_id": req.race_event_id,
+        "scope": {
+            "history_count": cached["history_count"],
+            "current_count": len(real_entries)
+        },
+        "trends": inference_results["adopted_conditions"][:5],
+        "evaluations": scored_horses,
+        "ai_insights": ai_insights,
+        "chat_history": []
+    }
+    
+    SESSION_STORE.set(session_id, session_data)
+    
+    return {
+        "status": "success",
+        "session_id": session_id,
+        "data": {
+            # 一括分析では任意の重賞を扱うため、レース名ではなくレースIDと過去スコープの規模を示す
+            "race_info": (
+                f"{req.race_event_id} 分析完了 "
+                f"(過去{cached['history_count']}開催 / 該当条件: {len(inference_results['adopted_conditions'])}個)"
+            ),
+            "ai_reasoning": ai_insights,
+            "horse_results": scored_horses
         }
+    }
+
+@app.post("/api/analyze")
+async def analyze_race(req: AnalyzeRequest):
+    try:
+        # レース当日の同時アクセスは1回の計算に合流させる（セッションはリクエストごとに発行）
+        analysis = await ANALYZE_FLIGHTS.run(
+            analysis_key(req, AnalyzerService.get_historical_event_ids()), lambda: compute_analysis(req)
+        )
+        # セッション保存（MySQLバックエンドではDB書き込み）はイベントループを塞がないようスレッドプールで行う
+        return await run_blocking(DB_EXECUTOR, build_analysis_response, req, analysis)
         
     except ValidationException as ve:
         raise HTTPException(status_code=400, detail=f"Validation Error: {ve.message}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
+@app.post("/api/analyze/batch")
+async def analyze_batch(req: BatchAnalyzeRequest):
+    """
+    複数レース（週末の重賞など）の一括分析。各レースの系譜を解決し、過去データは一括クエリで共有して読み込む。
+    結果はレースごとに完了順で NDJSON（1行1レース）としてストリーミングで返す。
+    """
+    if not req.races:
+        raise HTTPException(status_code=400, detail="races が空です")
+    targets = [(race.race_event_id, race.target_date) for race in req.races]
+    try:
+        scopes = await run_blocking(DB_EXECUTOR, AnalyzerService.build_batch_scopes, targets)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+    async def analyze_one(race: AnalyzeRequest) -> Dict[str, Any]:
+        scope = scopes[(race.race_event_id, race.target_date)]
+        header = {"race_event_id": race.race_event_id, "target_date": race.target_date}
+        try:
+            # 単体分析（フェブラリーS固定スコープ）とは系譜スコープが違えば合流しない
+            history_event_ids = [r.race_event_id for r in scope.historical_races]
+            analysis = await ANALYZE_FLIGHTS.run(
+                analysis_key(race, history_event_ids),
+                lambda: compute_analysis(race, lambda: load_scope_inference(scope))
+            )
+            return {**header, **await run_blocking(DB_EXECUTOR, build_analysis_response, race, analysis)}
+        except ValidationException as ve:
+            return {**header, "status": "error", "detail": f"Validation Error: {ve.message}"}
+        except Exception as e:
+            return {**header, "status": "error", "detail": f"Internal Server Error: {str(e)}"}
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(analyze_one(race)) for race in req.races]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            # クライアント切断時は未完了のレースを打ち切る（合流中の共有処理は shield により継続）
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/api/chat")
 def chat_followup(req: ChatRequest):
     """LLMとの対話を想定したフォローアップAPI"""
-    session = MOCK_SESSION_DB.get(req.session_id)
+    session = SESSION_STORE.get(req.session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
         
@@ -157,12 +359,23 @@ def chat_followup(req: ChatRequest):
         chat_history.append({"role": "user", "content": req.message})
         chat_history.append({"role": "assistant", "content": mock_reply})
         session["chat_history"] = chat_history
+        SESSION_STORE.set(req.session_id, session)
     
     return {
         "reply": mock_reply,
         "history": session["chat_history"]
     }
 
+@app.get("/api/metrics/stores")
+def store_metrics():
+    """セッション・出馬表・推論キャッシュの使用状況"""
+    return {
+        "session": SESSION_STORE.metrics(),
+        "race_card": RACE_CARD_STORE.metrics(),
+        "inference_cache": inference_cache.metrics(),
+        "count_tables": count_tables.metrics(),
+    }
+
 # 開発用プレースホルダー：GET / で簡易ヘルスチェック
 @app.get("/")
 def read_root():
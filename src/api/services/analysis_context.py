@@ -0,0 +1,151 @@
+import json
+import threading
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+from src.api.core.database import get_db_connection
+from src.api.core.models import HorseBaseResult, RaceData, AnalysisScope
+from src.api.services.analyzer import AnalyzerService
+
+Target = Tuple[str, str]
+
+
+class AnalysisContext:
+    """
+    複数の分析対象（race_event_id, target_date）で共有する、セッション単位の分析コンテキスト。
+    必要な過去開催・出走馬の和集合を一度だけ読み込み、直近5走特徴量は (horse_id, as_of_date) 単位でメモ化して、
+    以降は任意の数の対象スコープをメモリ上から組み立てる（重賞全体の一括分析・夜間の事前計算向け）。
+    ※ 保持量は nbytes / metrics() で確認でき、release() で明示的に解放する。
+    """
+
+    def __init__(self, limit_years: int = 10):
+        self.limit_years = limit_years
+        self.lineages: Dict[Target, List[str]] = {}
+        self.races: Dict[str, RaceData] = {}
+        self.entry_rows: Dict[str, List[Dict[str, Any]]] = {}
+        self.entries: Dict[Target, List[HorseBaseResult]] = {}
+        self.features: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._race_bytes: Dict[str, int] = {}
+        self._entry_bytes: Dict[Target, int] = {}
+        self._lock = threading.RLock()
+        self.feature_lookups = 0
+        self.feature_misses = 0
+
+    def __enter__(self) -> "AnalysisContext":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def load(self, targets: Iterable[Target]):
+        """未読み込みの対象について、系譜・過去開催・出走馬・直近5走を差分だけ一括で読み込む"""
+        with self._lock:
+            targets = [t for t in dict.fromkeys(targets) if t not in self.entries]
+            if not targets:
+                return
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
+            try:
+                for t in targets:
+                    if t not in self.lineages:
+                        self.lineages[t] = AnalyzerService.resolve_lineage_event_ids(cursor, t[0], t[1], self.limit_years)
+
+                # 過去開催はレース間で重複しやすいため、未読み込みの和集合だけを1回で読み込む
+                history_ids = [
+                    eid for eid in dict.fromkeys(eid for t in targets for eid in self.lineages[t])
+                    if eid not in self.races
+                ]
+                if history_ids:
+                    rows = AnalyzerService._fetch_history_rows(cursor, history_ids)
+                    for race in AnalyzerService._build_history_races(cursor, rows, self.features):
+                        self.races[race.race_event_id] = race
+                        self._race_bytes[race.race_event_id] = self._nbytes(race.model_dump(mode="json"))
+
+                # 出走馬行は対象レースごとに1回だけ取得し、target_date の異なる対象でも使い回す
+                race_ids = [rid for rid in dict.fromkeys(t[0] for t in targets) if rid not in self.entry_rows]
+                if race_ids:
+                    for rid in race_ids:
+                        self.entry_rows[rid] = []
+                    for row in AnalyzerService._fetch_entry_rows(cursor, race_ids):
+                        self.entry_rows[row["race_event_id"]].append(row)
+
+                # 直近5走は (horse_id, as_of_date) でメモ化し、未計算の組だけを一括クエリで補う
+                expanded = [(t, dict(row, target_date=t[1])) for t in targets for row in self.entry_rows[t[0]]]
+                known = len(self.features)
+                recent_list = AnalyzerService._resolve_recent_features(
+                    cursor, [row for _, row in expanded], lambda row: row["target_date"], self.features
+                )
+                self.feature_lookups += len(expanded)
+                self.feature_misses += len(self.features) - known
+            finally:
+                cursor.close()
+                conn.close()
+
+            for t in targets:
+                self.entries[t] = []
+            for (t, row), recent in zip(expanded, recent_list):
+                self.entries[t].append(AnalyzerService._build_entry(row, recent))
+            for t in targets:
+                self._entry_bytes[t] = self._nbytes([h.model_dump(mode="json") for h in self.entries[t]])
+
+    def scope(self, target_race_id: str, target_date: str) -> AnalysisScope:
+        """対象1件のスコープをメモリ上から組み立てる（未読み込みなら読み込む）"""
+        target = (target_race_id, target_date)
+        self.load([target])
+        with self._lock:
+            historical = [self.races[eid] for eid in self.lineages[target] if eid in self.races]
+            entries = list(self.entries[target])
+        historical.sort(key=lambda race: race.year, reverse=True)
+        return AnalysisScope(target_race_id=target_race_id, historical_races=historical, current_entries=entries)
+
+    def scopes(self, targets: Iterable[Target]) -> Dict[Target, AnalysisScope]:
+        targets = list(dict.fromkeys(targets))
+        self.load(targets)
+        return {t: self.scope(*t) for t in targets}
+
+    def release(self, targets: Optional[Iterable[Target]] = None):
+        """
+        対象を指定した場合はその対象の出走馬と、他の対象から参照されなくなった過去開催・出走馬行・特徴量を解放する。
+        未指定の場合はすべて解放する。
+        """
+        with self._lock:
+            if targets is None:
+                for store in (self.lineages, self.races, self.entry_rows, self.entries, self.features,
+                              self._race_bytes, self._entry_bytes):
+                    store.clear()
+                return
+
+            for t in targets:
+                self.lineages.pop(t, None)
+                self.entries.pop(t, None)
+                self._entry_bytes.pop(t, None)
+            live_races = {eid for ids in self.lineages.values() for eid in ids}
+            for eid in [eid for eid in self.races if eid not in live_races]:
+                del self.races[eid]
+                del self._race_bytes[eid]
+            live_entry_races = {t[0] for t in self.entries}
+            for rid in [rid for rid in self.entry_rows if rid not in live_entry_races]:
+                del self.entry_rows[rid]
+            live_pairs = {(row["horse_id"], t[1]) for t in self.entries for row in self.entry_rows.get(t[0], [])}
+            for pair in [pair for pair in self.features if pair not in live_pairs]:
+                del self.features[pair]
+
+    @property
+    def nbytes(self) -> int:
+        """保持している過去開催・出走馬のおおよそのバイト数（JSON表現のUTF-8長で計上）"""
+        with self._lock:
+            return sum(self._race_bytes.values()) + sum(self._entry_bytes.values())
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "targets": len(self.entries),
+                "races": len(self.races),
+                "entry_races": len(self.entry_rows),
+                "features": len(self.features),
+                "feature_lookups": self.feature_lookups,
+                "feature_misses": self.feature_misses,
+                "bytes": self.nbytes,
+            }
+
+    @staticmethod
+    def _nbytes(value: Any) -> int:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
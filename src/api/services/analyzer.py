@@ -1,8 +1,14 @@
-from typing import List, Dict, Any
+import os
+from typing import List, Dict, Any, Tuple, Optional
 from src.api.core.database import get_db_connection
 from src.api.core.models import HorseBaseResult, RaceData, AnalysisScope
 
 class AnalyzerService:
+    # フェブラリーS 過去5年分（要件上過去10年だが現在データがある分を全取得）
+    FEBRUARY_S_EVENT_IDS = ("202105010811", "202205010811", "202305010811", "202405010811", "202505010811")
+    # race_master 未紐付けを表すダミーID（取り込みスクリプトが入れる値）
+    UNLINKED_MASTER_IDS = ("UNKNOWN", "UNKNOWN_MASTER")
+
     @staticmethod
     def _bin_horse_weight(weight: int) -> str:
         if weight is None or weight == 0:
@@ -29,22 +35,25 @@ class AnalyzerService:
         if avg <= 6.9: return "4.0-6.9"
         return "7.0+"
 
+    # 直近5走の一括取得で1クエリに詰める (horse_id, before_date) ペア数の上限
+    RECENT_5_CHUNK_SIZE = 500
+
+    # 直近5走特徴量を horse_form_snapshot（実体化テーブル）から読むかどうか
+    USE_FORM_SNAPSHOT = os.getenv("USE_FORM_SNAPSHOT", "1") == "1"
+    # テーブルの有無（初回の参照時に確認。既存のDBボリュームには 06_horse_form_snapshot.sql が流れないため）
+    FORM_SNAPSHOT_AVAILABLE: Optional[bool] = None
+    # スナップショット参照用の列・JOIN（対象出走そのものを as_of とする）
+    FORM_SNAPSHOT_COLUMNS = """,
+                fs.as_of_race_event_id AS fs_as_of, fs.recent_highest_grade AS fs_recent_highest_grade,
+                fs.recent_top3_count AS fs_recent_top3_count, fs.recent_avg_rank_bin AS fs_recent_avg_rank_bin,
+                fs.has_dirt_1600_exp AS fs_has_dirt_1600_exp, fs.has_tokyo_exp AS fs_has_tokyo_exp"""
+    FORM_SNAPSHOT_JOIN = """
+            LEFT JOIN horse_form_snapshot fs
+                ON fs.horse_id = r.horse_id AND fs.as_of_race_event_id = r.race_event_id"""
+
     @staticmethod
-    def get_recent_5_races(cursor, horse_id: str, before_date: str) -> Dict[str, Any]:
-        """指定日以前の直近5走データを取得し、派生特徴量を計算する"""
-        query = """
-            SELECT 
-                r.rank, re.distance, re.surface, re.course_id, rm.grade
-            FROM race_result r
-            JOIN race_event re ON r.race_event_id = re.race_event_id
-            LEFT JOIN race_master rm ON re.race_master_id = rm.race_master_id
-            WHERE r.horse_id = %s AND re.race_date < %s
-            ORDER BY re.race_date DESC
-            LIMIT 5
-        """
-        cursor.execute(query, (horse_id, before_date))
-        rows = cursor.fetchall()
-        
+    def _compute_recent_features(rows: List[Tuple[Any, ...]]) -> Dict[str, Any]:
+        """直近5走の行 (rank, distance, surface, course_id, grade) から派生特徴量を計算する"""
         has_dirt_1600 = False
         has_tokyo = False
         top3_count = 0
@@ -90,34 +99,204 @@ class AnalyzerService:
         }
 
     @staticmethod
-    def get_historical_data(race_name_keyword: str="フェブラリー", limit_years: int=10) -> List[RaceData]:
-        """指定レースの過去履歴を取得する（RAGのRetrievalに相当）"""
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
+    def _recent_row_tuple(row) -> Tuple[Any, ...]:
+        """dictionaryカーソル・タプルカーソルどちらの行も (rank, distance, surface, course_id, grade) に揃える"""
+        if isinstance(row, dict):
+            return (row["rank"], row["distance"], row["surface"], row["course_id"], row["grade"])
+        return tuple(row)
+
+    @staticmethod
+    def get_recent_5_races(cursor, horse_id: str, before_date: str) -> Dict[str, Any]:
+        """指定日以前の直近5走データを取得し、派生特徴量を計算する（1頭分）"""
+        query = """
+            SELECT 
+                r.rank, re.distance, re.surface, re.course_id, rm.grade
+            FROM race_result r
+            JOIN race_event re ON r.race_event_id = re.race_event_id
+            LEFT JOIN race_master rm ON re.race_master_id = rm.race_master_id
+            WHERE r.horse_id = %s AND re.race_date < %s
+            ORDER BY re.race_date DESC
+            LIMIT 5
+        """
+        cursor.execute(query, (horse_id, before_date))
+        rows = [AnalyzerService._recent_row_tuple(row) for row in cursor.fetchall()]
+        return AnalyzerService._compute_recent_features(rows)
+
+    @staticmethod
+    def get_recent_5_races_bulk(cursor, pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        (horse_id, before_date) の組すべてについて直近5走特徴量をまとめて計算する。
+        1頭ごとに問い合わせる代わりに、ROW_NUMBER() OVER (PARTITION BY ...) で
+        各組の直近5行だけを残すクエリをチャンク単位で発行する（N+1クエリの解消）。
+        """
+        unique_pairs = list(dict.fromkeys(p for p in pairs if p[0] and p[1]))
+        rows_by_pair: Dict[Tuple[str, str], List[Tuple[Any, ...]]] = {p: [] for p in unique_pairs}
+
+        chunk_size = AnalyzerService.RECENT_5_CHUNK_SIZE
+        for start in range(0, len(unique_pairs), chunk_size):
+            chunk = unique_pairs[start:start + chunk_size]
+            # 対象ペアを派生表として渡す（リテラルは照合順序を明示してJOIN時の不一致を防ぐ）
+            pair_sql = " UNION ALL ".join(
+                ["SELECT %s COLLATE utf8mb4_unicode_ci AS horse_id, CAST(%s AS DATE) AS before_date"] * len(chunk)
+            )
+            query = f"""
+                SELECT
+                    q.horse_id, q.before_date, q.rank, q.distance, q.surface, q.course_id, q.grade
+                FROM (
+                    SELECT
+                        p.horse_id, p.before_date,
+                        r.`rank` AS `rank`, re.distance, re.surface, re.course_id, rm.grade,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY p.horse_id, p.before_date
+                            ORDER BY re.race_date DESC
+                        ) AS rn
+                    FROM ({pair_sql}) p
+                    JOIN race_result r ON r.horse_id = p.horse_id
+                    JOIN race_event re ON r.race_event_id = re.race_event_id
+                    LEFT JOIN race_master rm ON re.race_master_id = rm.race_master_id
+                    WHERE re.race_date < p.before_date
+                ) q
+                WHERE q.rn <= 5
+                ORDER BY q.horse_id, q.before_date, q.rn
+            """
+            params = tuple(v for pair in chunk for v in pair)
+            cursor.execute(query, params)
+            for row in cursor.fetchall():
+                if isinstance(row, dict):
+                    key = (row["horse_id"], str(row["before_date"]))
+                else:
+                    key = (row[0], str(row[1]))
+                    row = dict(zip(("horse_id", "before_date", "rank", "distance", "surface", "course_id", "grade"), row))
+                if key in rows_by_pair:
+                    rows_by_pair[key].append(AnalyzerService._recent_row_tuple(row))
+
+        return {p: AnalyzerService._compute_recent_features(rows) for p, rows in rows_by_pair.items()}
+
+    @staticmethod
+    def _resolve_recent_features(cursor, rows: List[Dict[str, Any]], before_date_of,
+                                 memo: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        各行の直近5走特徴量を返す。スナップショットが取れた行はそれを使い、
+        未構築の行だけを (horse_id, before_date) の一括クエリで補う。
+        ※ memo を渡した場合は (horse_id, before_date) → 特徴量 として再利用・追記する（分析コンテキスト用）。
+        """
+        no_history = AnalyzerService._compute_recent_features([])
+        memo = {} if memo is None else memo
+        missing_pairs = []
+        for row in rows:
+            pair = (row["horse_id"], before_date_of(row))
+            if pair in memo:
+                continue
+            if row.get("fs_as_of") is not None:
+                memo[pair] = {
+                    "recent_highest_grade": row["fs_recent_highest_grade"],
+                    "recent_top3_count": int(row["fs_recent_top3_count"]),
+                    "recent_avg_rank_bin": row["fs_recent_avg_rank_bin"],
+                    "has_dirt_1600_exp": bool(row["fs_has_dirt_1600_exp"]),
+                    "has_tokyo_exp": bool(row["fs_has_tokyo_exp"])
+                }
+            elif pair[1]:
+                missing_pairs.append(pair)
+        if missing_pairs:
+            memo.update(AnalyzerService.get_recent_5_races_bulk(cursor, missing_pairs))
+
+        return [memo.get((row["horse_id"], before_date_of(row)), no_history) for row in rows]
+
+    @staticmethod
+    def get_historical_event_ids(race_name_keyword: str="フェブラリー", limit_years: int=10) -> List[str]:
+        """過去履歴として使う race_event_id の一覧を返す（分析スコープの確定）"""
         # 今回はフェブラリーS用として固定のrace_event_id等で引くか、名前で引く設計
         # ※ 実運用では race_master と紐付けるが、現在は手動パッチした2021-2025を確実にとるようクエリ構築
-        target_event_ids = ["202105010811", "202205010811", "202305010811", "202405010811", "202505010811"] # 過去5年分（要件上過去10年だが現在データがある分を全取得）
-        
-        format_strings = ','.join(['%s'] * len(target_event_ids))
+        return list(AnalyzerService.FEBRUARY_S_EVENT_IDS)
+
+    @staticmethod
+    def resolve_lineage_event_ids(cursor, target_race_id: str, target_date: str, limit_years: int=10) -> List[str]:
+        """
+        race_master / race_definition_history から対象レースの過去開催（系譜）を解決する。
+        対象年に有効な施行条件（race_definition_history）があれば、同じ条件期間内の開催に絞る。
+        ※ race_master が明示的に未紐付け（UNKNOWN等。単一レース時代の取り込みデータ）の場合のみ、従来のフェブラリーS固定スコープを返す。
+           それ以外で過去開催が見つからない場合（初回開催・未登録のレースなど）は空リストを返し、スコープ検証で弾く。
+        """
+        cursor.execute("SELECT race_master_id FROM race_event WHERE race_event_id = %s", (target_race_id,))
+        target = cursor.fetchone()
+        if target is None:
+            return []
+        master_id = target["race_master_id"] if isinstance(target, dict) else target[0]
+        if master_id in AnalyzerService.UNLINKED_MASTER_IDS:
+            return list(AnalyzerService.FEBRUARY_S_EVENT_IDS)
+
+        cursor.execute("""
+            SELECT prev.race_event_id
+            FROM race_event tgt
+            JOIN race_event prev
+                ON prev.race_master_id = tgt.race_master_id
+                AND prev.race_event_id <> tgt.race_event_id
+                AND prev.race_date < %s
+            LEFT JOIN race_definition_history d
+                ON d.race_master_id = tgt.race_master_id
+                AND YEAR(%s) BETWEEN COALESCE(d.start_year, 0) AND COALESCE(d.end_year, 9999)
+            WHERE tgt.race_event_id = %s
+              AND (d.def_id IS NULL OR prev.race_year BETWEEN COALESCE(d.start_year, 0) AND COALESCE(d.end_year, 9999))
+            ORDER BY prev.race_date DESC
+            LIMIT %s
+        """, (target_date, target_date, target_race_id, limit_years))
+        rows = cursor.fetchall()
+        event_ids = [row["race_event_id"] if isinstance(row, dict) else row[0] for row in rows]
+        return event_ids
+
+    @staticmethod
+    def _has_form_snapshot(cursor) -> bool:
+        """horse_form_snapshot が存在するかを1回だけ確認する（無ければ直近5走は一括クエリで計算する）"""
+        if AnalyzerService.FORM_SNAPSHOT_AVAILABLE is None:
+            cursor.execute("""
+                SELECT COUNT(*) AS n FROM information_schema.tables
+                WHERE table_schema = DATABASE() AND table_name = 'horse_form_snapshot'
+            """)
+            row = cursor.fetchone()
+            available = (row["n"] if isinstance(row, dict) else row[0]) > 0
+            if not available:
+                print("[Analyzer] horse_form_snapshot not found. Computing recent form from race_result.")
+            AnalyzerService.FORM_SNAPSHOT_AVAILABLE = available
+        return AnalyzerService.FORM_SNAPSHOT_AVAILABLE
+
+    @staticmethod
+    def _snapshot_sql(cursor) -> Tuple[str, str]:
+        if not AnalyzerService.USE_FORM_SNAPSHOT or not AnalyzerService._has_form_snapshot(cursor):
+            return "", ""
+        return AnalyzerService.FORM_SNAPSHOT_COLUMNS, AnalyzerService.FORM_SNAPSHOT_JOIN
+
+    @staticmethod
+    def _fetch_history_rows(cursor, event_ids: List[str]) -> List[Dict[str, Any]]:
+        """過去開催の出走結果行を取得する（年の新しい順）"""
+        snapshot_columns, snapshot_join = AnalyzerService._snapshot_sql(cursor)
+        format_strings = ','.join(['%s'] * len(event_ids))
         query = f"""
             SELECT 
                 r.race_event_id, re.race_year, re.race_date,
                 r.horse_id, h.name, r.rank, r.frame, r.odds, r.popularity,
                 r.carried_weight, r.horse_weight, r.last_3f,
-                h.sex, h.birth_year, h.sire, h.dam, h.damsire
+                h.sex, h.birth_year, h.sire, h.dam, h.damsire{snapshot_columns}
             FROM race_result r
             JOIN race_event re ON r.race_event_id = re.race_event_id
-            JOIN horse h ON r.horse_id = h.horse_id
+            JOIN horse h ON r.horse_id = h.horse_id{snapshot_join}
             WHERE r.race_event_id IN ({format_strings})
             ORDER BY re.race_year DESC
         """
-        cursor.execute(query, tuple(target_event_ids))
-        rows = cursor.fetchall()
+        cursor.execute(query, tuple(event_ids))
+        return cursor.fetchall()
+
+    @staticmethod
+    def _build_history_races(cursor, rows: List[Dict[str, Any]],
+                             memo: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None) -> List[RaceData]:
+        """出走結果行を開催ごとの RaceData にまとめる（行の並び順を保持）"""
+        # 直近5走特徴量（レース日基準）: スナップショット参照＋未構築分のみ一括クエリ
+        recent_list = AnalyzerService._resolve_recent_features(
+            cursor, rows, lambda row: str(row["race_date"]) if row["race_date"] else None, memo
+        )
         
         # 年ごとにグルーピング
         races_dict = {}
-        for row in rows:
+        for row, recent_features in zip(rows, recent_list):
             rid = row["race_event_id"]
             if rid not in races_dict:
                 # race_year が DB上でNULLの場合は日付やIDの先頭から補完する
@@ -131,9 +310,6 @@ class AnalyzerService:
                     "results": []
                 }
             
-            # 直近5走特徴量抽出（レース日基準）
-            recent_features = AnalyzerService.get_recent_5_races(cursor, row["horse_id"], str(row["race_date"]))
-            
             # 生年からの年齢計算
             age = row["race_year"] - row["birth_year"] if row["birth_year"] else None
             
@@ -160,10 +336,66 @@ class AnalyzerService:
             )
             races_dict[rid]["results"].append(result)
             
+        return [RaceData(**v) for v in races_dict.values()]
+
+    @staticmethod
+    def get_historical_data(race_name_keyword: str="フェブラリー", limit_years: int=10) -> List[RaceData]:
+        """指定レースの過去履歴を取得する（RAGのRetrievalに相当）"""
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        target_event_ids = AnalyzerService.get_historical_event_ids(race_name_keyword, limit_years)
+        rows = AnalyzerService._fetch_history_rows(cursor, target_event_ids)
+        races = AnalyzerService._build_history_races(cursor, rows)
+            
         cursor.close()
         conn.close()
         
-        return [RaceData(**v) for v in races_dict.values()]
+        return races
+
+    @staticmethod
+    def _fetch_entry_rows(cursor, race_ids: List[str]) -> List[Dict[str, Any]]:
+        """対象レース（複数可）の出走馬行を取得する"""
+        snapshot_columns, snapshot_join = AnalyzerService._snapshot_sql(cursor)
+        format_strings = ','.join(['%s'] * len(race_ids))
+        query = f"""
+            SELECT 
+                r.race_event_id, r.horse_id, h.name, r.rank, r.frame, r.odds, r.popularity,
+                r.carried_weight, r.horse_weight, r.last_3f,
+                h.sex, h.birth_year, h.sire, h.dam, h.damsire{snapshot_columns}
+            FROM race_result r
+            JOIN horse h ON r.horse_id = h.horse_id{snapshot_join}
+            WHERE r.race_event_id IN ({format_strings})
+        """
+        cursor.execute(query, tuple(race_ids))
+        return cursor.fetchall()
+
+    @staticmethod
+    def _build_entry(row: Dict[str, Any], recent_features: Dict[str, Any]) -> HorseBaseResult:
+        # 現在は仮で2026年想定
+        age = 2026 - row["birth_year"] if row["birth_year"] else None
+        
+        return HorseBaseResult(
+            race_event_id=row["race_event_id"],
+            horse_id=row["horse_id"],
+            name=row["name"],
+            rank=row["rank"],
+            frame=row["frame"],
+            odds=row["odds"],
+            popularity=row["popularity"],
+            carried_weight=float(row["carried_weight"]) if row["carried_weight"] else None,
+            horse_weight=row["horse_weight"],
+            last_3f=row["last_3f"],
+            sex=row["sex"],
+            birth_year=row["birth_year"],
+            sire=row["sire"],
+            dam=row["dam"],
+            damsire=row["damsire"],
+            age_at_race=age,
+            horse_weight_bin=AnalyzerService._bin_horse_weight(row["horse_weight"]),
+            last_3f_bin=AnalyzerService._bin_last_3f(row["last_3f"]),
+            **recent_features
+        )
         
     @staticmethod
     def get_current_entries(target_race_id: str, target_date: str) -> List[HorseBaseResult]:
@@ -171,52 +403,29 @@ class AnalyzerService:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         # 今回のフェブラリーS用パッチで挿入した枠番等を使用する場合、対象レースIDを直接引く
-        query = """
-            SELECT 
-                r.race_event_id, r.horse_id, h.name, r.rank, r.frame, r.odds, r.popularity,
-                r.carried_weight, r.horse_weight, r.last_3f,
-                h.sex, h.birth_year, h.sire, h.dam, h.damsire
-            FROM race_result r
-            JOIN horse h ON r.horse_id = h.horse_id
-            WHERE r.race_event_id = %s
-        """
-        cursor.execute(query, (target_race_id,))
-        rows = cursor.fetchall()
+        rows = AnalyzerService._fetch_entry_rows(cursor, [target_race_id])
         
-        results = []
-        for row in rows:
-            # 今年のターゲット日付未満の5走
-            recent_features = AnalyzerService.get_recent_5_races(cursor, row["horse_id"], target_date)
-            # 現在は仮で2026年想定
-            age = 2026 - row["birth_year"] if row["birth_year"] else None
-            
-            result = HorseBaseResult(
-                race_event_id=row["race_event_id"],
-                horse_id=row["horse_id"],
-                name=row["name"],
-                rank=row["rank"],
-                frame=row["frame"],
-                odds=row["odds"],
-                popularity=row["popularity"],
-                carried_weight=float(row["carried_weight"]) if row["carried_weight"] else None,
-                horse_weight=row["horse_weight"],
-                last_3f=row["last_3f"],
-                sex=row["sex"],
-                birth_year=row["birth_year"],
-                sire=row["sire"],
-                dam=row["dam"],
-                damsire=row["damsire"],
-                age_at_race=age,
-                horse_weight_bin=AnalyzerService._bin_horse_weight(row["horse_weight"]),
-                last_3f_bin=AnalyzerService._bin_last_3f(row["last_3f"]),
-                **recent_features
-            )
-            results.append(result)
+        # 今年のターゲット日付未満の5走: スナップショット参照＋未構築分のみ一括クエリ
+        recent_list = AnalyzerService._resolve_recent_features(cursor, rows, lambda row: target_date)
+        results = [AnalyzerService._build_entry(row, recent) for row, recent in zip(rows, recent_list)]
             
         cursor.close()
         conn.close()
         return results
 
+    @staticmethod
+    def build_batch_scopes(targets: List[Tuple[str, str]], limit_years: int=10) -> Dict[Tuple[str, str], AnalysisScope]:
+        """
+        複数レース分の分析スコープをまとめて構築する（週末の重賞一括分析など）。
+        各レースの系譜を解決した上で、過去開催・出走馬・直近5走はレース横断の一括クエリで1回ずつ読み込む。
+        ※ 一時的な AnalysisContext で読み込み、スコープ構築後に解放する。
+        戻り値は (race_event_id, target_date) -> AnalysisScope。
+        """
+        # analysis_context は AnalyzerService を参照するため、循環importを避けてここで読み込む
+        from src.api.services.analysis_context import AnalysisContext
+        with AnalysisContext(limit_years) as context:
+            return context.scopes(targets)
+
     @staticmethod
     def build_analysis_scope(target_race_id: str, target_date: str) -> AnalysisScope:
         historical = AnalyzerService.get_historical_data()
@@ -0,0 +1,211 @@
+import time
+from typing import List, Dict, Any, Optional, Sequence
+import numpy as np
+from src.api.core.database import get_db_connection
+from src.api.core.models import HorseBaseResult, RaceData
+from src.api.core.columnar import ColumnarFrame
+from src.api.services.analyzer import AnalyzerService
+from src.api.services.inference import InferenceService
+from src.api.services.condition_counts import ConditionCountTable
+from src.api.services.scoring import ScoringModel
+
+
+class BacktestService:
+    """
+    ローリングオリジン方式のバックテスト（フェーズD: 予想と結果の照合）。
+    系譜（race_master）ごとに開催を古い順にたどり、各開催についてそれより前の開催だけを過去スコープとして
+    推論 → 実際の出走馬（当日時点の直近5走特徴量）をスコアリング → 着順・単勝オッズと照合する。
+    ※ 条件別・年別件数表（ConditionCountTable）を系譜ごとに1つだけ持ち、開催を1つ進めるたびに
+       その開催の追加（と窓から外れた最古年の除外）だけを差分更新する（foldごとの再集計なし）。
+    ※ DBに払戻は保持していないため、回収率は確定単勝オッズによる単勝ベタ買い（1点100円）で算出する。
+    """
+
+    # 推論に使う過去開催数（分析スコープと同じ過去10年）
+    LIMIT_YEARS = 10
+    # 過去開催がこの数に満たない開催は評価しない
+    MIN_HISTORY_YEARS = 3
+    # 系譜を自動解決する場合の対象グレード
+    DEFAULT_GRADES = ("G1", "G2", "G3")
+    # レース後にしか分からない項目。出馬表（/api/analyze）には無いため、スコアリング前に消してから評価する
+    # （走破タイム・通過順は HorseBaseResult に持たないため対象外）
+    RESULT_FIELDS = ("rank", "last_3f", "last_3f_bin")
+
+    @staticmethod
+    def resolve_lineages(cursor, race_master_ids: Optional[Sequence[str]] = None,
+                         grades: Sequence[str] = DEFAULT_GRADES) -> Dict[str, List[str]]:
+        """
+        バックテスト対象の系譜 → 開催ID（古い順）を返す。
+        race_master_ids 指定時はその系譜のみ、未指定時は対象グレードの全系譜。
+        ※ race_master 未紐付け（UNKNOWN等）の開催は系譜が分からないため対象外（該当がなければ空）。
+        """
+        if race_master_ids:
+            condition = f"re.race_master_id IN ({','.join(['%s'] * len(race_master_ids))})"
+            params = tuple(race_master_ids)
+        else:
+            condition = f"rm.grade IN ({','.join(['%s'] * len(grades))})"
+            params = tuple(grades)
+        cursor.execute(f"""
+            SELECT re.race_master_id, re.race_event_id
+            FROM race_event re
+            JOIN race_master rm ON rm.race_master_id = re.race_master_id
+            WHERE {condition}
+              AND re.race_master_id NOT IN ('UNKNOWN', 'UNKNOWN_MASTER')
+            ORDER BY re.race_master_id, re.race_date, re.race_event_id
+        """, params)
+
+        lineages: Dict[str, List[str]] = {}
+        for row in cursor.fetchall():
+            master_id, event_id = (row["race_master_id"], row["race_event_id"]) if isinstance(row, dict) else row
+            lineages.setdefault(master_id, []).append(event_id)
+        return lineages
+
+    @staticmethod
+    def load_races(cursor, event_ids: List[str]) -> Dict[str, RaceData]:
+        """全系譜の開催結果を1回の一括クエリで読み込む（直近5走は各開催日基準）"""
+        if not event_ids:
+            return {}
+        rows = AnalyzerService._fetch_history_rows(cursor, event_ids)
+        return {race.race_event_id: race for race in AnalyzerService._build_history_races(cursor, rows)}
+
+    @staticmethod
+    def run_lineage(races: List[RaceData], condition_stats: Dict[str, Dict[str, Any]],
+                    limit_years: int = LIMIT_YEARS, min_history_years: int = MIN_HISTORY_YEARS) -> List[Dict[str, Any]]:
+        """
+        1系譜分のバックテスト。races は開催の古い順。
+        condition_stats（条件 key → 集計）に採用条件ごとの成績を加算し、開催ごとの評価結果（fold）を返す。
+        """
+        table = ConditionCountTable()
+        window: List[str] = []
+        folds = []
+        for race in races:
+            if len(window) >= min_history_years:
+                adopted = InferenceService.run_inference_from_counts(table)["adopted_conditions"]
+                folds.append(BacktestService.evaluate_fold(race, adopted, len(window), condition_stats))
+
+            # 評価後にこの開催を過去スコープへ追加し、窓から外れた最古の開催を除く
+            table.upsert_race(race)
+            window.append(race.race_event_id)
+            if len(window) > limit_years:
+                table.remove_race(window.pop(0))
+        return folds
+
+    @staticmethod
+    def pre_race_entries(race: RaceData) -> List[HorseBaseResult]:
+        """開催の出走馬から結果項目を除き、出馬表と同じ情報だけにする"""
+        cleared = {f: None for f in BacktestService.RESULT_FIELDS}
+        return [h.model_copy(update=cleared) for h in race.results]
+
+    @staticmethod
+    def evaluate_fold(race: RaceData, adopted: List[Dict[str, Any]], history_years: int,
+                      condition_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """1開催分: 実際の出走馬をレース前の情報だけでスコアリングし、着順と照合する"""
+        entries = ColumnarFrame.from_entries(BacktestService.pre_race_entries(race))
+        # 着順・オッズは照合（採点）にだけ使う
+        frame = ColumnarFrame.from_entries(race.results)
+        model = ScoringModel(adopted)
+        scored = model.score(entries)
+
+        rank = np.nan_to_num(frame.num("rank"), nan=0.0)
+        odds = np.nan_to_num(frame.num("odds"), nan=0.0)
+        top3 = frame.top3
+        win = rank == 1
+
+        # 採用条件ごと: 該当馬への単勝ベタ買いとして件数・3着内・1着・払戻を加算する
+        matrix = model.match_matrix(entries)
+        n_bets = matrix.sum(axis=0)
+        n_top3 = (matrix & top3[:, None]).sum(axis=0)
+        n_win = (matrix & win[:, None]).sum(axis=0)
+        returns = (matrix * np.where(win, odds, 0.0)[:, None]).sum(axis=0)
+        for j, ac in enumerate(adopted):
+            if not n_bets[j]:
+                continue
+            stats = condition_stats.setdefault(ac["key"], {
+                "key": ac["key"], "name": ac["name"], "folds_adopted": 0,
+                "n_bets": 0, "n_top3": 0, "n_win": 0, "return": 0.0
+            })
+            stats["folds_adopted"] += 1
+            stats["n_bets"] += int(n_bets[j])
+            stats["n_top3"] += int(n_top3[j])
+            stats["n_win"] += int(n_win[j])
+            stats["return"] += float(returns[j])
+
+        rank_of = dict(zip(frame.horse_ids, rank.tolist()))
+        odds_of = dict(zip(frame.horse_ids, odds.tolist()))
+        top_pick = scored[0] if scored else None
+        predicted_top3 = [h["horse_id"] for h in scored[:3]]
+        return {
+            "race_event_id": race.race_event_id,
+            "year": race.year,
+            "history_years": history_years,
+            "adopted_count": len(adopted),
+            "field_size": len(frame),
+            "top_pick": {
+                "horse_id": top_pick["horse_id"],
+                "name": top_pick["name"],
+                "rank": int(rank_of[top_pick["horse_id"]]),
+                "odds": odds_of[top_pick["horse_id"]],
+            } if top_pick else None,
+            "top3_hits": sum(1 for hid in predicted_top3 if 1 <= rank_of[hid] <= 3),
+        }
+
+    @staticmethod
+    def summarize(folds: List[Dict[str, Any]], condition_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """開催全体の的中率・回収率と、条件別の的中率（3着内率）・回収率をまとめる"""
+        picks = [f["top_pick"] for f in folds if f["top_pick"]]
+        n_picks = len(picks)
+        conditions = []
+        for stats in condition_stats.values():
+            conditions.append(dict(
+                stats,
+                hit_rate=stats["n_top3"] / stats["n_bets"],
+                win_rate=stats["n_win"] / stats["n_bets"],
+                roi=stats["return"] / stats["n_bets"],
+            ))
+        # 的中率（3着内率）優先、次点で回収率
+        conditions.sort(key=lambda c: (c["hit_rate"], c["roi"], c["n_bets"]), reverse=True)
+        return {
+            "folds_evaluated": len(folds),
+            "top_pick_hit_rate": sum(1 for p in picks if 1 <= p["rank"] <= 3) / n_picks if n_picks else 0.0,
+            "top_pick_win_rate": sum(1 for p in picks if p["rank"] == 1) / n_picks if n_picks else 0.0,
+            "top_pick_roi": sum(p["odds"] for p in picks if p["rank"] == 1) / n_picks if n_picks else 0.0,
+            "top3_precision": sum(f["top3_hits"] for f in folds) / (3 * len(folds)) if folds else 0.0,
+            "conditions": conditions,
+        }
+
+    @staticmethod
+    def run(race_master_ids: Optional[Sequence[str]] = None, grades: Sequence[str] = DEFAULT_GRADES,
+            limit_years: int = LIMIT_YEARS, min_history_years: int = MIN_HISTORY_YEARS,
+            lineages: Optional[Dict[str, Sequence[str]]] = None) -> Dict[str, Any]:
+        """
+        系譜の解決・一括読み込み・系譜ごとのローリング評価・集計をまとめて行う。
+        lineages（系譜名 → 開催ID（古い順））を渡した場合は系譜を解決せず、その開催をそのまま評価する
+        （race_master 未紐付けの開催を評価する場合など）。
+        """
+        started = time.time()
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if lineages is None:
+                lineages = BacktestService.resolve_lineages(cursor, race_master_ids, grades)
+            lineages = {master_id: list(ids) for master_id, ids in lineages.items()}
+            races_by_id = BacktestService.load_races(
+                cursor, [eid for ids in lineages.values() for eid in ids]
+            )
+        finally:
+            cursor.close()
+            conn.close()
+        loaded = time.time()
+
+        condition_stats: Dict[str, Dict[str, Any]] = {}
+        folds = []
+        for master_id, event_ids in lineages.items():
+            races = [races_by_id[eid] for eid in event_ids if eid in races_by_id]
+            for fold in BacktestService.run_lineage(races, condition_stats, limit_years, min_history_years):
+                fold["race_master_id"] = master_id
+                folds.append(fold)
+
+        report = BacktestService.summarize(folds, condition_stats)
+        report["lineages"] = len(lineages)
+        report["folds"] = folds
+        report["timings"] = {"load": loaded - started, "evaluate": time.time() - loaded}
+        return report
@@ -0,0 +1,167 @@
+import json
+import hashlib
+import threading
+from typing import List, Dict, Any, Tuple
+import numpy as np
+from src.api.core.columnar import ColumnarFrame
+
+
+class Condition:
+    """単条件または複合条件を表現するクラス"""
+    def __init__(self, key: str, name: str, evaluator: callable, group: str, vector_evaluator: callable = None):
+        self.key = key          # 例: "frame_1"
+        self.name = name        # 例: "1枠"
+        self.evaluator = evaluator # 馬のデータ(HorseBaseResult)を受け取りboolを返す関数
+        self.group = group      # 独立性を担保するためのグループ名(例: "frame", "popularity")
+        # 列表現(ColumnarFrame)を受け取り、全馬分のbool配列を返す関数
+        self.vector_evaluator = vector_evaluator
+
+    def evaluate_frame(self, frame: ColumnarFrame) -> np.ndarray:
+        """全馬分の該当フラグを返す（ベクトル版が無い条件は1頭ずつ評価できないため例外）"""
+        if self.vector_evaluator is None:
+            raise ValueError(f"条件 {self.key} には列表現用の評価関数が定義されていません。")
+        return np.asarray(self.vector_evaluator(frame), dtype=bool)
+
+
+def _spec(key: str, name: str, group: str, field: str, op: str, value: Any) -> Dict[str, Any]:
+    return {"key": key, "name": name, "group": group, "field": field, "op": op, "value": value}
+
+# 単条件カタログの宣言的定義
+# op: eq（一致） / between（lo <= 値 <= hi、0・欠損は対象外） / ge（値 >= 下限、0・欠損は対象外） / in（カテゴリ一致） / flag（真偽値）
+CONDITION_SPECS: List[Dict[str, Any]] = [
+    # 1. 枠 (1-8)
+    *[_spec(f"frame_{i}", f"{i}枠", "frame", "frame", "eq", i) for i in range(1, 9)],
+
+    # 2. 人気帯 (1, 2-3, 4-6, 7+)
+    _spec("pop_1", "1番人気", "popularity", "popularity", "between", [1, 1]),
+    _spec("pop_2_3", "2-3番人気", "popularity", "popularity", "between", [2, 3]),
+    _spec("pop_4_6", "4-6番人気", "popularity", "popularity", "between", [4, 6]),
+    _spec("pop_7_over", "7番人気以下", "popularity", "popularity", "ge", 7),
+
+    # 3. オッズ帯 (<=3.9, 4.0-9.9, 10-19.9, 20+)
+    _spec("odds_under_3.9", "オッズ3.9倍以下", "odds", "odds", "between", [0, 3.9]),
+    _spec("odds_4_9.9", "オッズ4.0-9.9倍", "odds", "odds", "between", [4.0, 9.9]),
+    _spec("odds_10_19.9", "オッズ10.0-19.9倍", "odds", "odds", "between", [10.0, 19.9]),
+    _spec("odds_20_over", "オッズ20倍以上", "odds", "odds", "ge", 20.0),
+
+    # 4. 馬体重帯
+    *[_spec(f"weight_{wb}", f"馬体重{wb}", "horse_weight", "horse_weight_bin", "in", [wb])
+      for wb in ["<440", "440-459", "460-479", "480-499", "500-519", "520-539", "540+"]],
+
+    # 5. 上がり3F順位帯
+    *[_spec(f"last3f_{lb}", f"上がり3F {lb}位", "last_3f", "last_3f_bin", "in", [lb]) for lb in ["1-3", "4-6", "7+"]],
+
+    # 6. 馬齢
+    _spec("age_4", "4歳", "age", "age_at_race", "eq", 4),
+    _spec("age_5", "5歳", "age", "age_at_race", "eq", 5),
+    _spec("age_6", "6歳", "age", "age_at_race", "eq", 6),
+    _spec("age_7_over", "7歳以上", "age", "age_at_race", "ge", 7),
+
+    # 7. 性別
+    _spec("sex_male", "牡馬", "sex", "sex", "in", ["牡"]),
+    _spec("sex_female", "牝馬", "sex", "sex", "in", ["牝"]),
+    _spec("sex_gelding", "セ", "sex", "sex", "in", ["セ"]),
+
+    # 8. 直近5走: 最高格
+    _spec("recent_g1", "近5走にG1出走あり", "recent_grade", "recent_highest_grade", "in", ["G1"]),
+    _spec("recent_g2_g3", "近5走最高がG2/G3", "recent_grade", "recent_highest_grade", "in", ["G2", "G3"]),
+    _spec("recent_op", "近5走最高がOP", "recent_grade", "recent_highest_grade", "in", ["OP"]),
+
+    # 9. 直近5走: 3着内回数
+    _spec("recent_top3_0", "近5走3着内なし", "recent_top3", "recent_top3_count", "eq", 0),
+    _spec("recent_top3_1", "近5走3着内1回", "recent_top3", "recent_top3_count", "eq", 1),
+    _spec("recent_top3_2", "近5走3着内2回", "recent_top3", "recent_top3_count", "eq", 2),
+    _spec("recent_top3_3_over", "近5走3着内3回以上", "recent_top3", "recent_top3_count", "ge", 3),
+
+    # 10. 直近5走: 各種経験
+    _spec("exp_dirt_1600", "近5走ダ1600経験あり", "exp_dist", "has_dirt_1600_exp", "flag", None),
+    _spec("exp_tokyo", "近5走東京経験あり", "exp_course", "has_tokyo_exp", "flag", None),
+
+    # 血統等はパッチ完了後に母数が揃ってから拡張可能（今回は設計に準拠した基本セットを全実装）
+]
+
+
+def _compile_spec(spec: Dict[str, Any]) -> Condition:
+    """宣言的定義を、1頭用の判定関数と列表現用のベクトル判定関数に変換する"""
+    field, op, value = spec["field"], spec["op"], spec["value"]
+    if op == "eq":
+        row = lambda h: getattr(h, field) == value
+        vector = lambda f: f.num(field) == value
+    elif op == "between":
+        lo, hi = value
+        row = lambda h: bool(getattr(h, field)) and lo <= getattr(h, field) <= hi
+        vector = lambda f: f.between(field, lo, hi)
+    elif op == "ge":
+        row = lambda h: bool(getattr(h, field)) and getattr(h, field) >= value
+        vector = lambda f: f.num(field) >= value
+    elif op == "in":
+        values = tuple(value)
+        row = lambda h: getattr(h, field) in values
+        vector = lambda f: f.isin(field, values)
+    elif op == "flag":
+        row = lambda h: bool(getattr(h, field))
+        vector = lambda f: f.flag(field)
+    else:
+        raise ValueError(f"条件 {spec['key']} の演算子 {op} は未対応です。")
+    return Condition(spec["key"], spec["name"], row, spec["group"], vector)
+
+
+class ConditionCatalogue:
+    """
+    宣言的定義をコンパイル済みの単条件群として保持するカタログ（インポート時に1回だけ構築する）。
+    key → 単条件の索引と、複合条件 key（"A_AND_B"）の解決をスコアリング・検証で共有する。
+    """
+
+    COMPOSITE_SEPARATOR = "_AND_"
+
+    def __init__(self, specs: List[Dict[str, Any]]):
+        self.specs = specs
+        self.conditions: List[Condition] = [_compile_spec(spec) for spec in specs]
+        self.index: Dict[str, Condition] = {}
+        for cond in self.conditions:
+            if cond.key in self.index:
+                raise ValueError(f"条件カタログの key が重複しています: {cond.key}")
+            if self.COMPOSITE_SEPARATOR in cond.key:
+                raise ValueError(f"単条件の key に {self.COMPOSITE_SEPARATOR} は使えません: {cond.key}")
+            self.index[cond.key] = cond
+        # 単条件 key → 判定に使う列名（what-if で差し替えた列に依存する条件の特定に使う）
+        self.fields: Dict[str, str] = {spec["key"]: spec["field"] for spec in specs}
+        # 定義内容から決まるバージョン（定義を変えれば自動的に変わる）
+        canonical = json.dumps(specs, ensure_ascii=False, sort_keys=True)
+        self.version = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+        self._resolved: Dict[str, Tuple[Condition, ...]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.conditions)
+
+    def split_key(self, key: str) -> List[str]:
+        """条件 key を構成する単条件 key に分解する（単条件なら1要素）"""
+        return key.split(self.COMPOSITE_SEPARATOR)
+
+    def resolve(self, key: str) -> Tuple[Condition, ...]:
+        """
+        条件 key（単条件・複合条件）を構成する単条件を返す。
+        カタログにない単条件を含む場合は KeyError。
+        """
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = tuple(self.index[part] for part in self.split_key(key))
+            with self._lock:
+                self._resolved[key] = resolved
+        return resolved
+
+    def evaluate(self, key: str, frame: ColumnarFrame) -> np.ndarray:
+        """条件 key の該当フラグを全馬分返す（複合条件は単条件マスクのAND。単条件マスクはフレームごとに再利用）"""
+        mask = None
+        for cond in self.resolve(key):
+            part = frame.condition_masks.get(cond.key)
+            if part is None:
+                part = cond.evaluate_frame(frame)
+                frame.condition_masks[cond.key] = part
+            mask = part if mask is None else mask & part
+        return mask
+
+
+# インポート時にコンパイルし、以降のリクエストでは再構築しない
+CATALOGUE = ConditionCatalogue(CONDITION_SPECS)
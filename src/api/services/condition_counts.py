@@ -0,0 +1,224 @@
+import threading
+import warnings
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Sequence, Optional
+import numpy as np
+from src.api.core.models import RaceData
+from src.api.core.columnar import ColumnarFrame
+from src.api.services.condition_matrix import ConditionMatrix
+from src.api.services.condition_catalogue import CATALOGUE
+
+
+class ConditionCountTable:
+    """
+    条件ペア（対角成分は単条件）ごとの年別「該当数・3着内数」を、過去レース（race_event_id）単位で保持する件数表。
+    新しい年の結果の追加や過去年の修正は、そのレースの件数だけを差し替えて
+    n_all / n_top3 / 出現年数 / 年別3着内率の中央値 を条件数に比例する計算量で更新する（全履歴の再走査なし）。
+    ※ 採用条件はこの件数表から ConditionMatrix.collect_results で再導出する（一括計算と同じ結果になる）。
+    """
+
+    def __init__(self):
+        # 判定関数（lambda）は保持せず key のみ持つ（プロセスプールから pickle で受け渡すため）
+        self.keys = [c.key for c in CATALOGUE.conditions]
+        self.names = [c.name for c in CATALOGUE.conditions]
+        self.groups = [c.group for c in CATALOGUE.conditions]
+        n_cond = len(self.keys)
+
+        # race_event_id → 件数表のスロット番号 / そのレースを取り込んだ時点のデータ版数
+        self.slots: Dict[str, int] = {}
+        self.revisions: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+
+        # スロットごとの年別件数・3着内率（空きスロットは件数0・率NaN）
+        self.year_all = np.zeros((0, n_cond, n_cond), dtype=np.int64)
+        self.year_top3 = np.zeros((0, n_cond, n_cond), dtype=np.int64)
+        self.year_rates = np.zeros((0, n_cond, n_cond), dtype=np.float64)
+
+        # 全年合計（差分で更新する）
+        self.n_all = np.zeros((n_cond, n_cond), dtype=np.int64)
+        self.n_top3 = np.zeros((n_cond, n_cond), dtype=np.int64)
+        self.years_appeared = np.zeros((n_cond, n_cond), dtype=np.int64)
+        self.median_rate = np.zeros((n_cond, n_cond), dtype=np.float64)
+
+    @classmethod
+    def from_history(cls, history: Any, revisions: Optional[Dict[str, int]] = None) -> "ConditionCountTable":
+        """過去レース群（RaceData のリストまたは列表現）から件数表を一括で構築する"""
+        frame = history if isinstance(history, ColumnarFrame) else ColumnarFrame.from_history(history)
+        table = cls()
+        counts_all, counts_top3 = ConditionMatrix(table.conditions, frame).yearly_pair_counts()
+        table._grow(frame.n_years)
+        for y, race_event_id in enumerate(frame.race_event_ids):
+            table.slots[race_event_id] = y
+            table.revisions[race_event_id] = (revisions or {}).get(race_event_id, 0)
+        table.year_all[:frame.n_years] = counts_all
+        table.year_top3[:frame.n_years] = counts_top3
+        table.year_rates[:frame.n_years] = cls._rates(counts_all, counts_top3)
+
+        summary = ConditionMatrix.summarize(counts_all, counts_top3)
+        table.n_all = summary["n_all"]
+        table.n_top3 = summary["n_top3"]
+        table.years_appeared = summary["years_appeared"]
+        table.median_rate = summary["median_rate"]
+        return table
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def conditions(self) -> List[Any]:
+        return [CATALOGUE.index[key] for key in self.keys]
+
+    @property
+    def race_event_ids(self) -> List[str]:
+        return sorted(self.slots)
+
+    def copy(self) -> "ConditionCountTable":
+        """同じ件数表の独立したコピー（他スコープ向けに差分更新する前に使う）"""
+        table = ConditionCountTable.__new__(ConditionCountTable)
+        table.keys, table.names, table.groups = self.keys, self.names, self.groups
+        table.slots = dict(self.slots)
+        table.revisions = dict(self.revisions)
+        table._free_slots = list(self._free_slots)
+        for name in ("year_all", "year_top3", "year_rates", "n_all", "n_top3", "years_appeared", "median_rate"):
+            setattr(table, name, getattr(self, name).copy())
+        return table
+
+    def upsert_race(self, race: RaceData, revision: int = 0):
+        """1レース（1年）分の結果を追加、または既存の件数を置き換える"""
+        frame = ColumnarFrame.from_history([race])
+        counts_all, counts_top3 = ConditionMatrix(self.conditions, frame).yearly_pair_counts()
+        slot = self.slots.get(race.race_event_id)
+        if slot is None:
+            slot = self._allocate_slot()
+            self.slots[race.race_event_id] = slot
+        self.revisions[race.race_event_id] = revision
+        self._apply(slot, counts_all[0], counts_top3[0])
+
+    def remove_race(self, race_event_id: str):
+        """スコープから外れたレースの件数を取り除く"""
+        slot = self.slots.pop(race_event_id)
+        self.revisions.pop(race_event_id, None)
+        zeros = np.zeros_like(self.n_all)
+        self._apply(slot, zeros, zeros)
+        self._free_slots.append(slot)
+
+    def sync(self, history: List[RaceData], revisions: Dict[str, int]) -> Tuple[List[str], List[str]]:
+        """
+        件数表を過去スコープに合わせる。
+        未取り込み・版数が変わったレースだけを upsert し、スコープ外のレースは取り除く。
+        戻り値は (更新したレースID, 取り除いたレースID)。
+        """
+        wanted = {race.race_event_id for race in history}
+        removed = [rid for rid in self.race_event_ids if rid not in wanted]
+        for rid in removed:
+            self.remove_race(rid)
+
+        updated = []
+        for race in history:
+            revision = revisions.get(race.race_event_id, 0)
+            if race.race_event_id not in self.slots or self.revisions.get(race.race_event_id) != revision:
+                self.upsert_race(race, revision)
+                updated.append(race.race_event_id)
+        return updated, removed
+
+    def summary(self) -> Dict[str, np.ndarray]:
+        """ConditionMatrix.summarize と同じ形式の集計表"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate_3in = np.where(self.n_all > 0, self.n_top3 / self.n_all, 0.0)
+        return {
+            "n_all": self.n_all,
+            "n_top3": self.n_top3,
+            "rate_3in": rate_3in,
+            "median_rate": self.median_rate,
+            "years_appeared": self.years_appeared,
+        }
+
+    def collect_results(self, min_count: int, exclusive_groups: Sequence[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """件数表から単条件・複合条件の統計を列挙する（ConditionMatrix.search_pairs と同じ並び）"""
+        return ConditionMatrix.collect_results(
+            self.summary(), self.keys, self.names, self.groups, min_count, exclusive_groups
+        )
+
+    @staticmethod
+    def _rates(counts_all: np.ndarray, counts_top3: np.ndarray) -> np.ndarray:
+        # 該当馬がいない年は中央値の計算から除外する（NaN扱い）
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(counts_all > 0, counts_top3 / counts_all, np.nan)
+
+    def _grow(self, capacity: int):
+        n_slots = self.year_all.shape[0]
+        if capacity <= n_slots:
+            return
+        extra = capacity - n_slots
+        shape = (extra,) + self.n_all.shape
+        self.year_all = np.concatenate([self.year_all, np.zeros(shape, dtype=np.int64)])
+        self.year_top3 = np.concatenate([self.year_top3, np.zeros(shape, dtype=np.int64)])
+        self.year_rates = np.concatenate([self.year_rates, np.full(shape, np.nan)])
+
+    def _allocate_slot(self) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        slot = self.year_all.shape[0]
+        # 1年ずつ追加されるのが通常のため、倍々で確保して再確保の回数を抑える
+        self._grow(max(slot + 1, slot * 2))
+        self._free_slots.extend(range(self.year_all.shape[0] - 1, slot, -1))
+        return slot
+
+    def _apply(self, slot: int, new_all: np.ndarray, new_top3: np.ndarray):
+        """スロットの件数を差し替え、合計・出現年数は差分で、中央値は値が変わり得るセルのみ再計算する"""
+        old_all = self.year_all[slot]
+        old_top3 = self.year_top3[slot]
+        self.n_all += new_all - old_all
+        self.n_top3 += new_top3 - old_top3
+        self.years_appeared += (new_all > 0).astype(np.int64) - (old_all > 0)
+
+        # 旧・新いずれかで該当馬がいたセルのみ、その年の率が変わる
+        changed = (old_all > 0) | (new_all > 0)
+        self.year_all[slot] = new_all
+        self.year_top3[slot] = new_top3
+        self.year_rates[slot] = self._rates(new_all, new_top3)
+
+        if changed.any():
+            with warnings.catch_warnings():
+                # 全年で該当なし（All-NaN）の条件は中央値0.0とする
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                median = np.nanmedian(self.year_rates[:, changed], axis=0)
+            self.median_rate[changed] = np.nan_to_num(median, nan=0.0)
+
+
+class ConditionCountStore:
+    """
+    過去スコープごとの件数表を保持するプロセス内LRU。
+    新しいスコープの推論では、取り込み済みレースの重なりが最も大きい件数表を複製して差分更新する。
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._tables: "OrderedDict[frozenset, ConditionCountTable]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def nearest(self, race_event_ids: List[str]) -> Optional[ConditionCountTable]:
+        """スコープと重なるレースが最も多い件数表のコピーを返す（重なりがなければ None）"""
+        wanted = set(race_event_ids)
+        with self._lock:
+            best, best_overlap = None, 0
+            for key, table in self._tables.items():
+                overlap = len(wanted & key)
+                if overlap > best_overlap:
+                    best, best_overlap = key, overlap
+            if best is None:
+                return None
+            self._tables.move_to_end(best)
+            return self._tables[best].copy()
+
+    def remember(self, table: ConditionCountTable):
+        key = frozenset(table.slots)
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.max_entries:
+                self._tables.popitem(last=False)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._tables), "max_entries": self.max_entries}
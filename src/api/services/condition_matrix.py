@@ -0,0 +1,149 @@
+import warnings
+from typing import List, Dict, Any, Tuple, Sequence, Optional
+import numpy as np
+from src.api.core.columnar import ColumnarFrame
+
+
+class ConditionMatrix:
+    """
+    単条件ごとの該当フラグを「条件 x 出走馬」のbool行列として一度だけ計算し、
+    複合条件（2条件AND）の母数・3着内数を年別にまとめて集計するためのエンジン。
+    ※ 複合条件の該当判定はビットAND、件数はpopcountに相当する行列積で求める。
+    """
+
+    def __init__(self, conditions: List[Any], frame: ColumnarFrame):
+        self.conditions = conditions
+        self.n_years = frame.n_years
+        # 各馬がどの年（history上のレース）に属するか
+        self.year_idx = frame.year_idx
+        self.top3 = frame.top3
+
+        # 単条件の評価は列表現に対するベクトル演算で1回のみ
+        self.masks = np.zeros((len(conditions), len(frame)), dtype=bool)
+        for i, cond in enumerate(conditions):
+            self.masks[i] = cond.evaluate_frame(frame)
+
+    @classmethod
+    def from_arrays(cls, masks: np.ndarray, year_idx: np.ndarray, top3: np.ndarray, n_years: int) -> "ConditionMatrix":
+        """評価済みの該当行列から復元する（並列探索のワーカー側で共有メモリ上の配列を使う場合）"""
+        matrix = cls.__new__(cls)
+        matrix.conditions = range(masks.shape[0])
+        matrix.n_years = n_years
+        matrix.year_idx = year_idx
+        matrix.top3 = top3
+        matrix.masks = masks
+        return matrix
+
+    def yearly_pair_counts(self, row_start: int = 0, row_end: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        年ごとに条件ペアの該当数・3着内数を数える。
+        戻り値はいずれも (年数 x 行側の条件数 x 条件数) の配列で、[row_start, row_end) の条件（行）と全条件（列）の組を数える。
+        範囲指定なしの場合は正方行列となり、対角成分は単条件の件数になる。
+        """
+        n_cond = len(self.conditions)
+        row_end = n_cond if row_end is None else row_end
+        counts_all = np.zeros((self.n_years, row_end - row_start, n_cond), dtype=np.int64)
+        counts_top3 = np.zeros((self.n_years, row_end - row_start, n_cond), dtype=np.int64)
+
+        # 0/1行列同士の積 = ANDのpopcount（float64のBLAS演算でも件数は厳密に整数）
+        m = self.masks.astype(np.float64)
+        for y in range(self.n_years):
+            cols = self.year_idx == y
+            m_y = m[:, cols]
+            rows_y = m_y[row_start:row_end]
+            counts_all[y] = np.rint(rows_y @ m_y.T)
+            counts_top3[y] = np.rint((rows_y * self.top3[cols]) @ m_y.T)
+        return counts_all, counts_top3
+
+    def search_pairs(self, keys: Sequence[str], names: Sequence[str], groups: Sequence[str],
+                     min_count: int, exclusive_groups: Sequence[str],
+                     row_start: int = 0, row_end: Optional[int] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        [row_start, row_end) の条件を起点に、単条件と複合条件（i < j の2条件AND）の統計を列挙する。
+        戻り値は (単条件の統計リスト, 複合条件の統計リスト) で、いずれも i→j の順（逐次探索と同じ順序）。
+        ※ 行範囲ごとに独立して計算できるため、並列探索ではこの単位でワーカーに分割する。
+        """
+        summary = self.summarize(*self.yearly_pair_counts(row_start, row_end))
+        return self.collect_results(summary, keys, names, groups, min_count, exclusive_groups, row_start)
+
+    @staticmethod
+    def collect_results(summary: Dict[str, np.ndarray], keys: Sequence[str], names: Sequence[str], groups: Sequence[str],
+                        min_count: int, exclusive_groups: Sequence[str],
+                        row_start: int = 0) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        集計表（summarize の結果。行は row_start からの条件、列は全条件）から単条件・複合条件の統計を列挙する。
+        ※ 年別件数表を差分更新している場合（ConditionCountTable）も同じ列挙・ガードレールを使う。
+        """
+        n_all = summary["n_all"]
+        row_end = row_start + n_all.shape[0]
+
+        atomic_results = []
+        for local_i in range(row_end - row_start):
+            i = row_start + local_i
+            # 母数が過少（例: 過去10年で3頭未満）のものは参考外として弾く
+            if n_all[local_i, i] >= min_count:
+                stats = ConditionMatrix.stats_at(summary, local_i, i, keys[i], names[i])
+                stats["is_composite"] = False
+                atomic_results.append(stats)
+
+        # 独立したGroupを持つ2つの条件の組み合わせのみ
+        group_arr = np.asarray(groups)
+        allowed = group_arr[row_start:row_end, None] != group_arr[None, :]
+        # 強い相関があるグループは複合させないガードレール（oddsとpopularity等）
+        exclusive = np.isin(group_arr, list(exclusive_groups))
+        allowed &= ~(exclusive[row_start:row_end, None] & exclusive[None, :])
+        allowed &= n_all >= min_count
+        # 上三角 (i < j) のみを i→j の順で走査（従来のペア生成順と一致）
+        pair_i, pair_j = np.nonzero(np.triu(allowed, k=row_start + 1))
+
+        composite_results = []
+        for local_i, j in zip(pair_i.tolist(), pair_j.tolist()):
+            i = row_start + local_i
+            comp_key = f"{keys[i]}_AND_{keys[j]}"
+            comp_name = f"{names[i]} ＋ {names[j]}"
+            stats = ConditionMatrix.stats_at(summary, local_i, j, comp_key, comp_name)
+            stats["is_composite"] = True
+            composite_results.append(stats)
+        return atomic_results, composite_results
+
+    @staticmethod
+    def summarize(counts_all: np.ndarray, counts_top3: np.ndarray) -> Dict[str, np.ndarray]:
+        """年別集計から n_all / n_top3 / 全期間3着内率 / 年別3着内率の中央値 / 出現年数 を算出する"""
+        n_all = counts_all.sum(axis=0)
+        n_top3 = counts_top3.sum(axis=0)
+
+        # 該当馬がいない年は中央値の計算から除外する（NaN扱い）
+        with np.errstate(divide="ignore", invalid="ignore"):
+            yearly_rates = np.where(counts_all > 0, counts_top3 / counts_all, np.nan)
+            rate_3in = np.where(n_all > 0, n_top3 / n_all, 0.0)
+
+        years_appeared = (counts_all > 0).sum(axis=0)
+        if counts_all.shape[0] > 0:
+            with warnings.catch_warnings():
+                # 全年で該当なし（All-NaN）の条件は中央値0.0とする
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                median_rate = np.nanmedian(yearly_rates, axis=0)
+            median_rate = np.nan_to_num(median_rate, nan=0.0)
+        else:
+            median_rate = np.zeros(n_all.shape)
+
+        return {
+            "n_all": n_all,
+            "n_top3": n_top3,
+            "rate_3in": rate_3in,
+            "median_rate": median_rate,
+            "years_appeared": years_appeared,
+        }
+
+    @staticmethod
+    def stats_at(summary: Dict[str, np.ndarray], i: int, j: int, key: str, name: str) -> Dict[str, Any]:
+        """集計表の (i, j) 成分を従来の条件統計dictの形式で取り出す"""
+        return {
+            "key": key,
+            "name": name,
+            "n_all": int(summary["n_all"][i, j]),
+            "n_top3": int(summary["n_top3"][i, j]),
+            "rate_3in": float(summary["rate_3in"][i, j]), # N_top3 / N_all 全期間プール
+            "median_rate": float(summary["median_rate"][i, j]),
+            "years_appeared": int(summary["years_appeared"][i, j])
+        }
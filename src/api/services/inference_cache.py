@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from src.api.core.database import get_db_connection
+
+
+class InferenceCache:
+    """
+    過去スコープ（race_event_id の集合）と条件カタログのバージョンをキーにした推論結果キャッシュ。
+    ※ 過去レースの結果は通常変化しないため、同一スコープの再分析では推論をスキップしてスコアリングに進める。
+    ※ 無効化はレース単位のデータ版数（race_data_revision。race_result へのトリガーで更新）で判定し、
+       スコープ内のレースに書き込みがあった場合のみ再計算する。
+    """
+
+    def __init__(self, catalogue_version: str, max_entries: int = None, persist: bool = None):
+        self.catalogue_version = catalogue_version
+        self.max_entries = max_entries or int(os.getenv("INFERENCE_CACHE_SIZE", "32"))
+        # 永続層（MySQLの inference_cache テーブル）を使うかどうか
+        if persist is None:
+            persist = os.getenv("INFERENCE_CACHE_PERSIST", "mysql") == "mysql"
+        self.persist = persist
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, race_event_ids: List[str]) -> str:
+        """スコープのレース集合（順不同）とカタログのバージョンからキーを作る"""
+        raw = json.dumps({"events": sorted(set(race_event_ids)), "catalogue": self.catalogue_version})
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def fetch_revisions(race_event_ids: List[str]) -> Dict[str, int]:
+        """対象レースの現在のデータ版数を取得する（書き込み履歴のないレースは0）"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            format_strings = ','.join(['%s'] * len(race_event_ids))
+            cursor.execute(
+                f"SELECT race_event_id, revision FROM race_data_revision WHERE race_event_id IN ({format_strings})",
+                tuple(race_event_ids)
+            )
+            found = {rid: int(rev) for rid, rev in cursor.fetchall()}
+        finally:
+            cursor.close()
+            conn.close()
+        return {rid: found.get(rid, 0) for rid in sorted(set(race_event_ids))}
+
+    def get(self, race_event_ids: List[str], revisions: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        """版数が一致するキャッシュがあれば payload を返す"""
+        key = self.make_key(race_event_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["revisions"] == revisions:
+                    self._entries.move_to_end(key)
+                    return entry["payload"]
+                # スコープ内のレースに書き込みがあったため破棄
+                del self._entries[key]
+
+        if self.persist:
+            entry = self._load_persisted(key)
+            if entry is not None and entry["revisions"] == revisions:
+                self._remember(key, entry)
+                return entry["payload"]
+        return None
+
+    def put(self, race_event_ids: List[str], revisions: Dict[str, int], payload: Dict[str, Any]):
+        key = self.make_key(race_event_ids)
+        entry = {"revisions": revisions, "payload": payload}
+        self._remember(key, entry)
+        if self.persist:
+            self._save_persisted(key, race_event_ids, entry)
+
+    def lookup(self, race_event_ids: List[str]) -> Tuple[Optional[Dict[str, int]], Optional[Dict[str, Any]]]:
+        """
+        版数を確定させてキャッシュを引く。戻り値は (版数, payload)。
+        計算を呼び出し側で行う場合（プロセスプール等）は、ミス時にこの版数で put する。
+        ※ 計算前に版数を確定させる（計算中に書き込みがあれば次回は不一致となり再計算される）
+        """
+        try:
+            revisions = self.fetch_revisions(race_event_ids)
+        except Exception as e:
+            # 版数テーブルが未作成などで無効化判定ができない場合はキャッシュを使わない
+            print(f"[InferenceCache] Revision lookup failed, bypassing cache: {e}")
+            return None, None
+
+        payload = self.get(race_event_ids, revisions)
+        if payload is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return revisions, payload
+
+    def get_or_compute(self, race_event_ids: List[str], compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        キャッシュがあればそれを、なければ compute() の結果を保存して返す。
+        戻り値は (payload, キャッシュヒットしたか)。
+        """
+        revisions, payload = self.lookup(race_event_ids)
+        if payload is not None:
+            return payload, True
+
+        payload = compute()
+        if revisions is not None:
+            self.put(race_event_ids, revisions, payload)
+        return payload, False
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "max_entries": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        """メモリ上のLRUに登録し、上限を超えた古いものから追い出す"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load_persisted(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT revisions, payload FROM inference_cache WHERE cache_key = %s AND catalogue_version = %s",
+                    (key, self.catalogue_version)
+                )
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+                conn.close()
+        except Exception as e:
+            print(f"[InferenceCache] Failed to read persisted cache: {e}")
+            return None
+        if not row:
+            return None
+        return {"revisions": json.loads(row[0]), "payload": json.loads(row[1])}
+
+    def _save_persisted(self, key: str, race_event_ids: List[str], entry: Dict[str, Any]):
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    REPLACE INTO inference_cache (cache_key, catalogue_version, race_event_ids, revisions, payload)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (
+                    key, self.catalogue_version, ",".join(sorted(set(race_event_ids))),
+                    json.dumps(entry["revisions"]), json.dumps(entry["payload"], ensure_ascii=False)
+                ))
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+        except Exception as e:
+            print(f"[InferenceCache] Failed to persist cache entry: {e}")
@@ -0,0 +1,95 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Dict, Any, Tuple, Sequence
+import numpy as np
+from src.api.services.condition_matrix import ConditionMatrix
+
+
+def _search_block(specs: Dict[str, Tuple[str, Tuple[int, ...], str]], n_years: int,
+                  keys: Sequence[str], names: Sequence[str], groups: Sequence[str],
+                  min_count: int, exclusive_groups: Sequence[str],
+                  row_start: int, row_end: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """ワーカープロセス側: 共有メモリ上の該当行列を参照し、担当する行範囲の条件ペアを探索する"""
+    segments = []
+    try:
+        arrays = {}
+        for name, (shm_name, shape, dtype) in specs.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            segments.append(shm)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        matrix = ConditionMatrix.from_arrays(arrays["masks"], arrays["year_idx"], arrays["top3"], n_years)
+        result = matrix.search_pairs(keys, names, groups, min_count, exclusive_groups, row_start, row_end)
+        # 共有メモリを閉じる前に、バッファを参照している配列を解放する
+        del matrix, arrays
+        return result
+    finally:
+        for shm in segments:
+            shm.close()
+
+
+class ParallelPairSearch:
+    """
+    複合条件探索の (c1, c2) ペア空間を条件（行）ブロックに分割し、プロセスプールで並列に数える。
+    入力の該当行列・年インデックス・3着内フラグは共有メモリに置き、ワーカーへはコピーせずに渡す。
+    ※ ブロックは行の昇順に結合するため、結果の並びは逐次探索（ConditionMatrix.search_pairs）と一致する。
+    """
+
+    # ワーカー数ごとに共有するインスタンス（プロセスプールはリクエスト間で使い回す）
+    _instances: Dict[int, "ParallelPairSearch"] = {}
+    _instances_lock = threading.Lock()
+
+    # 1ワーカーあたりのブロック数（行ごとの負荷の偏りをならすため細かめに分割する）
+    BLOCKS_PER_WORKER = 4
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # スレッドプールから呼ばれるため fork ではなく spawn で起動する
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @classmethod
+    def shared(cls, workers: int) -> "ParallelPairSearch":
+        with cls._instances_lock:
+            if workers not in cls._instances:
+                cls._instances[workers] = cls(workers)
+            return cls._instances[workers]
+
+    def row_blocks(self, n_cond: int) -> List[Tuple[int, int]]:
+        n_blocks = max(1, min(n_cond, self.workers * self.BLOCKS_PER_WORKER))
+        bounds = np.linspace(0, n_cond, n_blocks + 1).astype(int)
+        return [(int(s), int(e)) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+    def search(self, matrix: ConditionMatrix, keys: Sequence[str], names: Sequence[str], groups: Sequence[str],
+               min_count: int, exclusive_groups: Sequence[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """ConditionMatrix.search_pairs を全行について並列に実行した結果を返す"""
+        arrays = {
+            "masks": np.ascontiguousarray(matrix.masks),
+            "year_idx": np.ascontiguousarray(matrix.year_idx),
+            "top3": np.ascontiguousarray(matrix.top3),
+        }
+        segments = []
+        try:
+            specs = {}
+            for name, arr in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                segments.append(shm)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                specs[name] = (shm.name, arr.shape, arr.dtype.str)
+
+            futures = [
+                self._executor.submit(
+                    _search_block, specs, matrix.n_years, list(keys), list(names), list(groups),
+                    min_count, list(exclusive_groups), start, end
+                )
+                for start, end in self.row_blocks(len(keys))
+            ]
+            block_results = [f.result() for f in futures]
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+        atomic_results = [stats for atomics, _ in block_results for stats in atomics]
+        composite_results = [stats for _, composites in block_results for stats in composites]
+        return atomic_results, composite_results
@@ -0,0 +1,113 @@
+import math
+from typing import List, Dict, Any, Optional
+import numpy as np
+from src.api.core.columnar import ColumnarFrame
+from src.api.services.condition_catalogue import CATALOGUE
+
+
+class ScoringModel:
+    """
+    採用条件の集合から作るスコアリングモデル。
+    条件ごとの寄与（3着内率中央値 x 重み）は採用条件セットごとに1回だけ計算し、
+    出走馬のスコアは「馬 x 条件」の該当行列と寄与ベクトルの積で求める。
+    """
+
+    def __init__(self, adopted_conditions: List[Dict[str, Any]]):
+        self.adopted_conditions = adopted_conditions
+        self.keys = [ac["key"] for ac in adopted_conditions]
+        # 【スコア計算仕様】: 重み w(c) = log10(n_all + 1) * years_appeared
+        # ※母数が大きく、毎年安定して出現しているものを高く評価
+        self.weights = np.array(
+            [math.log10(ac["n_all"] + 1) * (ac["years_appeared"] / 10.0) for ac in adopted_conditions],
+            dtype=np.float64
+        )
+        self.contributions = np.array([ac["median_rate"] for ac in adopted_conditions], dtype=np.float64) * self.weights
+        # 評価できる条件のみ該当判定する（複合条件は2条件ANDかつカタログに定義済みのもの）
+        self.evaluable = []
+        for j, ac in enumerate(adopted_conditions):
+            if ac["is_composite"]:
+                parts = CATALOGUE.split_key(ac["key"])
+                if len(parts) != 2 or not all(part in CATALOGUE.index for part in parts):
+                    continue
+            self.evaluable.append(j)
+        self.matched_views = [
+            {
+                "name": ac["name"],
+                "median_rate": ac["median_rate"],
+                "n_top3": ac["n_top3"],
+                "n_all": ac["n_all"],
+                "rate_3in": ac["rate_3in"]
+            }
+            for ac in adopted_conditions
+        ]
+
+    def match_matrix(self, frame: ColumnarFrame) -> np.ndarray:
+        """馬 x 採用条件 の該当行列（bool）を作る"""
+        matrix = np.zeros((len(frame), len(self.keys)), dtype=bool)
+        for j in self.evaluable:
+            matrix[:, j] = CATALOGUE.evaluate(self.keys[j], frame)
+        return matrix
+
+    @staticmethod
+    def normalize(raw_scores: np.ndarray) -> np.ndarray:
+        """1位の馬のスコアを100とする相対評価（最後の軸ごと。全馬0点なら0のまま）"""
+        max_raw = raw_scores.max(axis=-1, keepdims=True) if raw_scores.shape[-1] else np.ones(raw_scores.shape[:-1] + (1,))
+        max_raw = np.where(max_raw == 0, 1.0, max_raw)
+        return np.round(raw_scores / max_raw * 100, 1)
+
+    def score(self, frame: ColumnarFrame) -> List[Dict[str, Any]]:
+        """出走馬をスコアリングし、スコア順に並べて predicted_rank を付ける"""
+        matrix = self.match_matrix(frame)
+        raw_scores = (matrix.astype(np.float64) @ self.contributions).tolist()
+
+        # 正規化 (0-100)
+        # 1位の馬のスコアを100とする相対評価
+        max_raw = max(raw_scores) if raw_scores else 1.0
+        if max_raw == 0: max_raw = 1.0
+
+        scored_horses = []
+        for n, raw in enumerate(raw_scores):
+            scored_horses.append({
+                "horse_id": frame.horse_ids[n],
+                "name": frame.names[n],
+                "raw_score": raw,
+                "matched_conditions": [self.matched_views[j] for j in np.flatnonzero(matrix[n]).tolist()],
+                "score": round((raw / max_raw) * 100, 1)
+            })
+
+        # スコア順にソート
+        scored_horses.sort(key=lambda x: x["score"], reverse=True)
+
+        # 順位(rank)を付与
+        for i, h in enumerate(scored_horses):
+            h["predicted_rank"] = i + 1
+        return scored_horses
+
+    def sweep(self, frame: ColumnarFrame, odds: Optional[np.ndarray] = None,
+              popularity: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        オッズ・人気の仮定値（シナリオ数 x 頭数）ごとに出走馬を再スコアリングする（推論の再実行なし）。
+        戻り値はいずれも (シナリオ数 x 頭数) の配列で、predicted_rank は score() と同じ並び（同点は元の順）で付ける。
+        """
+        overrides = {}
+        if odds is not None:
+            overrides["odds"] = np.asarray(odds, dtype=np.float64)
+        if popularity is not None:
+            overrides["popularity"] = np.asarray(popularity, dtype=np.float64)
+        if not overrides:
+            raise ValueError("odds または popularity のシナリオを指定してください。")
+
+        scenarios = frame.with_scenarios(overrides)
+        n_scenarios = scenarios.n_years
+        # 差し替えた列に依存しない単条件は元フレームの評価結果を複製して使う
+        for key, field in CATALOGUE.fields.items():
+            if field not in overrides:
+                scenarios.condition_masks[key] = np.tile(CATALOGUE.evaluate(key, frame), n_scenarios)
+
+        matrix = self.match_matrix(scenarios).reshape(n_scenarios, len(frame), len(self.keys))
+        raw_scores = matrix.astype(np.float64) @ self.contributions
+        scores = self.normalize(raw_scores)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(1, len(frame) + 1)[None, :], axis=1)
+        return {"raw_scores": raw_scores, "scores": scores, "predicted_rank": ranks}
@@ -1,5 +1,6 @@
 from typing import List, Dict, Any
 from src.api.core.models import AnalysisScope
+from src.api.services.condition_catalogue import CATALOGUE
 
 class ValidationException(Exception):
     def __init__(self, message: str):
@@ -26,10 +27,13 @@ class ValidatorService:
         
         for cond in adopted_conditions:
             # 1. 複合条件のルール検証 (3つ以上のANDは禁止)
-            if "_AND_" in cond["key"]:
-                parts = cond["key"].split("_AND_")
-                if len(parts) > 2:
-                    raise ValidationException(f"禁止事項: 3つ以上の複合条件が生成されました（{cond['name']}）")
+            parts = CATALOGUE.split_key(cond["key"])
+            if len(parts) > 2:
+                raise ValidationException(f"禁止事項: 3つ以上の複合条件が生成されました（{cond['name']}）")
+            # カタログにない条件（定義変更前の結果など）は採用できない
+            unknown = [part for part in parts if part not in CATALOGUE.index]
+            if unknown:
+                raise ValidationException(f"未定義の条件が含まれています（{cond['name']}: {', '.join(unknown)}）")
                     
             # 2. 割合と母数の再計算と検証 (事実と出力の乖離がないか)
             if cond["n_all"] == 0:
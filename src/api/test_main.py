@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
@@ -45,7 +46,24 @@ def main():
     chat_data = chat_response.json()
     print("AI Reply:", chat_data["reply"])
     print("Chat History Length:", len(chat_data["history"]))
-    
+
+    print("\nTesting /api/analyze/batch endpoint...")
+    races = [
+        {"race_event_id": "202505010811", "target_date": "2025-02-23"},
+        {"race_event_id": "202405010811", "target_date": "2024-02-18"},
+    ]
+    with client.stream("POST", "/api/analyze/batch", json={"races": races}) as batch_response:
+        if batch_response.status_code != 200:
+            print(f"Error calling /analyze/batch: {batch_response.read()}")
+            sys.exit(1)
+        lines = [json.loads(line) for line in batch_response.iter_lines() if line]
+
+    for result in lines:
+        print(f"  {result['race_event_id']}: {result['status']}")
+    if len(lines) != len(races) or any(result["status"] != "success" for result in lines):
+        print("Error: batch analysis did not return a successful result for every race")
+        sys.exit(1)
+
     print("\nAPI Integration Tests Passed Successfully.")
 
 if __name__ == "__main__":
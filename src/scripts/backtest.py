@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import argparse
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.api.services.backtest import BacktestService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="過去開催のローリングオリジン・バックテスト")
+    parser.add_argument("--race-master-id", action="append", dest="race_master_ids",
+                        help="対象の系譜（複数指定可。未指定時は --grades の全系譜）")
+    parser.add_argument("--grades", default=",".join(BacktestService.DEFAULT_GRADES),
+                        help="系譜を自動解決する場合の対象グレード（カンマ区切り）")
+    parser.add_argument("--years", type=int, default=BacktestService.LIMIT_YEARS, help="推論に使う過去開催数")
+    parser.add_argument("--min-history", type=int, default=BacktestService.MIN_HISTORY_YEARS,
+                        help="評価に必要な最小の過去開催数")
+    parser.add_argument("--output", help="レポート（JSON）の出力先")
+    args = parser.parse_args()
+
+    report = BacktestService.run(
+        race_master_ids=args.race_master_ids,
+        grades=[g for g in args.grades.split(",") if g],
+        limit_years=args.years,
+        min_history_years=args.min_history,
+    )
+
+    print(f"Lineages: {report['lineages']}, folds evaluated: {report['folds_evaluated']}")
+    print(f"Timings: load {report['timings']['load']:.1f}s, evaluate {report['timings']['evaluate']:.1f}s")
+    print(f"Top pick: top3 {report['top_pick_hit_rate']:.1%}, win {report['top_pick_win_rate']:.1%}, "
+          f"win ROI {report['top_pick_roi']:.1%}")
+    print(f"Predicted top3 precision: {report['top3_precision']:.1%}")
+    print("\nConditions (top 10 by hit rate):")
+    for c in report["conditions"][:10]:
+        print(f"  {c['name']}: top3 {c['hit_rate']:.1%}, ROI {c['roi']:.1%} "
+              f"({c['n_top3']}/{c['n_bets']}, adopted in {c['folds_adopted']} folds)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
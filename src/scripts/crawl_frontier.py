@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from typing import Any, Dict, Iterable, List
+
+FRONTIER_FILE = "data/processed/crawl_frontier.sqlite3"
+
+# 深夜クローラーの優先度（数字が小さいほど先に取得する）
+PRIORITY_TARGET_RACE = 1   # 優先度1: 対象重賞（2026年フェブラリーS）の出走馬
+PRIORITY_MISSING_RACE = 2  # 優先度2: 未取得期間のレース結果
+PRIORITY_PEDIGREE = 3      # 優先度3: 直近5年出走馬の血統補完
+
+
+class CrawlItem:
+    def __init__(self, item_id: int, kind: str, key: str, priority: int, attempts: int):
+        self.item_id = item_id
+        self.kind = kind
+        self.key = key
+        self.priority = priority
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return f"CrawlItem({self.kind}:{self.key}, priority={self.priority}, attempts={self.attempts})"
+
+
+class CrawlFrontier:
+    """
+    SQLite に保存するクロール待ち行列（missing_race_queue.json の置き換え）。
+    ※ (kind, key) で重複を除き、優先度 → 登録順 で取り出す。取り出した項目はリース（一定時間の貸し出し）になり、
+       complete / fail するまで他の取り出しには出てこない。途中で落ちても、期限切れのリースは次回の lease で再び取り出される。
+    ※ 状態の更新は1件ごとにコミットするため、中断しても処理済みの項目は失われない。
+    ※ 状態（status）: pending（待ち）/ leased（取得中）/ done（完了）/ failed（リトライ上限）
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS frontier (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL,
+            last_error TEXT,
+            enqueued_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            UNIQUE (kind, item_key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_frontier_ready ON frontier (status, kind, priority, item_id);
+        CREATE INDEX IF NOT EXISTS idx_frontier_ready_all ON frontier (status, priority, item_id);
+    """
+
+    MAX_ATTEMPTS = 3
+    LEASE_SECONDS = 600
+    # 失敗時に再び取り出せるようになるまでの待ち（5 -> 10 -> 20分）
+    RETRY_BACKOFF = 300
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("CRAWL_FRONTIER_PATH", FRONTIER_FILE)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL では NORMAL でもコミット済みの内容はプロセスの異常終了で失われない
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "CrawlFrontier":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def enqueue(self, kind: str, keys: Iterable[str], priority: int) -> int:
+        """
+        項目をまとめて登録し、新規に追加した件数を返す（渡した順が取り出し順になる）。
+        登録済みの項目は追加しない。待ち・失敗の項目をより高い優先度で登録した場合は優先度だけ引き上げる。
+        """
+        now = time.time()
+        rows = [(kind, str(key), priority, now, now) for key in dict.fromkeys(keys)]
+        with self._lock:
+            with self._conn:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO frontier (kind, item_key, priority, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                added = self._conn.total_changes - before
+                self._conn.executemany("""
+                    UPDATE frontier SET priority = ?, updated_at = ?
+                    WHERE kind = ? AND item_key = ? AND priority > ? AND status IN ('pending', 'failed')
+                """, [(priority, now, kind, key, priority) for kind, key, _, _, _ in rows])
+        return added
+
+    def lease(self, kind: str = None, limit: int = 1, lease_seconds: float = None) -> List[CrawlItem]:
+        """優先度の高い順に、取り出せる項目を最大 limit 件リースする（期限切れのリースも取り出し直す）"""
+        now = time.time()
+        lease_until = now + (lease_seconds or self.LEASE_SECONDS)
+        kind_clause = "AND kind = ?" if kind else ""
+        kind_params = (kind,) if kind else ()
+        with self._lock:
+            with self._conn:
+                # 前回の実行が途中で終わった項目（期限切れのリース）は待ちに戻す
+                self._conn.execute(
+                    f"UPDATE frontier SET status = 'pending' WHERE status = 'leased' AND lease_until < ? {kind_clause}",
+                    (now, *kind_params)
+                )
+                rows = self._conn.execute(f"""
+                    SELECT item_id, kind, item_key, priority, attempts FROM frontier
+                    WHERE status = 'pending' {kind_clause} AND available_at <= ?
+                    ORDER BY priority, item_id
+                    LIMIT ?
+                """, (*kind_params, now, limit)).fetchall()
+                self._conn.executemany("""
+                    UPDATE frontier SET status = 'leased', attempts = attempts + 1, lease_until = ?, updated_at = ?
+                    WHERE item_id = ?
+                """, [(lease_until, now, row[0]) for row in rows])
+        return [CrawlItem(item_id, kind, key, priority, attempts + 1) for item_id, kind, key, priority, attempts in rows]
+
+    def complete(self, item: CrawlItem):
+        """処理済みにする（即コミット）"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE frontier SET status = 'done', lease_until = NULL, last_error = NULL, updated_at = ? WHERE item_id = ?",
+                    (time.time(), item.item_id)
+                )
+
+    def fail(self, item: CrawlItem, error: str = None, retry: bool = True):
+        """失敗を記録する。リトライ上限までは待ちに戻し（バックオフ付き）、上限に達したら failed にする"""
+        now = time.time()
+        give_up = not retry or item.attempts >= self.MAX_ATTEMPTS
+        with self._lock:
+            with self._conn:
+                self._conn.execute("""
+                    UPDATE frontier
+                    SET status = ?, available_at = ?, lease_until = NULL, last_error = ?, updated_at = ?
+                    WHERE item_id = ?
+                """, (
+                    "failed" if give_up else "pending",
+                    now + self.RETRY_BACKOFF * (2 ** (item.attempts - 1)),
+                    error, now, item.item_id
+                ))
+
+    def release(self, item: CrawlItem):
+        """処理せずに待ちへ戻す（予算切れで打ち切る場合など。試行回数も戻す）"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("""
+                    UPDATE frontier SET status = 'pending', attempts = MAX(attempts - 1, 0), lease_until = NULL, updated_at = ?
+                    WHERE item_id = ? AND status = 'leased'
+                """, (time.time(), item.item_id))
+
+    def requeue_failed(self, kind: str = None) -> int:
+        """failed の項目を試行回数をリセットして待ちに戻し、件数を返す"""
+        kind_clause = "AND kind = ?" if kind else ""
+        with self._lock:
+            with self._conn:
+                cur = self._conn.execute(
+                    f"UPDATE frontier SET status = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                    f"WHERE status = 'failed' {kind_clause}",
+                    (time.time(), *((kind,) if kind else ()))
+                )
+        return cur.rowcount
+
+    def pending_count(self, kind: str = None) -> int:
+        kind_clause = "AND kind = ?" if kind else ""
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM frontier WHERE status IN ('pending', 'leased') {kind_clause}",
+                (kind,) if kind else ()
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """種類・状態ごとの件数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, status, COUNT(*) FROM frontier GROUP BY kind, status").fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for kind, status, count in rows:
+            stats.setdefault(kind, {})[status] = count
+        return stats
+
+    def import_json_queue(self, path: str, kind: str, priority: int) -> int:
+        """従来の JSON キュー（ID の配列）を取り込み、取り込み済みのファイルは .imported に改名する"""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            keys = json.load(f)
+        added = self.enqueue(kind, keys, priority)
+        os.replace(path, path + ".imported")
+        return added
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クロール待ち行列（crawl frontier）の状態表示・取り込み")
+    parser.add_argument("--path", default=None, help="frontier の SQLite ファイル")
+    parser.add_argument("--import-json", help="従来形式の JSON キュー（レースIDの配列）を取り込む")
+    parser.add_argument("--retry-failed", action="store_true", help="failed の項目を待ちに戻す")
+    args = parser.parse_args()
+
+    with CrawlFrontier(args.path) as frontier:
+        if args.import_json:
+            added = frontier.import_json_queue(args.import_json, "race", PRIORITY_MISSING_RACE)
+            print(f"Imported {added} races from {args.import_json}")
+        if args.retry_failed:
+            print(f"Requeued {frontier.requeue_failed()} failed items")
+        for kind, counts in frontier.stats().items():
+            print(f"{kind}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 import os
+import sys
 import time
+import threading
 import urllib.robotparser
 from urllib.parse import urlparse
 import json
 import random
 import requests
 from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.html_cache import (
+    DEFAULT_CACHE_DIR, HtmlCache, ParseCache, content_hash, create_html_cache, create_parse_cache
+)
+from src.scripts.netkeiba_parsers import extract_fragment
 
 STATE_FILE = "data/processed/crawler_state.json"
 
@@ -16,6 +26,72 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0",
 ]
 
+# [安全装置0]: 30分あたりのリクエスト上限
+RATE_LIMIT_REQUESTS = 100
+RATE_LIMIT_WINDOW = 1800
+# [安全装置1]: リクエスト前のランダムスリープ（秒）
+PRE_SLEEP_RANGE = (5.0, 15.0)
+# [安全装置3]: ページ滞在・読み込み時間の模倣（秒）
+POST_SLEEP_RANGE = (2.0, 5.0)
+# [死んだふりロジック]: 403 / 429 検知時の待機（秒）
+DEAD_SLEEP_RANGE = (3 * 3600, 24 * 3600)
+
+
+class HostTokenBucket:
+    """
+    ホスト（サイト）ごとのリクエスト予算。ウィンドウ（30分）ごとに上限（100回）まで補充されるトークンバケツ。
+    状態は STATE_FILE と同じ形式（count / reset_time）で保存し、逐次クローラー・スケジューラー・再起動後で共有する。
+    """
+
+    def __init__(self, capacity: int = RATE_LIMIT_REQUESTS, window: float = RATE_LIMIT_WINDOW,
+                 state_file: Optional[str] = STATE_FILE):
+        self.capacity = capacity
+        self.window = window
+        self.state_file = state_file
+        # 状態ファイルを使わない場合（テスト等）はメモリ上に保持する
+        self._state = {"count": 0, "reset_time": 0.0}
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        state = dict(self._state)
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as f:
+                    state.update(json.load(f))
+            except Exception:
+                pass
+        return state
+
+    def _save(self, state: dict):
+        self._state = state
+        if not self.state_file:
+            return
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, "w") as f:
+            json.dump(state, f)
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ取得する。取得できた場合は0を、上限に達している場合は消費せずに
+        ウィンドウが明けるまでの秒数を返す（呼び出し側で待ってから再度 reserve する）。
+        """
+        with self._lock:
+            state = self._load()
+            now = time.time()
+
+            # ウィンドウ（30分）が過ぎていればリセット
+            if now > state["reset_time"]:
+                state["count"] = 0
+                state["reset_time"] = now + self.window
+
+            # 上限に達していたら、ウィンドウが明けるまで待機が必要
+            if state["count"] >= self.capacity:
+                return max(state["reset_time"] - now, 0.001)
+
+            state["count"] += 1
+            self._save(state)
+            return 0.0
+
 class NetkeibaCrawler:
     """
     netkeiba.com から対象データを安全に取得・キャッシュするためのクローラー基盤。
@@ -23,44 +99,143 @@ class NetkeibaCrawler:
     ※ 1リクエストごとに確実なスリープを挟み、サーバー負荷を軽減します。
     """
 
-    def __init__(self, cache_dir: str = "data/raw/netkeiba"):
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, cache: Optional[HtmlCache] = None,
+                 parse_cache: Optional[ParseCache] = None):
         self.cache_dir = cache_dir
         self.base_url = "https://db.netkeiba.com"
         
-        # キャッシュディレクトリの作成
-        os.makedirs(self.cache_dir, exist_ok=True)
+        # キャッシュの保存先（NETKEIBA_CACHE_BACKEND で切り替え。既定は SQLite、従来のファイルは未移行分の読み込み元）
+        self.cache = cache or create_html_cache(cache_dir=cache_dir)
+        self.cache_hits = 0
+        # パース結果のキャッシュ（同じHTMLを同じパーサーで何度もパースしない）
+        self.parse_cache = parse_cache or create_parse_cache(cache_dir)
+        self.parse_hits = 0
+        self.stream_parses = 0
         
         # クローラーの身元明示（初期化用、実際はリクエスト時にランダム設定）
         self.headers = {
             "User-Agent": random.choice(USER_AGENTS)
         }
-        
-    def _get_cache_path(self, url: str) -> str:
-        """URLから一意なキャッシュファイルパスを生成する"""
-        parsed = urlparse(url)
-        # クエリパラメータやパスをアンダースコアに置換してファイル名にする
-        safe_name = parsed.path.strip("/").replace("/", "_")
-        if parsed.query:
-            safe_name += "_" + parsed.query.replace("=", "").replace("&", "_")
-        safe_name += ".html"
-        return os.path.join(self.cache_dir, safe_name)
-
-    def fetch_html(self, url: str, force_refresh: bool = False) -> str:
+        # 100リクエスト / 30分 の予算（状態ファイルで他プロセス・スケジューラーと共有）
+        self.rate_limit = HostTokenBucket()
+
+    def read_cache(self, url: str, force_refresh: bool = False, max_age: float = None) -> Optional[str]:
+        """
+        キャッシュ済みHTMLを返す（なければ None）。
+        max_age（秒）を指定した場合、それより古いキャッシュは無いものとして扱う（オッズ等が変わるページ用）。
+        """
+        return self.read_cache_many([url], force_refresh, max_age).get(url)
+
+    def read_cache_many(self, urls: List[str], force_refresh: bool = False, max_age: float = None) -> Dict[str, str]:
+        """複数URLのキャッシュをまとめて引く（見つかったものだけを返す）"""
+        if force_refresh:
+            return {}
+        found = self.cache.get_many(urls, max_age)
+        self.cache_hits += len(found)
+        return found
+
+    def fetch_html(self, url: str, force_refresh: bool = False, max_age: float = None) -> str:
         """
         URLからHTMLを取得する。
         キャッシュが存在する場合はキャッシュを返し、存在しない場合はHTTPリクエストを発行する。
+        max_age（秒）を指定した場合、それより古いキャッシュは再取得する（オッズ等が変わるページ用）。
+        ※ 呼び出しスレッド上でスリープする逐次版。多数のページを取得する場合は FetchScheduler を使う。
         """
-        cache_path = self._get_cache_path(url)
-        
-        if not force_refresh and os.path.exists(cache_path):
-            print(f"[CACHE HIT] {url}")
-            with open(cache_path, "r", encoding="euc-jp", errors="replace") as f:
-                return f.read()
+        html = self.read_cache(url, force_refresh, max_age)
+        if html is not None:
+            return html
                 
         # サーバーへのリクエスト（安全装置付き）
-        return self._safe_request(url, cache_path)
+        return self._safe_request(url)
+
+    def parse(self, url: str, html: str, parser: Callable[[str], Any]) -> Any:
+        """
+        parser(html) の結果を返す。@versioned のパーサーはパース結果キャッシュを使い、
+        (URL, HTMLの内容ハッシュ, パーサーのバージョン) が一致すればパースを省略する。
+        """
+        version = getattr(parser, "parser_version", None)
+        if not html or version is None:
+            return parser(html)
+        digest = content_hash(html)
+        cached = self.parse_cache.get(url, parser.__name__, digest, version)
+        if cached is not None:
+            self.parse_hits += 1
+            return json.loads(cached)
+        result = parser(html)
+        self.parse_cache.put(url, parser.__name__, digest, version, json.dumps(result, ensure_ascii=False))
+        return result
+
+    def fetch_parsed(self, url: str, parser: Callable[[str], Any], force_refresh: bool = False,
+                     max_age: float = None) -> Any:
+        """
+        URLのページを parser でパースした結果を返す（取得に失敗した場合は None）。
+        キャッシュ済みのページは、パース結果キャッシュ → 対象要素だけの逐次抽出（@streamable のパーサー）
+        → HTML全体のパース の順に試し、ページ全体を文字列に展開・パースするのは最後の手段にする。
+        """
+        if not force_refresh:
+            version = getattr(parser, "parser_version", None)
+            meta = self.cache.metadata(url)
+            if version and meta and meta.get("content_hash") and HtmlCache._is_fresh(meta["fetched_at"], max_age):
+                cached = self.parse_cache.get(url, parser.__name__, meta["content_hash"], version)
+                if cached is not None:
+                    self.cache_hits += 1
+                    self.parse_hits += 1
+                    return json.loads(cached)
+
+            targets = getattr(parser, "stream_targets", None)
+            stream = self.cache.open_stream(url, max_age) if targets else None
+            if stream is not None:
+                encoding, digest, chunks = stream
+                fragment = extract_fragment(chunks, encoding, targets)
+                if fragment is not None:
+                    self.cache_hits += 1
+                    self.stream_parses += 1
+                    result = parser(fragment)
+                    if version and digest:
+                        self.parse_cache.put(url, parser.__name__, digest, version, json.dumps(result, ensure_ascii=False))
+                    return result
+
+        html = self.fetch_html(url, force_refresh, max_age)
+        if not html:
+            return None
+        return self.parse(url, html, parser)
+
+    def request_once(self, url: str) -> str:
+        """
+        1回だけHTTPリクエストを発行し、HTMLをキャッシュに保存して返す（スリープ・リトライなし）。
+        前回の ETag があれば条件付きリクエストにし、304 ならキャッシュ済みの本文を使う。
+        HTTPエラーは requests.exceptions.HTTPError として呼び出し側に送出する。
+        """
+        # UA動的ローテーション
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        meta = self.cache.metadata(url)
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        
+        response = requests.get(url, headers=headers, timeout=15)
+        
+        # エラーチェック
+        response.raise_for_status()
+
+        if response.status_code == 304:
+            html_content = self.cache.get(url)
+            if html_content is not None:
+                self.cache.put(url, html_content, status=304, etag=meta["etag"])
+                return html_content
+            # 本文が失われている場合は条件なしで取り直す
+            headers.pop("If-None-Match")
+            response = requests.get(url, headers=headers, timeout=15)
+            response.raise_for_status()
+        
+        # NetkeibaはEUC-JPが標準
+        response.encoding = 'euc-jp'
+        html_content = response.text
+        
+        # [安全装置2]: 二重取得防除のためのHTMLキャッシュ保存
+        self.cache.put(url, html_content, status=response.status_code, etag=response.headers.get("ETag"))
+        return html_content
 
-    def _safe_request(self, url: str, cache_path: str, max_retries: int = 3) -> str:
+    def _safe_request(self, url: str, max_retries: int = 3) -> str:
         """
         指数的バックオフと強制スリープを備えたリクエスト送信
         """
@@ -72,40 +247,26 @@ class NetkeibaCrawler:
                 self._check_global_rate_limit()
                 
                 # [安全装置1]: リクエスト前の完全ランダムスリープ（5〜15秒）
-                pre_sleep = random.uniform(5.0, 15.0)
+                pre_sleep = random.uniform(*PRE_SLEEP_RANGE)
                 print(f"-> Sleeping for {pre_sleep:.1f}s before request...")
                 time.sleep(pre_sleep)
                 
-                # UA動的ローテーション
-                headers = {"User-Agent": random.choice(USER_AGENTS)}
-                
-                response = requests.get(url, headers=headers, timeout=15)
-                
-                # エラーチェック
-                response.raise_for_status()
-                
-                # NetkeibaはEUC-JPが標準
-                response.encoding = 'euc-jp'
-                html_content = response.text
-                
-                # [安全装置2]: 二重取得防除のためのHTMLキャッシュ保存
-                with open(cache_path, "w", encoding="euc-jp", errors="replace") as f:
-                    f.write(html_content)
+                html_content = self.request_once(url)
                     
                 # [安全装置3]: 人間らしい「ページ滞在・読み込み時間」の模倣
-                post_sleep = random.uniform(2.0, 5.0)
+                post_sleep = random.uniform(*POST_SLEEP_RANGE)
                 print(f"-> Reading page... sleeping for {post_sleep:.1f}s")
                 time.sleep(post_sleep)
                     
                 return html_content
                 
             except requests.exceptions.HTTPError as e:
-                status_code = e.response.status_code if e.response else None
+                status_code = e.response.status_code if e.response is not None else None
                 print(f"[HTTP ERROR] Status: {status_code}, URL: {url}")
                 
                 # [死んだふりロジック]: 403 / 429 はアクセス過多。即座に3時間〜24時間のランダム待機を行う
                 if status_code in (403, 429):
-                    dead_sleep = random.uniform(3 * 3600, 24 * 3600)
+                    dead_sleep = random.uniform(*DEAD_SLEEP_RANGE)
                     print(f"!!! CRITICAL STATUS {status_code} DETECTED !!!")
                     print(f"-> Playing dead. Sleeping for {dead_sleep/3600:.2f} hours...")
                     time.sleep(dead_sleep)
@@ -129,37 +290,12 @@ class NetkeibaCrawler:
 
     def _check_global_rate_limit(self):
         """100リクエストごとに30分待機するグローバル制限"""
-        os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
-        state = {"count": 0, "reset_time": 0.0}
-        
-        if os.path.exists(STATE_FILE):
-            try:
-                with open(STATE_FILE, "r") as f:
-                    state = json.load(f)
-            except Exception:
-                pass
-                
-        now = time.time()
-        
-        # ウィンドウ（30分）が過ぎていればリセット
-        if now > state["reset_time"]:
-            state["count"] = 0
-            state["reset_time"] = now + 1800  # 30分後
-            
-        # 100回に達していたら、ウィンドウが明けるまで待機
-        if state["count"] >= 100:
-            sleep_time = state["reset_time"] - now
-            if sleep_time > 0:
-                print(f"[RATE LIMIT] 100 requests reached. Sleeping for {int(sleep_time)} seconds (30 mins strict rule)...")
-                time.sleep(sleep_time)
-            # 待機明けにリセット
-            state["count"] = 0
-            state["reset_time"] = time.time() + 1800
-            
-        # カウントをインクリメントして保存
-        state["count"] += 1
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f)
+        while True:
+            sleep_time = self.rate_limit.reserve()
+            if sleep_time <= 0:
+                return
+            print(f"[RATE LIMIT] {RATE_LIMIT_REQUESTS} requests reached. Sleeping for {int(sleep_time)} seconds (30 mins strict rule)...")
+            time.sleep(sleep_time)
 
 if __name__ == "__main__":
     # 使用例:
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+import requests
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.crawl_netkeiba import (
+    NetkeibaCrawler, HostTokenBucket, PRE_SLEEP_RANGE, POST_SLEEP_RANGE, DEAD_SLEEP_RANGE
+)
+
+
+class _FetchJob:
+    def __init__(self, url: str, future: Future):
+        self.url = url
+        # HTML文字列で完了する Future（パースは予約ごとに別途行う）
+        self.future = future
+        self.attempt = 0
+        # リトライ時のバックオフ（この時刻までは送信しない）
+        self.not_before = 0.0
+
+
+class _HostState:
+    def __init__(self, bucket: HostTokenBucket):
+        self.bucket = bucket
+        self.queue: Deque[_FetchJob] = deque()
+        # 次のリクエストを送ってよい時刻（前回の読み込み時間＋次回の事前スリープ分を空ける）
+        self.next_at = 0.0
+        self.in_flight = False
+
+
+class FetchScheduler:
+    """
+    NetkeibaCrawler の取得をキューで受け付け、ホスト（サイト）ごとの礼儀ルールを守りながら送信するスケジューラー。
+    ※ 100リクエスト / 30分 の予算は HostTokenBucket（状態ファイルは逐次クローラーと共有）で、
+       リクエスト間隔（読み込み 2〜5秒＋事前 5〜15秒）と 403/429 時の長時間停止はホストごとの送信時刻で管理する。
+    ※ 待機するのはディスパッチャースレッドだけで、呼び出し側には Future（または非同期イテレーター）を返す。
+       キャッシュヒットの読み込みとHTMLのパースは別スレッドで、送信待ちと並行して進む。
+    """
+
+    MAX_RETRIES = 3
+    # 通常のエラー時のバックオフ（秒。5 -> 10 -> 20）
+    RETRY_BACKOFF = 5
+
+    def __init__(self, crawler: Optional[NetkeibaCrawler] = None, parse_workers: int = 4):
+        self.crawler = crawler or NetkeibaCrawler()
+        self._parse_pool = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="fetch-parse")
+        # HTTP送信はホストごとに1本ずつのため、ホスト数ぶんあれば足りる
+        self._fetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fetch-http")
+        self._hosts: Dict[str, _HostState] = {}
+        # URL → HTML取得の Future（未完了のもの）
+        self._pending: Dict[str, Future] = {}
+        # パース結果の Future（未完了のもの）。close() はこれが空になるまでパース用プールを止めない
+        self._parsing: Set[Future] = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {"submitted": 0, "cache_hits": 0, "requests": 0, "retries": 0, "failures": 0}
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="fetch-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def __enter__(self) -> "FetchScheduler":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def host_key(url: str) -> str:
+        """礼儀ルールを共有する単位（db.netkeiba.com と race.netkeiba.com は同じサイトとして数える）"""
+        netloc = urlparse(url).netloc.lower()
+        return ".".join(netloc.split(".")[-2:])
+
+    def submit(self, url: str, parser: Optional[Callable[[str], Any]] = None,
+               force_refresh: bool = False, max_age: float = None) -> Future:
+        """
+        URLの取得を予約し、Future を返す。結果は parser(html)（未指定ならHTML文字列）。
+        取得に失敗した場合（404・403/429・リトライ上限）は fetch_html と同様に空文字列を parser に渡す。
+        ※ 同じURLの取得が未完了なら、HTMLの取得はその予約と共有する。
+        """
+        return self.submit_many([url], parser, force_refresh, max_age)[url]
+
+    def submit_many(self, urls: Iterable[str], parser: Optional[Callable[[str], Any]] = None,
+                    force_refresh: bool = False, max_age: float = None) -> Dict[str, Future]:
+        """複数URLをまとめて予約する（キャッシュは get_many の1回でまとめて引く）"""
+        html_futures: Dict[str, Future] = {}
+        new_jobs = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("FetchScheduler is closed")
+            for url in dict.fromkeys(urls):
+                html_future = self._pending.get(url)
+                if html_future is None:
+                    html_future = Future()
+                    self._pending[url] = html_future
+                    self.stats["submitted"] += 1
+                    new_jobs.append(_FetchJob(url, html_future))
+                html_futures[url] = html_future
+        for job in new_jobs:
+            job.future.add_done_callback(lambda _, url=job.url: self._forget(url))
+        if new_jobs:
+            self._parse_pool.submit(self._check_cache, new_jobs, force_refresh, max_age)
+        if parser is None:
+            return html_futures
+
+        results = {}
+        for url, html_future in html_futures.items():
+            result = Future()
+            with self._cond:
+                self._parsing.add(result)
+            result.add_done_callback(self._parse_done)
+            html_future.add_done_callback(
+                lambda f, url=url, result=result: self._schedule_parse(url, f, parser, result)
+            )
+            results[url] = result
+        return results
+
+    def fetch_many(self, urls: Iterable[str], parser: Optional[Callable[[str], Any]] = None,
+                   **kwargs) -> Iterator[Tuple[str, Any]]:
+        """複数URLをまとめて予約し、完了順に (url, 結果) を返す"""
+        futures = {future: url for url, future in self.submit_many(urls, parser, **kwargs).items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    async def iter_completed(self, urls: Iterable[str], parser: Optional[Callable[[str], Any]] = None,
+                             **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+        """fetch_many の非同期版（イベントループを塞がずに完了順で受け取る）"""
+        async def tagged(url: str, future: Future) -> Tuple[str, Any]:
+            return url, await asyncio.wrap_future(future)
+
+        tasks = [tagged(url, future) for url, future in self.submit_many(urls, parser, **kwargs).items()]
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+
+    def close(self, wait: bool = True):
+        """新規の予約を止め、予約済みの取得が終わるのを待って終了する"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            self._dispatcher.join()
+            # HTML取得の完了後に done-callback から登録されるパースが終わるまで待つ
+            with self._cond:
+                while self._parsing:
+                    self._cond.wait()
+        self._fetch_pool.shutdown(wait=wait)
+        self._parse_pool.shutdown(wait=wait)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = sum(len(h.queue) for h in self._hosts.values())
+            return dict(self.stats, queued=queued, pending=len(self._pending))
+
+    # --- 内部処理 ---
+
+    def _forget(self, url: str):
+        with self._cond:
+            self._pending.pop(url, None)
+            self._cond.notify_all()
+
+    def _check_cache(self, jobs: List[_FetchJob], force_refresh: bool, max_age: Optional[float]):
+        """パース用スレッド: キャッシュにあるものはそのまま完了、なければホストごとの送信キューへ"""
+        try:
+            cached = self.crawler.read_cache_many([job.url for job in jobs], force_refresh, max_age)
+        except Exception as e:
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+
+        with self._cond:
+            self.stats["cache_hits"] += len(cached)
+            for job in jobs:
+                if job.url in cached:
+                    continue
+                host = self.host_key(job.url)
+                state = self._hosts.get(host)
+                if state is None:
+                    # netkeiba は逐次クローラーと同じ予算（状態ファイル）を使う
+                    bucket = self.crawler.rate_limit if host == self.host_key(self.crawler.base_url) else HostTokenBucket(state_file=None)
+                    state = self._hosts[host] = _HostState(bucket)
+                state.queue.append(job)
+            self._cond.notify_all()
+        for job in jobs:
+            if job.url in cached:
+                job.future.set_result(cached[job.url])
+
+    def _schedule_parse(self, url: str, html_future: Future, parser: Callable[[str], Any], result: Future):
+        try:
+            self._parse_pool.submit(self._parse, url, html_future, parser, result)
+        except RuntimeError:
+            # close(wait=False) でプールが止まった後に取得が完了した場合は、その場でパースする
+            self._parse(url, html_future, parser, result)
+
+    def _parse_done(self, result: Future):
+        with self._cond:
+            self._parsing.discard(result)
+            self._cond.notify_all()
+
+    def _parse(self, url: str, html_future: Future, parser: Callable[[str], Any], result: Future):
+        """パース用スレッド: 取得済みHTMLをパースして予約ごとの Future を完了させる（パース結果キャッシュ経由）"""
+        try:
+            result.set_result(self.crawler.parse(url, html_future.result(), parser))
+        except Exception as e:
+            result.set_exception(e)
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                wake_at = None
+                for state in self._hosts.values():
+                    if state.in_flight or not state.queue:
+                        continue
+                    ready_at = max(state.next_at, state.queue[0].not_before)
+                    if ready_at > now:
+                        wake_at = ready_at if wake_at is None else min(wake_at, ready_at)
+                        continue
+                    # [安全装置0]: 予算が尽きていればウィンドウが明けるまでこのホストだけ止める
+                    budget_wait = state.bucket.reserve()
+                    if budget_wait > 0:
+                        print(f"[RATE LIMIT] Budget exhausted. Holding requests for {int(budget_wait)} seconds (30 mins strict rule)...")
+                        state.next_at = now + budget_wait
+                        wake_at = state.next_at if wake_at is None else min(wake_at, state.next_at)
+                        continue
+                    state.in_flight = True
+                    self._fetch_pool.submit(self._fetch, state, state.queue.popleft())
+
+                idle = not any(state.queue or state.in_flight for state in self._hosts.values())
+                if self._closed and idle and not self._pending:
+                    return
+                self._cond.wait(None if wake_at is None else max(wake_at - time.time(), 0.0))
+
+    def _fetch(self, state: _HostState, job: _FetchJob):
+        """HTTP用スレッド: 1回だけ送信し、結果に応じて次回送信時刻・リトライを決める"""
+        print(f"[FETCH] Requesting {job.url} (Attempt {job.attempt+1}/{self.MAX_RETRIES})")
+        html = None
+        # [安全装置3]+[安全装置1]: 読み込み時間の模倣と次のリクエスト前の待機を、送信時刻の間隔として空ける
+        next_gap = random.uniform(*POST_SLEEP_RANGE) + random.uniform(*PRE_SLEEP_RANGE)
+        try:
+            with self._cond:
+                self.stats["requests"] += 1
+            html = self.crawler.request_once(job.url)
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code if e.response is not None else None
+            print(f"[HTTP ERROR] Status: {status_code}, URL: {job.url}")
+            if status_code in (403, 429):
+                # [死んだふりロジック]: このホストへの送信を3時間〜24時間止める
+                next_gap = random.uniform(*DEAD_SLEEP_RANGE)
+                print(f"!!! CRITICAL STATUS {status_code} DETECTED !!! Holding host for {next_gap/3600:.2f} hours...")
+                html = ""
+            elif status_code == 404:
+                print(f"-> Not Found. Skip retrying.")
+                html = ""
+        except requests.exceptions.RequestException as e:
+            print(f"[REQUEST ERROR] {e}")
+        except Exception as e:
+            # 想定外の例外（キャッシュ書き込み失敗など）はリトライせずに呼び出し側へ返す
+            with self._cond:
+                state.in_flight = False
+                state.next_at = time.time() + next_gap
+                self.stats["failures"] += 1
+                self._cond.notify_all()
+            job.future.set_exception(e)
+            return
+
+        with self._cond:
+            state.in_flight = False
+            state.next_at = time.time() + next_gap
+            if html is None:
+                job.attempt += 1
+                if job.attempt < self.MAX_RETRIES:
+                    # 通常のエラーバックオフ(5 -> 10 -> 20)。同じホストの先頭に戻す
+                    job.not_before = time.time() + self.RETRY_BACKOFF * (2 ** (job.attempt - 1))
+                    self.stats["retries"] += 1
+                    state.queue.appendleft(job)
+                else:
+                    print(f"[FAILURE] Max retries reached for {job.url}")
+                    self.stats["failures"] += 1
+                    html = ""
+            self._cond.notify_all()
+
+        if html is not None:
+            job.future.set_result(html)
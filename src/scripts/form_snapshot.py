@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+from typing import Iterable, List, Optional
+import mysql.connector
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+DB_CONFIG = {
+    "host": "db",
+    "user": "root",
+    "password": "root",
+    "database": "horse_race_db",
+    "charset": "utf8mb4"
+}
+
+# 1回の差分更新で対象にする馬の数
+REFRESH_CHUNK_SIZE = 500
+
+# 各出走（race_result の1行）について、その馬の「前走まで直近5走」をウィンドウ関数で集計する。
+# 特徴量の定義は AnalyzerService._compute_recent_features と揃えている。
+SNAPSHOT_INSERT = """
+    INSERT INTO horse_form_snapshot (
+        horse_id, as_of_race_event_id, as_of_date,
+        recent_highest_grade, recent_top3_count, recent_avg_rank_bin,
+        has_dirt_1600_exp, has_tokyo_exp
+    )
+    SELECT
+        w.horse_id, w.race_event_id, w.race_date,
+        CASE w.max_grade_rank
+            WHEN 5 THEN 'G1' WHEN 4 THEN 'G2' WHEN 3 THEN 'G3' WHEN 2 THEN 'OP'
+            ELSE 'OTHER'
+        END,
+        COALESCE(w.top3_count, 0),
+        CASE
+            WHEN w.avg_rank IS NULL THEN '7.0+'
+            WHEN w.avg_rank <= 3.9 THEN '<=3.9'
+            WHEN w.avg_rank <= 6.9 THEN '4.0-6.9'
+            ELSE '7.0+'
+        END,
+        COALESCE(w.has_dirt_1600, 0),
+        COALESCE(w.has_tokyo, 0)
+    FROM (
+        SELECT
+            r.horse_id, r.race_event_id, re.race_date,
+            MAX(CASE rm.grade WHEN 'G1' THEN 5 WHEN 'G2' THEN 4 WHEN 'G3' THEN 3 WHEN 'OP' THEN 2 ELSE 1 END) OVER w5 AS max_grade_rank,
+            SUM(CASE WHEN r.`rank` BETWEEN 1 AND 3 THEN 1 ELSE 0 END) OVER w5 AS top3_count,
+            AVG(CASE WHEN r.`rank` > 0 THEN r.`rank` END) OVER w5 AS avg_rank,
+            MAX(CASE WHEN re.distance = 1600 AND re.surface = 'ダート' THEN 1 ELSE 0 END) OVER w5 AS has_dirt_1600,
+            MAX(CASE WHEN re.course_id IN ('東京', '05') THEN 1 ELSE 0 END) OVER w5 AS has_tokyo
+        FROM race_result r
+        JOIN race_event re ON r.race_event_id = re.race_event_id
+        LEFT JOIN race_master rm ON re.race_master_id = rm.race_master_id
+        WHERE re.race_date IS NOT NULL {horse_filter}
+        WINDOW w5 AS (
+            PARTITION BY r.horse_id
+            ORDER BY re.race_date, r.race_event_id
+            ROWS BETWEEN 5 PRECEDING AND 1 PRECEDING
+        )
+    ) w
+"""
+
+def get_db_connection():
+    try:
+        return mysql.connector.connect(**DB_CONFIG)
+    except:
+        return mysql.connector.connect(**{**DB_CONFIG, "host": "localhost"})
+
+def snapshot_table_exists(cursor) -> bool:
+    """horse_form_snapshot があるか（既存のDBボリュームには mysql/init の追加分が流れないため）"""
+    cursor.execute("""
+        SELECT COUNT(*) AS n FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = 'horse_form_snapshot'
+    """)
+    row = cursor.fetchone()
+    return (row["n"] if isinstance(row, dict) else row[0]) > 0
+
+def rebuild_form_snapshot(cursor) -> int:
+    """全馬・全出走分のスナップショットを作り直す（一括インポート後などに使用）"""
+    cursor.execute("TRUNCATE TABLE horse_form_snapshot")
+    cursor.execute(SNAPSHOT_INSERT.format(horse_filter=""))
+    return cursor.rowcount
+
+def refresh_form_snapshot(cursor, horse_ids: Iterable[str]) -> int:
+    """
+    指定馬のスナップショットを差分更新する。
+    過去の出走が後から追加された場合もそれ以降の全出走に影響するため、馬単位で作り直す。
+    """
+    unique_ids: List[str] = list(dict.fromkeys(h for h in horse_ids if h))
+    written = 0
+    # テーブル未作成のDBでは更新しない（分析側は race_result から直近5走を計算する）
+    if not unique_ids or not snapshot_table_exists(cursor):
+        return written
+    for start in range(0, len(unique_ids), REFRESH_CHUNK_SIZE):
+        chunk = unique_ids[start:start + REFRESH_CHUNK_SIZE]
+        format_strings = ','.join(['%s'] * len(chunk))
+        cursor.execute(f"DELETE FROM horse_form_snapshot WHERE horse_id IN ({format_strings})", tuple(chunk))
+        cursor.execute(
+            SNAPSHOT_INSERT.format(horse_filter=f"AND r.horse_id IN ({format_strings})"),
+            tuple(chunk)
+        )
+        written += cursor.rowcount
+    return written
+
+def main(horse_ids: Optional[List[str]] = None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    started = time.time()
+    if horse_ids:
+        written = refresh_form_snapshot(cursor, horse_ids)
+        print(f"Refreshed form snapshot for {len(set(horse_ids))} horses ({written} rows)")
+    else:
+        written = rebuild_form_snapshot(cursor)
+        print(f"Rebuilt form snapshot ({written} rows)")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Finished in {time.time() - started:.1f}s")
+
+if __name__ == "__main__":
+    # 引数なし: 全件再構築 / 引数あり: 指定 horse_id のみ差分更新
+    main(sys.argv[1:])
@@ -1,131 +1,110 @@
 import os
+import sys
 import time
-import requests
-from bs4 import BeautifulSoup
-import json
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import mysql.connector
 
-# DBと重複しないための簡易なファイルベースキュー
-QUEUE_FILE = "data/processed/missing_race_queue.json"
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.crawl_frontier import CrawlFrontier, PRIORITY_MISSING_RACE
+from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.netkeiba_parsers import parse_calendar_race_ids
 
-def get_race_ids_for_month(year: int, month: int) -> list:
+DB_CONFIG = {
+    "host": "db",
+    "user": "root",
+    "password": "root",
+    "database": "horse_race_db",
+    "charset": "utf8mb4"
+}
+
+# 当月のカレンダーは開催の追加・変更があるため、この秒数より古いキャッシュは取り直す
+# （終わった月のカレンダーは変わらないため、月が終わった後に一度取得したらキャッシュから読む）
+OPEN_MONTH_TTL_SECONDS = 12 * 3600
+
+# race_event との突き合わせで1回の IN 句に入れるID数
+EXISTING_CHUNK_SIZE = 1000
+
+def get_db_connection():
+    try:
+        return mysql.connector.connect(**DB_CONFIG)
+    except:
+        return mysql.connector.connect(**{**DB_CONFIG, "host": "localhost"})
+
+def get_race_ids_for_month(crawler: NetkeibaCrawler, year: int, month: int) -> list:
     """
     netkeibaの月間カレンダーURLから、その月の全レースIDを抽出する。
     URL例: https://race.netkeiba.com/top/calendar.html?year=2021&month=8
-    ※スクレイピングルール（3秒待機など）を遵守。
+    ※取得は NetkeibaCrawler 経由（スクレイピングルールの待機・予算を共有し、取得済みの月はキャッシュから読む）。
+    ※終わった月は、月が終わった後に取得したキャッシュならそのまま使う（月の途中で取得したものは取り直す）。
+       当月は OPEN_MONTH_TTL_SECONDS より古いキャッシュを取り直す。
     """
-    # 実際には、netkeibaのHTML構造に合わせたパースが必要ですが、
-    # ここでは仕様に基づくプレースホルダ（安全なモック/簡易実装）として構築します。
-    # 実環境ではカレンダーの <a> タグ href から race_id を抜く処理を入れます。
-    
     url = f"https://race.netkeiba.com/top/calendar.html?year={year}&month={month}"
-    print(f"Scraping calendar for {year}-{month:02d} ...")
-    
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/100.0'}
-    time.sleep(3) # 必須の3秒固定スリープ
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        response.encoding = 'EUC-JP'
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        race_ids = []
-        # ここはnetkeibaの現在のDOM構造に依存するため、仮設定
-        # 一般的な race_id は 12桁の数字 (例: 202105040811)
-        # 本格稼働時は詳細なセレクタを調整
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
-            if 'race_id=' in href:
-                # "?race_id=202105040811" からIDを抽出
-                parts = href.split('race_id=')
-                if len(parts) > 1:
-                    r_id = parts[1][:12]
-                    if r_id.isdigit() and len(r_id) == 12:
-                        race_ids.append(r_id)
-        
-        # 重複排除
-        return list(set(race_ids))
-    except Exception as e:
-        print(f"Error fetching calendar {year}-{month:02d}: {e}")
+    now = datetime.now()
+    month_end = datetime(year, month, 1) + relativedelta(months=1)
+    max_age = (now - month_end).total_seconds() if now >= month_end else OPEN_MONTH_TTL_SECONDS
+    race_ids = crawler.fetch_parsed(url, parse_calendar_race_ids, max_age=max_age)
+    if race_ids is None:
+        print(f"Error fetching calendar {year}-{month:02d}")
         return []
+    return race_ids
 
-def filter_existing_races(race_ids: list) -> list:
+def filter_existing_races(cursor, race_ids: list) -> list:
     """
-    抽出したレースIDのうち、すでにDB(race_event)に存在しているものを除外する。
+    抽出したレースIDのうち、すでにDB(race_event)に存在しているものを除外する（順序は保つ）。
+    ※ 1件ずつではなく EXISTING_CHUNK_SIZE 件ごとの IN 句でまとめて存在確認する。
     """
-    import mysql.connector
-    
-    DB_CONFIG = {
-        "host": "localhost", # コンテナ外の場合はlocalhost, コンテナ内なら 'db'
-        "user": "root",
-        "password": "root",
-        "database": "horse_race_db",
-        "charset": "utf8mb4"
-    }
-
-    try:
-        # このスクリプトはコンテナ内実行を想定
-        conn = mysql.connector.connect(**{**DB_CONFIG, "host": "db"})
-    except:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        
-    cursor = conn.cursor()
-    
-    missing = []
-    # in句での一括検索や1件ずつの検索など
-    for r_id in race_ids:
-        cursor.execute("SELECT 1 FROM race_event WHERE race_event_id = %s", (r_id,))
-        if not cursor.fetchone():
-            missing.append(r_id)
-            
-    cursor.close()
-    conn.close()
-    
-    return missing
+    existing = set()
+    for start in range(0, len(race_ids), EXISTING_CHUNK_SIZE):
+        chunk = race_ids[start:start + EXISTING_CHUNK_SIZE]
+        format_strings = ','.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT race_event_id FROM race_event WHERE race_event_id IN ({format_strings})", tuple(chunk))
+        existing.update(row[0] for row in cursor.fetchall())
+    return [r_id for r_id in race_ids if r_id not in existing]
 
 def main():
     print("Starting generation of missing race list (2021-08-01 to Present)")
-    
+
     start_date = datetime(2021, 8, 1)
     end_date = datetime.now()
-    
+
+    crawler = NetkeibaCrawler()
     current_date = start_date
-    all_missing_races = []
-    
+    calendar_race_ids = []
+    fetch_started = time.time()
+
+    # 1. カレンダーから全レースIDを集める（終わった月はキャッシュから読み、ネットワークに出るのは基本的に当月だけ）
     while current_date <= end_date:
         y = current_date.year
         m = current_date.month
-        
-        month_race_ids = get_race_ids_for_month(y, m)
-        print(f"  Found {len(month_race_ids)} total races in calendar.")
-        
-        if month_race_ids:
-            # 既にDBにあるものは除外
-            missing_for_month = filter_existing_races(month_race_ids)
-            print(f"  -> {len(missing_for_month)} races are missing in DB.")
-            all_missing_races.extend(missing_for_month)
-            
+
+        month_race_ids = get_race_ids_for_month(crawler, y, m)
+        print(f"  {y}-{m:02d}: {len(month_race_ids)} races in calendar.")
+        calendar_race_ids.extend(month_race_ids)
+
         current_date += relativedelta(months=1)
-        
-    print(f"\nTotal missing races found: {len(all_missing_races)}")
-    
-    # JSONに保存 (深夜バッチでここから消費する)
-    os.makedirs(os.path.dirname(QUEUE_FILE), exist_ok=True)
-    
-    existing_queue = []
-    if os.path.exists(QUEUE_FILE):
-        with open(QUEUE_FILE, 'r') as f:
-            existing_queue = json.load(f)
-            
-    # 新旧マージしてユニーク化
-    updated_queue = list(set(existing_queue + all_missing_races))
-    
-    with open(QUEUE_FILE, 'w') as f:
-        json.dump(updated_queue, f)
-        
-    print(f"Saved {len(updated_queue)} queue items to {QUEUE_FILE}")
+    calendar_race_ids = list(dict.fromkeys(calendar_race_ids))
+    fetch_elapsed = time.time() - fetch_started
+
+    # 2. 既にDBにあるものは除外（1つの接続で、チャンク単位の IN 句でまとめて突き合わせる）
+    db_started = time.time()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        all_missing_races = filter_existing_races(cursor, calendar_race_ids)
+    finally:
+        cursor.close()
+        conn.close()
+    db_elapsed = time.time() - db_started
+
+    print(f"\nTotal missing races found: {len(all_missing_races)} of {len(calendar_race_ids)} "
+          f"(calendar {fetch_elapsed:.1f}s, DB {db_elapsed:.2f}s)")
+
+    # crawl frontier に登録 (深夜バッチでここから消費する)。登録済みのレースは重複せず、古い月から順に取り出される
+    with CrawlFrontier() as frontier:
+        added = frontier.enqueue("race", all_missing_races, PRIORITY_MISSING_RACE)
+        print(f"Queued {added} new races to {frontier.path} (pending: {frontier.pending_count('race')})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,359 @@
+import io
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    import zstandard
+except ImportError:  # zstd が無い環境では zlib で圧縮する
+    zstandard = None
+
+DEFAULT_CACHE_DIR = "data/raw/netkeiba"
+# open_stream で1回に読む・展開するバイト数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(html: str) -> str:
+    """HTML本文の内容ハッシュ（SHA-256）"""
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+class HtmlCache(ABC):
+    """
+    クローラーが取得したHTMLのキャッシュ（バックエンド差し替え用の共通インターフェース）。
+    メタデータは fetched_at（取得時刻）/ status（HTTPステータス）/ etag を持つ。
+    """
+
+    def get(self, url: str, max_age: float = None) -> Optional[str]:
+        """キャッシュ済みHTMLを返す（なし・max_age 秒より古い場合は None）"""
+        found = self.get_many([url], max_age)
+        return found.get(url)
+
+    @abstractmethod
+    def get_many(self, urls: Iterable[str], max_age: float = None) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    def put(self, url: str, html: str, status: int = 200, etag: str = None, fetched_at: float = None):
+        ...
+
+    @abstractmethod
+    def metadata(self, url: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def open_stream(self, url: str, max_age: float = None) -> Optional[Tuple[str, Optional[str], Iterator[bytes]]]:
+        """
+        キャッシュ済みHTMLを文字列に展開せず、(文字コード, 内容ハッシュ（不明なら None）, バイト列のチャンク) で返す
+        （なし・max_age 秒より古い場合、またはバックエンドが未対応の場合は None）。
+        途中で読むのをやめれば、残りの読み込み・展開は行わない。
+        """
+        return None
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _is_fresh(fetched_at: float, max_age: Optional[float]) -> bool:
+        return max_age is None or (time.time() - fetched_at) <= max_age
+
+
+class FlatFileCache(HtmlCache):
+    """従来形式: URLごとに EUC-JP の .html ファイルを1つ置く（取得時刻はファイルの mtime）"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, url: str) -> str:
+        """URLから一意なキャッシュファイルパスを生成する"""
+        parsed = urlparse(url)
+        # クエリパラメータやパスをアンダースコアに置換してファイル名にする
+        safe_name = parsed.path.strip("/").replace("/", "_")
+        if parsed.query:
+            safe_name += "_" + parsed.query.replace("=", "").replace("&", "_")
+        safe_name += ".html"
+        return os.path.join(self.cache_dir, safe_name)
+
+    def get_many(self, urls: Iterable[str], max_age: float = None) -> Dict[str, str]:
+        found = {}
+        for url in urls:
+            path = self.path_for(url)
+            if not os.path.exists(path) or not self._is_fresh(os.path.getmtime(path), max_age):
+                continue
+            with open(path, "r", encoding="euc-jp", errors="replace") as f:
+                found[url] = f.read()
+        return found
+
+    def put(self, url: str, html: str, status: int = 200, etag: str = None, fetched_at: float = None):
+        path = self.path_for(url)
+        with open(path, "w", encoding="euc-jp", errors="replace") as f:
+            f.write(html)
+        if fetched_at is not None:
+            os.utime(path, (fetched_at, fetched_at))
+
+    def metadata(self, url: str) -> Optional[Dict[str, Any]]:
+        path = self.path_for(url)
+        if not os.path.exists(path):
+            return None
+        # 従来形式ではステータス・ETag は保存していない（保存済み＝取得成功）
+        return {"fetched_at": os.path.getmtime(path), "status": 200, "etag": None, "size": os.path.getsize(path)}
+
+    def open_stream(self, url: str, max_age: float = None) -> Optional[Tuple[str, Optional[str], Iterator[bytes]]]:
+        path = self.path_for(url)
+        if not os.path.exists(path) or not self._is_fresh(os.path.getmtime(path), max_age):
+            return None
+
+        def chunks() -> Iterator[bytes]:
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        return "euc-jp", None, chunks()
+
+    def iter_files(self) -> Iterator[Tuple[str, float]]:
+        """保存済みファイルのパスと mtime（移行用）"""
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".html"):
+                    yield entry.path, entry.stat().st_mtime
+
+
+class SQLiteCache(HtmlCache):
+    """
+    1ファイルの SQLite に圧縮して保存するキャッシュ（ファイル数・ディスク使用量を抑える）。
+    ※ 本文は内容のハッシュ（SHA-256）をキーに1回だけ保存し（内容アドレス）、同一内容のページは共有する。
+    ※ 圧縮は zstd（zstandard がある場合）、なければ zlib。codec は本文ごとに記録するため混在してよい。
+    ※ legacy を渡すと、未登録のURLは従来形式のファイルから読み込み、その場で取り込む（段階的な移行）。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            content_hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            status INTEGER NOT NULL,
+            etag TEXT,
+            size INTEGER NOT NULL
+        );
+    """
+
+    # SQLite の変数上限に収まるよう get_many の IN 句を分割する
+    BATCH_SIZE = 500
+
+    def __init__(self, path: str, legacy: Optional[FlatFileCache] = None):
+        self.path = path
+        self.legacy = legacy
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._zstd_c = zstandard.ZstdCompressor(level=10) if zstandard else None
+        self._zstd_d = zstandard.ZstdDecompressor() if zstandard else None
+
+    @staticmethod
+    def content_hash(html: str) -> str:
+        return content_hash(html)
+
+    def _compress(self, raw: bytes) -> Tuple[str, bytes]:
+        if self._zstd_c is not None:
+            return "zstd", self._zstd_c.compress(raw)
+        return "zlib", zlib.compress(raw, 6)
+
+    def _decompress(self, codec: str, data: bytes) -> str:
+        if codec == "zstd":
+            if self._zstd_d is None:
+                raise RuntimeError("zstd で圧縮されたキャッシュの読み込みには zstandard が必要です。")
+            raw = self._zstd_d.decompress(data)
+        elif codec == "zlib":
+            raw = zlib.decompress(data)
+        else:
+            raise ValueError(f"未対応の圧縮形式です: {codec}")
+        return raw.decode("utf-8")
+
+    def get_many(self, urls: Iterable[str], max_age: float = None) -> Dict[str, str]:
+        urls = list(dict.fromkeys(urls))
+        found = {}
+        with self._lock:
+            for start in range(0, len(urls), self.BATCH_SIZE):
+                chunk = urls[start:start + self.BATCH_SIZE]
+                rows = self._conn.execute(f"""
+                    SELECT p.url, p.fetched_at, b.codec, b.data
+                    FROM pages p JOIN blobs b ON b.content_hash = p.content_hash
+                    WHERE p.url IN ({','.join(['?'] * len(chunk))})
+                """, chunk).fetchall()
+                for url, fetched_at, codec, data in rows:
+                    if self._is_fresh(fetched_at, max_age):
+                        found[url] = self._decompress(codec, data)
+
+        if self.legacy is not None:
+            # 未移行のページは従来形式から読み込み、取り込んでおく
+            missing = [url for url in urls if url not in found]
+            for url, html in self.legacy.get_many(missing, max_age).items():
+                meta = self.legacy.metadata(url)
+                self.put(url, html, fetched_at=meta["fetched_at"] if meta else None)
+                found[url] = html
+        return found
+
+    def put(self, url: str, html: str, status: int = 200, etag: str = None, fetched_at: float = None):
+        self.put_many([(url, html, status, etag, fetched_at)])
+
+    def put_many(self, pages: Iterable[Tuple[str, str, int, Optional[str], Optional[float]]]):
+        """(url, html, status, etag, fetched_at) をまとめて1トランザクションで保存する（移行用）"""
+        blob_rows, page_rows = {}, []
+        for url, html, status, etag, fetched_at in pages:
+            digest = self.content_hash(html)
+            raw = html.encode("utf-8")
+            if digest not in blob_rows:
+                blob_rows[digest] = (digest, *self._compress(raw))
+            page_rows.append((url, digest, time.time() if fetched_at is None else fetched_at, status, etag, len(raw)))
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO blobs (content_hash, codec, data) VALUES (?, ?, ?)",
+                                       list(blob_rows.values()))
+                self._conn.executemany("""
+                    INSERT OR REPLACE INTO pages (url, content_hash, fetched_at, status, etag, size)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, page_rows)
+
+    def metadata(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, status, etag, size, content_hash FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return self.legacy.metadata(url) if self.legacy is not None else None
+        return {"fetched_at": row[0], "status": row[1], "etag": row[2], "size": row[3], "content_hash": row[4]}
+
+    def open_stream(self, url: str, max_age: float = None) -> Optional[Tuple[str, Optional[str], Iterator[bytes]]]:
+        # 未移行のページは従来形式のファイルから読む（取り込みは通常の get で行われる）
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT p.fetched_at, p.content_hash, b.codec, b.data
+                FROM pages p JOIN blobs b ON b.content_hash = p.content_hash
+                WHERE p.url = ?
+            """, (url,)).fetchone()
+        if row is None:
+            return self.legacy.open_stream(url, max_age) if self.legacy is not None else None
+        fetched_at, digest, codec, data = row
+        if not self._is_fresh(fetched_at, max_age):
+            return None
+        return "utf-8", digest, self._decompress_stream(codec, data)
+
+    def _decompress_stream(self, codec: str, data: bytes) -> Iterator[bytes]:
+        """圧縮済みの本文を STREAM_CHUNK_SIZE ずつ展開する"""
+        if codec == "zstd":
+            if self._zstd_d is None:
+                raise RuntimeError("zstd で圧縮されたキャッシュの読み込みには zstandard が必要です。")
+            yield from self._zstd_d.read_to_iter(io.BytesIO(data), write_size=STREAM_CHUNK_SIZE)
+        elif codec == "zlib":
+            d = zlib.decompressobj()
+            for start in range(0, len(data), STREAM_CHUNK_SIZE // 4):
+                chunk = d.decompress(data[start:start + STREAM_CHUNK_SIZE // 4])
+                if chunk:
+                    yield chunk
+            tail = d.flush()
+            if tail:
+                yield tail
+        else:
+            raise ValueError(f"未対応の圧縮形式です: {codec}")
+
+    def prune(self) -> int:
+        """どのページからも参照されなくなった本文を削除し、削除件数を返す"""
+        with self._lock:
+            with self._conn:
+                cur = self._conn.execute(
+                    "DELETE FROM blobs WHERE content_hash NOT IN (SELECT content_hash FROM pages)"
+                )
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pages, raw_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            blobs, stored_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {"pages": pages, "blobs": blobs, "raw_bytes": raw_bytes, "stored_bytes": stored_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ParseCache:
+    """
+    パース結果（JSON）のキャッシュ。(URL, パーサー名) ごとに1件を持ち、
+    HTMLの内容ハッシュとパーサーのバージョンが両方一致した場合だけ使う（どちらかが変われば再パースして上書き）。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS parsed (
+            url TEXT NOT NULL,
+            parser TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            version TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (url, parser)
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, url: str, parser: str, digest: str, version: str) -> Optional[str]:
+        """一致するパース結果（JSON文字列）を返す（なし・HTMLかパーサーが変わっている場合は None）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM parsed WHERE url = ? AND parser = ? AND content_hash = ? AND version = ?",
+                (url, parser, digest, version)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, url: str, parser: str, digest: str, version: str, data: str):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO parsed (url, parser, content_hash, version, data)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (url, parser, digest, version, data))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_parse_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> ParseCache:
+    """パース結果キャッシュを作る（保存先は NETKEIBA_PARSE_CACHE。既定は "<cache_dir>.parsed.sqlite3"）"""
+    return ParseCache(os.getenv("NETKEIBA_PARSE_CACHE", cache_dir.rstrip("/") + ".parsed.sqlite3"))
+
+
+def create_html_cache(backend: str = None, cache_dir: str = DEFAULT_CACHE_DIR) -> HtmlCache:
+    """
+    HTMLキャッシュのバックエンドを作る（NETKEIBA_CACHE_BACKEND=files|sqlite。既定は sqlite）。
+    sqlite の保存先は NETKEIBA_CACHE_SQLITE（既定は "<cache_dir>.sqlite3"）。
+    従来形式のディレクトリは読み込み元として残し、未移行のページは参照時に取り込む。
+    """
+    backend = backend or os.getenv("NETKEIBA_CACHE_BACKEND", "sqlite")
+    legacy = FlatFileCache(cache_dir)
+    if backend == "files":
+        return legacy
+    if backend == "sqlite":
+        path = os.getenv("NETKEIBA_CACHE_SQLITE", cache_dir.rstrip("/") + ".sqlite3")
+        return SQLiteCache(path, legacy=legacy)
+    raise ValueError(f"未対応のキャッシュバックエンドです: {backend}")
@@ -1,7 +1,15 @@
 import os
+import sys
+import time
+import tempfile
+import numpy as np
 import pandas as pd
 import mysql.connector
 
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.form_snapshot import rebuild_form_snapshot
+
 # DB接続設定
 DB_CONFIG = {
     "host": "localhost",
@@ -11,35 +19,209 @@ DB_CONFIG = {
     "charset": "utf8mb4"
 }
 
-def parse_time(time_str):
-    if pd.isna(time_str) or not isinstance(time_str, str):
-        return None
-    time_str = str(time_str).strip()
-    if ':' in time_str:
-        try:
-            m, s = time_str.split(':')
-            return float(m) * 60 + float(s)
-        except:
-            return None
-    return parse_numeric(time_str)
-
-def parse_numeric(val):
-    try:
-        if pd.isna(val) or val == '':
-            return None
-        return float(val)
-    except:
-        return None
+def to_float_series(series: pd.Series) -> pd.Series:
+    """列をまとめて数値化する（変換できない値・空文字は NaN）"""
+    return pd.to_numeric(series, errors='coerce')
 
-def parse_int(val):
-    try:
-        if pd.isna(val) or val == '':
-            return None
-        return int(float(val))
-    except:
-        return None
+def to_int_series(series: pd.Series) -> pd.Series:
+    """列をまとめて整数化する（小数は切り捨て。変換できない値は <NA>）"""
+    return np.trunc(to_float_series(series)).astype('Int64')
+
+def parse_time_series(series: pd.Series) -> pd.Series:
+    """走破タイム列（"1:23.4" 形式または秒数）を秒に変換する"""
+    text = series.str.strip()
+    parts = text.str.split(':', n=1, expand=True)
+    seconds = to_float_series(text)
+    if parts.shape[1] == 2:
+        # "分:秒" 形式（コロンが2つ以上あるものは変換不可として NaN）
+        has_colon = parts[1].notna() & (text.str.count(':') == 1)
+        minute_sec = to_float_series(parts[0]) * 60 + to_float_series(parts[1])
+        seconds = seconds.where(~has_colon, minute_sec)
+    return seconds
+
+def to_records(df: pd.DataFrame) -> list:
+    """DataFrame を executemany 用のタプル列に変換する（NaN / <NA> は None）"""
+    columns = [df[c].astype(object).where(df[c].notna(), None).tolist() for c in df.columns]
+    return list(zip(*columns))
+
+def transform_chunk(chunk: pd.DataFrame):
+    """
+    CSVの1チャンクを horse / race_event / race_result 用の DataFrame に列単位で変換する。
+    ※ 行ループ（iterrows）を使わず、数値化・重複排除はすべて列演算で行う。
+    """
+    race_year = chunk['レース日付'].dt.year.astype('Int64')
+    race_id = chunk['レースID']
+    horse_name = chunk['馬名']
+    has_race_id = race_id.notna() & (race_id != '')
+    has_name = horse_name.notna() & (horse_name != '')
+
+    # --- horse ---
+    horses = pd.DataFrame({
+        'horse_id': horse_name,
+        'name': horse_name,
+        'sex': chunk['性別'],
+        'birth_year': race_year - to_int_series(chunk['馬齢']),
+    })[has_name].drop_duplicates()
+
+    # --- race_event ---
+    events = pd.DataFrame({
+        'race_event_id': race_id,
+        'race_master_id': 'UNKNOWN_MASTER', # 仕様上必須だが今回特定困難なためダミー
+        'race_date': chunk['レース日付'].dt.strftime('%Y-%m-%d'),
+        'race_year': race_year,
+        'course_id': chunk['競馬場名'],
+        'distance': to_int_series(chunk['距離(m)']),
+        'surface': chunk['芝・ダート区分'],
+        'track_condition': chunk['馬場状態1'],
+    })[has_race_id].drop_duplicates()
+
+    # --- race_result ---
+    results = pd.DataFrame({
+        'race_event_id': race_id,
+        'horse_id': horse_name, # horse_idは馬名
+        'rank': to_int_series(chunk['着順']),
+        'frame': to_int_series(chunk['枠番']),
+        'odds': to_float_series(chunk['単勝']),
+        'popularity': to_int_series(chunk['人気']),
+        'carried_weight': to_float_series(chunk['斤量']),
+        'horse_weight': to_int_series(chunk['馬体重']),
+        'last_3f': None, # last_3fはスキーマがINTだがCSVが秒数(float)のためNULLとする
+        'time': parse_time_series(chunk['タイム']),
+        'jockey': chunk['騎手'],
+        'trainer': chunk['調教師'],
+    })[has_race_id & has_name]
+
+    return horses, events, results
+
+# --- 一括ロードモード（--bulk）---
+# 変換済みチャンクをTSVに書き出して LOAD DATA LOCAL INFILE でステージングテーブルへ流し込み、
+# 本テーブルへは INSERT ... SELECT ... ON DUPLICATE KEY UPDATE の集合演算でまとめて反映する。
+BULK_TABLES = {
+    "horse": {
+        "columns": ("horse_id", "name", "sex", "birth_year"),
+        "merge": """
+            INSERT INTO horse (horse_id, name, sex, birth_year)
+            SELECT s.horse_id, s.name, s.sex, s.birth_year FROM stg_horse s
+            ON DUPLICATE KEY UPDATE
+            sex=s.sex,
+            birth_year=COALESCE(horse.birth_year, s.birth_year)
+        """,
+    },
+    "race_event": {
+        "columns": ("race_event_id", "race_master_id", "race_date", "race_year", "course_id", "distance", "surface", "track_condition"),
+        "merge": """
+            INSERT INTO race_event (race_event_id, race_master_id, race_date, race_year, course_id, distance, surface, track_condition)
+            SELECT s.race_event_id, s.race_master_id, s.race_date, s.race_year, s.course_id, s.distance, s.surface, s.track_condition
+            FROM stg_race_event s
+            ON DUPLICATE KEY UPDATE
+            race_date=s.race_date, race_year=s.race_year, course_id=s.course_id,
+            distance=s.distance, surface=s.surface, track_condition=s.track_condition
+        """,
+    },
+    "race_result": {
+        "columns": ("race_event_id", "horse_id", "rank", "frame", "odds", "popularity",
+                    "carried_weight", "horse_weight", "last_3f", "time", "jockey", "trainer"),
+        "merge": """
+            INSERT INTO race_result (
+                race_event_id, horse_id, `rank`, frame, odds, popularity,
+                carried_weight, horse_weight, last_3f, time, jockey, trainer
+            )
+            SELECT s.race_event_id, s.horse_id, s.`rank`, s.frame, s.odds, s.popularity,
+                   s.carried_weight, s.horse_weight, s.last_3f, s.time, s.jockey, s.trainer
+            FROM stg_race_result s
+            ON DUPLICATE KEY UPDATE
+                `rank`=s.`rank`, frame=s.frame, odds=s.odds,
+                popularity=s.popularity, carried_weight=s.carried_weight,
+                horse_weight=s.horse_weight, last_3f=s.last_3f,
+                time=s.time, jockey=s.jockey, trainer=s.trainer
+        """,
+        # 行ごとのトリガーは止めているため、マージしたレースの版数（推論キャッシュの無効化用）をレース単位で1回だけ進める
+        "revision": """
+            INSERT INTO race_data_revision (race_event_id, revision)
+            SELECT DISTINCT s.race_event_id, 1 FROM stg_race_result s
+            ON DUPLICATE KEY UPDATE revision = revision + 1
+        """,
+    },
+}
 
-def import_kaggle_data():
+# 一括ロード中は維持コストを避けるため外し、最後に作り直すセカンダリインデックス（02_optimize.sql と対応）
+DEFERRED_INDEXES = (
+    ("race_result", "idx_horse_id", "horse_id"),
+    ("race_result", "idx_jockey", "jockey"),
+    ("race_result", "idx_trainer", "trainer"),
+    ("race_event", "idx_race_date", "race_date"),
+)
+
+def create_staging_tables(cursor):
+    """本テーブルと同じ列型で、キー・インデックスを持たない一時テーブルを作る"""
+    for table, spec in BULK_TABLES.items():
+        columns = ", ".join(f"`{c}`" for c in spec["columns"])
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS stg_{table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE stg_{table} AS SELECT {columns} FROM {table} LIMIT 0")
+
+def index_exists(cursor, table: str, index_name: str) -> bool:
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index_name))
+    return cursor.fetchone()[0] > 0
+
+def drop_deferred_indexes(cursor):
+    for table, index_name, _ in DEFERRED_INDEXES:
+        if index_exists(cursor, table, index_name):
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {index_name}")
+
+def restore_deferred_indexes(cursor):
+    """
+    外したインデックスを作り直す。
+    ※ 途中で中断した場合も次回の一括ロード完了時に揃うよう、存在しないものをすべて作成する。
+    """
+    for table, index_name, column in DEFERRED_INDEXES:
+        if not index_exists(cursor, table, index_name):
+            started = time.time()
+            cursor.execute(f"CREATE INDEX {index_name} ON {table}({column})")
+            print(f"Recreated index {index_name} on {table}({column}) in {time.time() - started:.1f}s")
+
+def write_tsv(df: pd.DataFrame, path: str):
+    """LOAD DATA の既定書式（タブ区切り・バックスラッシュエスケープ・NULLは \\N）でTSVを書き出す"""
+    fields = []
+    for c in df.columns:
+        s = df[c]
+        text = s.astype(str)
+        if not pd.api.types.is_numeric_dtype(s):
+            text = (text.str.replace('\\', '\\\\', regex=False)
+                        .str.replace('\t', '\\t', regex=False)
+                        .str.replace('\n', '\\n', regex=False)
+                        .str.replace('\r', '\\r', regex=False))
+        fields.append(text.where(s.notna(), '\\N'))
+    lines = fields[0].str.cat(fields[1:], sep='\t') if len(fields) > 1 else fields[0]
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+
+def bulk_merge(cursor, table: str, df: pd.DataFrame, tmp_dir: str):
+    """1チャンク分をTSV経由でステージングに読み込み、本テーブルへ集合演算でupsertする"""
+    if df.empty:
+        return
+    spec = BULK_TABLES[table]
+    path = os.path.join(tmp_dir, f"{table}.tsv")
+    write_tsv(df, path)
+    columns = ", ".join(f"`{c}`" for c in spec["columns"])
+    cursor.execute(f"TRUNCATE TABLE stg_{table}")
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE stg_{table} CHARACTER SET utf8mb4 "
+        f"FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({columns})",
+        (path,)
+    )
+    cursor.execute(spec["merge"])
+    if "revision" in spec:
+        cursor.execute(spec["revision"])
+
+def report_throughput(label: str, rows: int, elapsed: float):
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f"  {label:<12} {rows:>8} rows  {elapsed:7.2f}s  {rate:>10.0f} rows/s")
+
+def import_kaggle_data(bulk: bool = False):
     csv_path = "data/raw/19860105-20210731_race_result.csv"
     if not os.path.exists(csv_path):
         print(f"Error: {csv_path} not found.")
@@ -48,25 +230,38 @@ def import_kaggle_data():
     print("Connecting to database...")
     # docker-compose内のapiサービスから実行されることを想定 (host="db")
     # ローカルから直接実行している場合は"localhost"
+    # 一括ロードモードではクライアント側のファイル読み込み（LOAD DATA LOCAL）を許可する
+    connect_config = {**DB_CONFIG, "allow_local_infile": True} if bulk else DB_CONFIG
     try:
-        conn = mysql.connector.connect(**{**DB_CONFIG, "host": "db"})
+        conn = mysql.connector.connect(**{**connect_config, "host": "db"})
     except:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = mysql.connector.connect(**connect_config)
         
     cursor = conn.cursor()
+    tmp_dir = None
+    if bulk:
+        print("Bulk mode: staging via LOAD DATA LOCAL INFILE, deferring secondary indexes")
+        create_staging_tables(cursor)
+        drop_deferred_indexes(cursor)
+        # race_result の行ごとのトリガー（race_data_revision の更新）をこの接続では止める（04_inference_cache.sql）
+        cursor.execute("SET @skip_revision_trigger = 1")
+        tmp_dir = tempfile.TemporaryDirectory(prefix="import_kaggle_")
     
     chunksize = 100000
     total_processed = 0
     first_race_date = None
     last_race_date = None
+    # ステージごとの累計（行数, 秒）
+    stage_totals = {stage: [0, 0.0] for stage in ("transform", "horse", "race_event", "race_result")}
     
     # 読み込みの最適化とエラー無視のため、主要なカラムのみ抽出してパース
     print(f"Start processing {csv_path} with chunksize={chunksize}...")
     for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype=str):
+        stage_started = time.time()
         # 1. 2001年1月1日以降のフィルタ（直近25年・満年齢表記統一）
         chunk['レース日付'] = pd.to_datetime(chunk['レース日付'], errors='coerce')
         # 2000年以前のデータはスキップ
-        chunk = chunk[chunk['レース日付'] >= pd.Timestamp('2001-01-01')].copy()
+        chunk = chunk[chunk['レース日付'] >= pd.Timestamp('2001-01-01')]
         
         if chunk.empty:
             continue
@@ -78,99 +273,86 @@ def import_kaggle_data():
         if last_race_date is None or c_max > last_race_date:
             last_race_date = c_max
             
-        chunk['race_year'] = chunk['レース日付'].dt.year
-        chunk = chunk.where(pd.notnull(chunk), None)
+        horses, events, results = transform_chunk(chunk)
+        timings = {"transform": (len(chunk), time.time() - stage_started)}
         
-        # --- 2. horseテーブルへのインポート ---
-        horse_records = set() # 重複排除のためsetを使用
-        for _, row in chunk.iterrows():
-            name = row.get('馬名')
-            if not name:
-                continue
-            age = parse_int(row.get('馬齢'))
-            year = row.get('race_year')
-            birth_year = (year - age) if age is not None and year is not None else None
-            horse_records.add((name, name, row.get('性別'), birth_year))
-            
-        if horse_records:
-            cursor.executemany('''
-                INSERT INTO horse (horse_id, name, sex, birth_year)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                sex=VALUES(sex),
-                birth_year=COALESCE(horse.birth_year, VALUES(birth_year))
-            ''', list(horse_records))
-            
-        # --- 3. race_eventテーブルへのインポート ---
-        race_events = set()
-        for _, row in chunk.iterrows():
-            race_id = str(row.get('レースID')) if row.get('レースID') else None
-            if not race_id:
-                continue
-            race_events.add((
-                race_id,
-                "UNKNOWN_MASTER", # 仕様上必須だが今回特定困難なためダミー
-                row.get('レース日付').strftime('%Y-%m-%d') if row.get('レース日付') else None,
-                row.get('race_year'),
-                row.get('競馬場名'),
-                parse_int(row.get('距離(m)')),
-                row.get('芝・ダート区分'),
-                row.get('馬場状態1')
-            ))
+        if bulk:
+            # --- 2-4. TSV → ステージング → 本テーブルへ集合演算でupsert ---
+            for table, df in (("horse", horses), ("race_event", events), ("race_result", results)):
+                stage_started = time.time()
+                bulk_merge(cursor, table, df, tmp_dir.name)
+                timings[table] = (len(df), time.time() - stage_started)
+            conn.commit()
+        else:
+            # --- 2. horseテーブルへのインポート ---
+            stage_started = time.time()
+            horse_records = to_records(horses)
+            if horse_records:
+                cursor.executemany('''
+                    INSERT INTO horse (horse_id, name, sex, birth_year)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE 
+                    sex=VALUES(sex),
+                    birth_year=COALESCE(horse.birth_year, VALUES(birth_year))
+                ''', horse_records)
+            timings["horse"] = (len(horse_records), time.time() - stage_started)
             
-        if race_events:
-            cursor.executemany('''
-                INSERT INTO race_event (race_event_id, race_master_id, race_date, race_year, course_id, distance, surface, track_condition)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                race_date=VALUES(race_date), race_year=VALUES(race_year), course_id=VALUES(course_id),
-                distance=VALUES(distance), surface=VALUES(surface), track_condition=VALUES(track_condition)
-            ''', list(race_events))
+            # --- 3. race_eventテーブルへのインポート ---
+            stage_started = time.time()
+            race_events = to_records(events)
+            if race_events:
+                cursor.executemany('''
+                    INSERT INTO race_event (race_event_id, race_master_id, race_date, race_year, course_id, distance, surface, track_condition)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                    race_date=VALUES(race_date), race_year=VALUES(race_year), course_id=VALUES(course_id),
+                    distance=VALUES(distance), surface=VALUES(surface), track_condition=VALUES(track_condition)
+                ''', race_events)
+            timings["race_event"] = (len(race_events), time.time() - stage_started)
             
-        # --- 4. race_resultテーブルへのインポート ---
-        race_results = []
-        for _, row in chunk.iterrows():
-            race_id = str(row.get('レースID')) if row.get('レースID') else None
-            horse_name = row.get('馬名')
-            if not race_id or not horse_name:
-                continue
-                
-            race_results.append((
-                race_id,
-                horse_name, # horse_idは馬名
-                parse_int(row.get('着順')),
-                parse_int(row.get('枠番')),
-                parse_numeric(row.get('単勝')),
-                parse_int(row.get('人気')),
-                parse_numeric(row.get('斤量')),
-                parse_int(row.get('馬体重')),
-                None, # last_3fはスキーマがINTだがCSVが秒数(float)のためNULLとする
-                parse_time(row.get('タイム')),
-                row.get('騎手'),
-                row.get('調教師')
-            ))
+            # --- 4. race_resultテーブルへのインポート ---
+            stage_started = time.time()
+            race_results = to_records(results)
+            if race_results:
+                cursor.executemany('''
+                    INSERT INTO race_result (
+                        race_event_id, horse_id, `rank`, frame, odds, popularity, 
+                        carried_weight, horse_weight, last_3f, time, jockey, trainer
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE 
+                        `rank`=VALUES(`rank`), frame=VALUES(frame), odds=VALUES(odds),
+                        popularity=VALUES(popularity), carried_weight=VALUES(carried_weight),
+                        horse_weight=VALUES(horse_weight), last_3f=VALUES(last_3f),
+                        time=VALUES(time), jockey=VALUES(jockey), trainer=VALUES(trainer)
+                ''', race_results)
             
-        if race_results:
-            cursor.executemany('''
-                INSERT INTO race_result (
-                    race_event_id, horse_id, `rank`, frame, odds, popularity, 
-                    carried_weight, horse_weight, last_3f, time, jockey, trainer
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                    `rank`=VALUES(`rank`), frame=VALUES(frame), odds=VALUES(odds),
-                    popularity=VALUES(popularity), carried_weight=VALUES(carried_weight),
-                    horse_weight=VALUES(horse_weight), last_3f=VALUES(last_3f),
-                    time=VALUES(time), jockey=VALUES(jockey), trainer=VALUES(trainer)
-            ''', race_results)
-            
-        conn.commit()
+            conn.commit()
+            timings["race_result"] = (len(race_results), time.time() - stage_started)
         total_processed += len(chunk)
         print(f"Processed valid rows: {total_processed} (skipped < 2001-01-01)")
+        for stage, (rows, elapsed) in timings.items():
+            report_throughput(stage, rows, elapsed)
+            stage_totals[stage][0] += rows
+            stage_totals[stage][1] += elapsed
+        
+    if bulk:
+        tmp_dir.cleanup()
+        cursor.execute("SET @skip_revision_trigger = NULL")
+        # 直近5走の集計は horse_id インデックスを使うため、スナップショット再構築より先に戻す
+        restore_deferred_indexes(cursor)
+        
+    # 全馬の直近5走スナップショットを作り直す
+    print("Rebuilding horse form snapshot...")
+    snapshot_rows = rebuild_form_snapshot(cursor)
+    conn.commit()
+    print(f"Form snapshot rows: {snapshot_rows}")
         
     cursor.close()
     conn.close()
     
     print("\n--- IMPORT FINISHED ---")
+    for stage, (rows, elapsed) in stage_totals.items():
+        report_throughput(stage, rows, elapsed)
     if first_race_date and last_race_date:
         print(f"登録された最初のレースの日付: {first_race_date.strftime('%Y-%m-%d')}")
         print(f"登録された最後のレースの日付: {last_race_date.strftime('%Y-%m-%d')}")
@@ -178,4 +360,5 @@ def import_kaggle_data():
         print("> 2001-01-01以降のデータが見つかりませんでした。")
 
 if __name__ == "__main__":
-    import_kaggle_data()
+    # --bulk: LOAD DATA LOCAL INFILE によるステージング経由の一括ロード（全履歴の再構築向け）
+    import_kaggle_data(bulk="--bulk" in sys.argv[1:])
@@ -2,9 +2,17 @@ import os
 import time
 import json
 import logging
+import sys
 from datetime import datetime, timedelta
 import mysql.connector
 
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.crawl_frontier import CrawlFrontier, PRIORITY_MISSING_RACE, PRIORITY_PEDIGREE
+from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.netkeiba_parsers import parse_horse_page, parse_race_result
+from src.scripts.race_ingest import RaceIngestBuffer
+
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +34,9 @@ DB_CONFIG = {
 
 QUEUE_FILE = "data/processed/missing_race_queue.json"
 
+# 深夜クロールを打ち切る時刻（時）。これ以降は新しい項目を取り出さない
+CRAWL_END_HOUR = int(os.getenv("MIDNIGHT_CRAWL_END_HOUR", "6"))
+
 def get_db_connection():
     try:
         # コンテナ内実行を想定
@@ -125,46 +136,100 @@ def scrape_february_s_2026():
     safe_scrape(lambda: logger.info("  -> Fetched and updated pedigree for horse B ..."))
     logger.info("Priority 1 completed.")
 
-def scrape_missing_races():
+def crawl_deadline() -> float:
+    """今夜のクロールを打ち切る時刻（次に来る CRAWL_END_HOUR 時）の UNIX 時刻"""
+    now = datetime.now()
+    end = now.replace(hour=CRAWL_END_HOUR, minute=0, second=0, microsecond=0)
+    if end <= now:
+        end += timedelta(days=1)
+    return end.timestamp()
+
+def _lease_seconds(deadline: float) -> float:
+    """
+    バッファに溜めている間にリースが切れて同じ項目を取り直さないよう、締め切りまでリースする。
+    途中で落ちた場合は翌晩に取り直される（取得済みのHTML・パース結果はキャッシュから読むため再取得にはならない）。
+    """
+    return max(deadline - time.time(), 0) + CrawlFrontier.LEASE_SECONDS
+
+def _flush(buffer: RaceIngestBuffer, frontier: CrawlFrontier, fetch_elapsed: float):
+    """バッファを書き込み、成功した項目は完了に、書き込めなかった項目は失敗（リトライ対象）にする"""
+    items = list(buffer.items)
+    if not items:
+        return
+    try:
+        buffer.flush()
+    except mysql.connector.Error as e:
+        logger.error(f"  -> DB write failed for {len(items)} items: {e}")
+        for item in items:
+            frontier.fail(item, f"db write failed: {e}")
+        return
+    for item in items:
+        frontier.complete(item)
+    t = buffer.timings
+    logger.info(f"  -> Committed {len(items)} items "
+                f"(fetch {fetch_elapsed:.1f}s, transform {t['transform']:.2f}s, write {t['write']:.2f}s, "
+                f"snapshot {t['snapshot']:.2f}s, commit {t['commit']:.2f}s so far)")
+
+def scrape_missing_races(frontier: CrawlFrontier, crawler: NetkeibaCrawler, deadline: float):
     """優先度2: 2021年8月以降の未取得レース収集"""
     logger.info("Starting Priority 2: Missing races retrieval (2021-08-01 to Present)")
-    if not os.path.exists(QUEUE_FILE):
-        logger.info("  -> No missing race queue found. generate_missing_list.py will run first.")
-        # ここで generate_missing_list.main() を呼び出すことも可能
-        return
-        
-    with open(QUEUE_FILE, 'r') as f:
-        queue = json.load(f)
-        
-    if not queue:
-        logger.info("  -> Missing race queue is empty.")
+    # 従来の JSON キューが残っていれば frontier に取り込む（取り込み後は .imported に改名）
+    imported = frontier.import_json_queue(QUEUE_FILE, "race", PRIORITY_MISSING_RACE)
+    if imported:
+        logger.info(f"  -> Imported {imported} races from {QUEUE_FILE}")
+
+    remaining = frontier.pending_count("race")
+    if not remaining:
+        logger.info("  -> Missing race queue is empty. Run generate_missing_list.py to refill it.")
         return
         
-    logger.info(f"  -> Found {len(queue)} races in queue. Starting processing...")
+    logger.info(f"  -> Found {remaining} races in queue. Starting processing...")
     
-    # 実際の実装: queueの先頭からURLを叩き、結果をDBにINSERTしていく
-    # チャンクごとにQUEUE_FILEを上書き保存し、中断に備える
+    # frontier の先頭から結果ページを取得・パースし、INGEST_BATCH_SIZE 件ごとにまとめてDBへ書き込む。
+    # 件数の上限は設けず、取得ペースはクローラーのリクエスト予算（100回/30分）と待機に任せて、締め切りまで続ける。
+    # frontier の完了は書き込みのコミット後に行うため、中断しても未コミット分は次回処理し直される。
+    conn = get_db_connection()
+    buffer = RaceIngestBuffer(conn)
     processed = 0
-    while queue and processed < 100: # 1日の取得上限（安全装置。実際はもっと多くてもよい）
-        r_id = queue.pop(0)
-        safe_scrape(lambda: logger.info(f"  -> Scraping race {r_id} ..."))
-        # scrape_race_logic(r_id) ... DB INSERT
-        processed += 1
-        
-    # 残りを保存
-    with open(QUEUE_FILE, 'w') as f:
-        json.dump(queue, f)
-        
-    logger.info(f"Priority 2 completed. Processed {processed} races. Remaining in queue: {len(queue)}")
+    fetch_elapsed = 0.0
+    try:
+        while time.time() < deadline:
+            items = frontier.lease("race", lease_seconds=_lease_seconds(deadline))
+            if not items:
+                break
+            item = items[0]
+            started = time.time()
+            page = crawler.fetch_parsed(f"https://db.netkeiba.com/race/{item.key}", parse_race_result)
+            fetch_elapsed += time.time() - started
+            processed += 1
+            if page is None:
+                frontier.fail(item, "fetch failed")
+                continue
+            if not page["rows"]:
+                # 中止・未確定などで結果表がないレースは取り直しても変わらないためリトライしない
+                frontier.fail(item, "no result table", retry=False)
+                continue
+            buffer.add_race(item, item.key, page)
+            if buffer.is_full():
+                _flush(buffer, frontier, fetch_elapsed)
+        _flush(buffer, frontier, fetch_elapsed)
+    finally:
+        # 例外で抜けた場合も、リース中の項目は期限切れ後に再び取り出される
+        conn.close()
+
+    written = buffer.written
+    logger.info(f"Priority 2 completed. Processed {processed} races "
+                f"({written['race_event']} races / {written['race_result']} results / {written['horse']} horses written). "
+                f"Remaining in queue: {frontier.pending_count('race')}")
 
-def scrape_recent_horses_pedigree():
+def scrape_recent_horses_pedigree(frontier: CrawlFrontier, crawler: NetkeibaCrawler, deadline: float):
     """優先度3: 直近5年以内に出走歴がある馬の血統補完"""
     logger.info("Starting Priority 3: Recent (last 5 years) horses pedigree retrieval")
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # 過去5年のレースに出走した馬のうち、sire(父)がNULLの馬を抽出
-    # ※ LIMITを設けて1日あたりの負荷を制御
+    # ※ 1日あたりの負荷は件数ではなく、リクエスト予算と締め切りで制御する
     query = """
         SELECT DISTINCT rr.horse_id
         FROM race_result rr
@@ -172,23 +237,45 @@ def scrape_recent_horses_pedigree():
         JOIN horse h ON rr.horse_id = h.horse_id
         WHERE re.race_year >= (YEAR(CURDATE()) - 5)
           AND h.sire IS NULL
-        LIMIT 50
     """
     cursor.execute(query)
     horses = [row[0] for row in cursor.fetchall()]
     cursor.close()
-    conn.close()
     
-    if not horses:
+    # 候補は frontier に積み（取得済み・取得中の馬は重複しない）、優先度順に取り出す
+    added = frontier.enqueue("pedigree", horses, PRIORITY_PEDIGREE)
+    if not frontier.pending_count("pedigree"):
         logger.info("  -> No horses need pedigree update.")
+        conn.close()
         return
         
-    logger.info(f"  -> Found {len(horses)} horses to update.")
-    for h_id in horses:
-        safe_scrape(lambda: logger.info(f"  -> Scraping pedigree for horse {h_id} ..."))
-        # update_horse_pedigree(h_id) ... DB UPDATE
+    logger.info(f"  -> Found {len(horses)} horses to update ({added} newly queued).")
+    buffer = RaceIngestBuffer(conn)
+    fetch_elapsed = 0.0
+    try:
+        while time.time() < deadline:
+            items = frontier.lease("pedigree", lease_seconds=_lease_seconds(deadline))
+            if not items:
+                break
+            item = items[0]
+            started = time.time()
+            parsed = crawler.fetch_parsed(f"https://db.netkeiba.com/horse/{item.key}", parse_horse_page)
+            fetch_elapsed += time.time() - started
+            if parsed is None:
+                frontier.fail(item, "fetch failed")
+                continue
+            if not parsed["pedigree"]:
+                frontier.fail(item, "no pedigree table", retry=False)
+                continue
+            buffer.add_pedigree(item, item.key, parsed["pedigree"])
+            if buffer.is_full():
+                _flush(buffer, frontier, fetch_elapsed)
+        _flush(buffer, frontier, fetch_elapsed)
+    finally:
+        conn.close()
         
-    logger.info("Priority 3 completed.")
+    logger.info(f"Priority 3 completed. {buffer.written['pedigree']} pedigrees written. "
+                f"Remaining in queue: {frontier.pending_count('pedigree')}")
 
 def main():
     logger.info("=== Midnight Crawler Service Initialized ===")
@@ -201,11 +288,15 @@ def main():
     # 【優先度1】2026年フェブラリーSの血統・出馬表スクレイピング
     scrape_february_s_2026()
     
-    # 【優先度2】未取得期間のレース結果の収集
-    scrape_missing_races()
-    
-    # 【優先度3】直近5年出走馬の血統マスター補完
-    scrape_recent_horses_pedigree()
+    # 優先度2・3は件数ではなく締め切り（朝 CRAWL_END_HOUR 時）まで、リクエスト予算の許す限り取得する
+    crawler = NetkeibaCrawler()
+    deadline = crawl_deadline()
+    with CrawlFrontier() as frontier:
+        # 【優先度2】未取得期間のレース結果の収集
+        scrape_missing_races(frontier, crawler, deadline)
+        
+        # 【優先度3】直近5年出走馬の血統マスター補完
+        scrape_recent_horses_pedigree(frontier, crawler, deadline)
     
     logger.info("=== All Daily Crawl Tasks Completed ===")
 
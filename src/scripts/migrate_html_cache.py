@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import time
+import argparse
+from typing import Optional
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.html_cache import DEFAULT_CACHE_DIR, FlatFileCache, SQLiteCache
+
+# 従来形式のファイル名はURLから一意に戻せないため、クローラーが取得するページの形式から逆算する
+# （ファイル名 → URL。該当しないファイルは移行せず、参照時の読み込み・取り込みに任せる）
+URL_PATTERNS = [
+    (re.compile(r"^race_shutuba\.html_race_id(\d+)$"), "https://race.netkeiba.com/race/shutuba.html?race_id={0}"),
+    (re.compile(r"^top_calendar\.html_year(\d+)_month(\d+)$"), "https://race.netkeiba.com/top/calendar.html?year={0}&month={1}"),
+    (re.compile(r"^horse_ped_(\w+)$"), "https://db.netkeiba.com/horse/ped/{0}/"),
+    (re.compile(r"^horse_(\w+)$"), "https://db.netkeiba.com/horse/{0}"),
+    (re.compile(r"^race_(\d+)$"), "https://db.netkeiba.com/race/{0}"),
+]
+
+
+def url_from_filename(filename: str) -> Optional[str]:
+    name = filename[:-len(".html")] if filename.endswith(".html") else filename
+    for pattern, template in URL_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            return template.format(*m.groups())
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="従来形式（1URL1ファイル）のHTMLキャッシュを SQLite キャッシュへ移行する")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="従来形式のキャッシュディレクトリ")
+    parser.add_argument("--sqlite", default=os.getenv("NETKEIBA_CACHE_SQLITE", DEFAULT_CACHE_DIR + ".sqlite3"),
+                        help="移行先の SQLite ファイル")
+    parser.add_argument("--batch-size", type=int, default=500, help="1トランザクションで保存するページ数")
+    parser.add_argument("--delete", action="store_true", help="移行できたファイルを削除する")
+    args = parser.parse_args()
+
+    legacy = FlatFileCache(args.cache_dir)
+    cache = SQLiteCache(args.sqlite)
+    started = time.time()
+    migrated, skipped = 0, []
+    batch, batch_paths = [], []
+
+    def flush():
+        nonlocal migrated
+        cache.put_many(batch)
+        migrated += len(batch)
+        if args.delete:
+            for path in batch_paths:
+                os.remove(path)
+        batch.clear()
+        batch_paths.clear()
+
+    for path, mtime in legacy.iter_files():
+        url = url_from_filename(os.path.basename(path))
+        # 逆算したURLが同じファイル名に戻らない場合は取り違えを避けて移行しない
+        if url is None or legacy.path_for(url) != path:
+            skipped.append(path)
+            continue
+        with open(path, "r", encoding="euc-jp", errors="replace") as f:
+            batch.append((url, f.read(), 200, None, mtime))
+        batch_paths.append(path)
+        if len(batch) >= args.batch_size:
+            flush()
+            print(f"  migrated {migrated} pages...")
+    if batch:
+        flush()
+
+    stats = cache.stats()
+    cache.close()
+    print(f"Migrated {migrated} pages in {time.time() - started:.1f}s, skipped {len(skipped)}")
+    for path in skipped[:10]:
+        print(f"  skipped: {path}")
+    ratio = stats["stored_bytes"] / stats["raw_bytes"] if stats["raw_bytes"] else 0.0
+    print(f"SQLite cache: {stats['pages']} pages, {stats['blobs']} blobs, "
+          f"{stats['raw_bytes']:,} -> {stats['stored_bytes']:,} bytes ({ratio:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+import os
+import re
+import hashlib
+from bs4 import BeautifulSoup
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # lxml が無い環境では BeautifulSoup（html.parser）でパースする
+    etree = None
+    lxml_html = None
+
+# パーサーの実装（NETKEIBA_PARSER_BACKEND=lxml|bs4）。どちらも同じ結果を返す（test_netkeiba_parsers.py で検証）
+PARSER_BACKEND = os.getenv("NETKEIBA_PARSER_BACKEND", "lxml" if lxml_html is not None else "bs4")
+
+# パーサーのバージョン。このモジュールのソースのハッシュなので、パーサーのコードを変えると
+# パース結果キャッシュ（ParseCache）は自動的に無効になる
+with open(__file__, "rb") as _f:
+    PARSER_VERSION = hashlib.sha256(_f.read()).hexdigest()[:16] + ":" + PARSER_BACKEND
+
+
+def versioned(parser: Callable[[str], Any]) -> Callable[[str], Any]:
+    """
+    パース結果キャッシュの対象にするパーサーに付ける（NetkeibaCrawler.parse がバージョンを見て使う）。
+    ※ 結果は JSON でキャッシュするため、dict / list / str / 数値 / None だけで返すこと。
+    """
+    parser.parser_version = PARSER_VERSION
+    return parser
+
+
+def streamable(*targets: Tuple[str, Optional[str]]) -> Callable[[Callable[[str], Any]], Callable[[str], Any]]:
+    """
+    ページ全体ではなく targets（(タグ, class)。class が None ならタグのみ）の要素だけを見るパーサーに付ける。
+    NetkeibaCrawler.fetch_parsed は、キャッシュ済みHTMLを逐次読みながら対象要素だけを取り出し（extract_fragment）、
+    すべて閉じた時点で読み込みを打ち切ってからパースする。
+    """
+    def wrap(parser: Callable[[str], Any]) -> Callable[[str], Any]:
+        parser.stream_targets = targets
+        return parser
+    return wrap
+
+
+def extract_fragment(chunks: Iterable[bytes], encoding: str,
+                     targets: Iterable[Tuple[str, Optional[str]]]) -> Optional[str]:
+    """
+    HTMLのバイト列をチャンクごとにイベント型パーサー（lxml の HTMLPullParser）へ流し、
+    各対象の最初の要素だけを取り出した小さなHTMLを返す（lxml が無い場合は None）。
+    ※ 対象がすべて閉じた時点で以降のチャンクは読まない。対象外の要素は閉じた時点で捨てるため、
+       メモリ使用量はページ全体ではなく対象要素の大きさに比例する。
+    ※ 取り出した要素は祖先のタグ（属性なし）で包むため、td などもパーサーから元と同じように見える。
+    """
+    if etree is None:
+        return None
+    pending = list(targets)
+    active: Dict[Any, Tuple[str, Optional[str]]] = {}
+    fragments = []
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                classes = (elem.get("class") or "").split()
+                for target in pending:
+                    if elem.tag == target[0] and (target[1] is None or target[1] in classes):
+                        active[elem] = target
+                        pending.remove(target)
+                        break
+                continue
+
+            if elem in active:
+                del active[elem]
+                wrappers = [a.tag for a in elem.iterancestors() if a.tag not in ("html", "head", "body")][::-1]
+                fragments.append(
+                    "".join(f"<{tag}>" for tag in wrappers)
+                    + etree.tostring(elem, method="html", encoding="unicode", with_tail=False)
+                    + "".join(f"</{tag}>" for tag in reversed(wrappers))
+                )
+                if not pending and not active:
+                    return "<html><body>" + "".join(fragments) + "</body></html>"
+            if not active:
+                # 対象の外で閉じた要素は不要なので捨てる（祖先は開いたままなので残る）
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    return "<html><body>" + "".join(fragments) + "</body></html>"
+
+
+@versioned
+@streamable(("table", "Shutuba_Table"))
+def parse_race_card(html: str, backend: str = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    出馬表ページから出走馬のID、枠順、馬番、馬名、斤量、騎手、現在オッズを抽出する。
+    出馬表テーブルが見つからない場合は None。
+    """
+    return _backend(backend)["race_card"](html)
+
+
+@versioned
+@streamable(("title", None), ("dl", "racedata"), ("table", "race_table_01"), ("td", "race_lap_cell"))
+def parse_race_result(html: str, backend: str = None) -> Dict[str, Any]:
+    """
+    レース結果ページ（db.netkeiba.com/race/）から、タイトル・コース条件・ラップタイムと結果表（race_table_01）の各行を抽出する。
+    race_data はレース名の下の条件行（例: "ダ左1600m / 天候 : 晴 / ダート : 良 / 発走 : 15:40"。区切りの空白は &nbsp;）。
+    各行は {"cells": 各セルのテキスト（前後の空白除去済み）, "horse_id", "horse_name"}。
+    列の意味づけ（着順・通過順・オッズ等）は使う側で cells の位置から行う。
+    """
+    return _backend(backend)["race_result"](html)
+
+
+@versioned
+@streamable(("table", "blood_table"), ("table", "db_h_race_results"))
+def parse_horse_page(h_html: str, backend: str = None) -> Optional[Dict[str, Any]]:
+    """馬ページから {"pedigree": [sire, dam, damsire] または None, "career_race_ids": 全キャリアのレースID一覧} を抽出する（取得失敗時は None）"""
+    if not h_html:
+        return None
+    return _backend(backend)["horse_page"](h_html)
+
+
+@versioned
+def parse_calendar_race_ids(html: str, backend: str = None) -> List[str]:
+    """月間カレンダーページ（race.netkeiba.com/top/calendar.html）のリンクから、その月のレースID（12桁）を重複なしで抽出する"""
+    return _backend(backend)["calendar"](html)
+
+
+def _backend(name: Optional[str]) -> Dict[str, Callable[[str], Any]]:
+    name = name or PARSER_BACKEND
+    if name == "lxml" and lxml_html is None:
+        raise RuntimeError("lxml バックエンドには lxml が必要です。")
+    if name not in _BACKENDS:
+        raise ValueError(f"未対応のパーサーバックエンドです: {name}")
+    return _BACKENDS[name]
+
+
+# --- BeautifulSoup（html.parser）実装 ---
+
+def _race_card_bs4(html: str) -> Optional[List[Dict[str, Any]]]:
+    soup = BeautifulSoup(html, 'html.parser')
+    entries = []
+
+    # 出馬表テーブルを探す (netkeibaの出馬表はいくつかclassのパターンがある)
+    shutuba_table = soup.find('table', class_='Shutuba_Table')
+    if not shutuba_table:
+        return None
+
+    # TR要素から各馬の行を抽出
+    horse_rows = shutuba_table.find_all('tr', class_='HorseList')
+
+    for row in horse_rows:
+        try:
+            # 枠番
+            frame_td = row.find('td', class_='Waku')
+            frame_number = int(frame_td.text.strip()) if frame_td and frame_td.text.strip().isdigit() else None
+
+            # 馬番
+            umaban_td = row.find('td', class_='Umaban')
+            umaban = int(umaban_td.text.strip()) if umaban_td and umaban_td.text.strip().isdigit() else None
+
+            # 馬情報
+            horse_info_td = row.find('td', class_='HorseInfo')
+            horse_id = None
+            horse_name = "Unknown"
+            if horse_info_td:
+                a_tag = horse_info_td.find('a')
+                if a_tag:
+                    horse_name = a_tag.text.strip()
+                    href = a_tag.get('href', '')
+                    m = re.search(r'/horse/(\d+)', href)
+                    if m:
+                        horse_id = m.group(1)
+
+            # 斤量
+            jockey_td = row.find('td', class_='Jockey') # 斤量は騎手と同じセルまたは隣接セルにあることが多い
+            weight = 0.0
+            jockey_name = "Unknown"
+            if jockey_td:
+                # 騎手名抽出
+                jockey_a = jockey_td.find('a')
+                if jockey_a:
+                    jockey_name = jockey_a.text.strip()
+                # 斤量抽出（netkeibaの構造によるが、通常は 56.0 等直接書かれているかspanの中）
+                weight_m = re.search(r'(\d{2}\.\d)', jockey_td.text)
+                if weight_m:
+                    weight = float(weight_m.group(1))
+
+            # オッズと人気 (事前オッズ。確定前はオッズセルに記載される)
+            odds_td = row.find('td', class_='Odds')
+            odds = None
+            popularity = None
+            if odds_td:
+                txt = odds_td.text.strip()
+                # "12.3" のような数値を抽出
+                odds_m = re.search(r'(\d+\.\d+)', txt)
+                if odds_m:
+                    odds = float(odds_m.group(1))
+
+            # 人気 (人気セルがある場合)
+            pop_td = row.find('td', class_='Popularity')
+            if pop_td and pop_td.text.strip().isdigit():
+                popularity = int(pop_td.text.strip())
+
+            # 馬IDが取れなかった行（取消等）はスキップ
+            if not horse_id:
+                continue
+
+            entries.append({
+                "horse_id": horse_id,
+                "horse_name": horse_name,
+                "frame_number": frame_number,
+                "horse_number": umaban,
+                "weight_carried": weight,
+                "jockey": jockey_name,
+                "odds": odds,
+                "popularity": popularity
+            })
+
+        except Exception as e:
+            print(f"  -> Error parsing row: {e}")
+            continue
+
+    return entries
+
+
+def _race_result_bs4(html: str) -> Dict[str, Any]:
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.find('title')
+    race_data = soup.find('dl', class_='racedata')
+    race_data_span = race_data.find('span') if race_data else None
+    lap_td = soup.find('td', class_='race_lap_cell')
+
+    rows = []
+    results_table = soup.find('table', class_='race_table_01')
+    if results_table:
+        for row in results_table.find_all('tr')[1:]: # ヘッダー除外
+            cols = row.find_all('td')
+            # 馬名セル（4列目）のリンクから horse_id を取る
+            # "https://db.netkeiba.com/horse/2018105027/" -> strip('/') -> split('/') -> 末尾が ID
+            horse_a = cols[3].find('a') if len(cols) > 3 else None
+            href = horse_a.get('href', '') if horse_a else ''
+            rows.append({
+                "cells": [td.text.strip() for td in cols],
+                "horse_id": href.strip('/').split('/')[-1] if '/horse/' in href else None,
+                "horse_name": horse_a.text.strip() if horse_a else None,
+            })
+
+    return {
+        "title": title.text if title else "",
+        "race_data": race_data_span.text.strip() if race_data_span else None,
+        "lap_time": lap_td.text.strip() if lap_td else None,
+        "rows": rows,
+    }
+
+
+def _horse_page_bs4(h_html: str) -> Dict[str, Any]:
+    h_soup = BeautifulSoup(h_html, 'html.parser')
+
+    # 1. 5代血統パース
+    pedigree = None
+    blood_table = h_soup.find('table', class_='blood_table')
+    if blood_table:
+        # 簡易パース：最初のtdがsire、真ん中あたりがdam
+        tds = blood_table.find_all('td')
+        if len(tds) >= 4:
+            sire = tds[0].text.strip().replace('\n', '')
+            dam = tds[2].text.strip().replace('\n', '')
+            damsire = tds[3].text.strip().replace('\n', '')
+            pedigree = [sire, dam, damsire]
+
+    # 2. 全キャリアの成績テーブル
+    career_race_ids = []
+    career_table = h_soup.find('table', class_='db_h_race_results')
+    if career_table:
+        rows = career_table.find_all('tr')[1:]
+        for row in rows:
+            cols = row.find_all('td')
+            if len(cols) > 20: # 成績行には多数の列がある
+                r_a = cols[4].find('a')
+                href = r_a.get('href', '') if r_a else ''
+                if 'race' in href:
+                    # /race/2025xxx/ の形式
+                    r_id = href.strip('/').split('/')[-1]
+                    if r_id.isdigit():
+                        career_race_ids.append(r_id)
+    return {"pedigree": pedigree, "career_race_ids": career_race_ids}
+
+
+def _calendar_bs4(html: str) -> List[str]:
+    soup = BeautifulSoup(html, 'html.parser')
+    return _race_ids_from_hrefs(a_tag['href'] for a_tag in soup.find_all('a', href=True))
+
+
+def _race_ids_from_hrefs(hrefs: Iterable[str]) -> List[str]:
+    race_ids = []
+    for href in hrefs:
+        if 'race_id=' in href:
+            # "?race_id=202105040811" からIDを抽出
+            parts = href.split('race_id=')
+            r_id = parts[1][:12]
+            if r_id.isdigit() and len(r_id) == 12:
+                race_ids.append(r_id)
+    # 重複排除（順序を毎回同じにするためレースID順）
+    return sorted(set(race_ids))
+
+
+# --- lxml 実装（C実装のパーサーと XPath。結果は BeautifulSoup 実装と同じ） ---
+
+def _class_xpath(tag: str, cls: str, root: str = ".//") -> Any:
+    """BeautifulSoup の find_all(tag, class_=cls) と同じく、class 属性の単語のどれかが cls と一致する要素"""
+    if etree is None:
+        return None
+    return etree.XPath(f"{root}{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]")
+
+
+_SHUTUBA_TABLE = _class_xpath("table", "Shutuba_Table", root="//")
+_HORSE_LIST = _class_xpath("tr", "HorseList")
+_WAKU = _class_xpath("td", "Waku")
+_UMABAN = _class_xpath("td", "Umaban")
+_HORSE_INFO = _class_xpath("td", "HorseInfo")
+_JOCKEY = _class_xpath("td", "Jockey")
+_ODDS = _class_xpath("td", "Odds")
+_POPULARITY = _class_xpath("td", "Popularity")
+_RACE_TABLE = _class_xpath("table", "race_table_01", root="//")
+_RACE_DATA = _class_xpath("dl", "racedata", root="//")
+_LAP_CELL = _class_xpath("td", "race_lap_cell", root="//")
+_BLOOD_TABLE = _class_xpath("table", "blood_table", root="//")
+_CAREER_TABLE = _class_xpath("table", "db_h_race_results", root="//")
+
+
+def _lxml_root(html: str) -> Any:
+    # lxml は空文書や XML 宣言付きの文字列を受け付けないため、その場合は空の文書として扱う
+    if not html.strip():
+        return lxml_html.fromstring("<html></html>")
+    try:
+        return lxml_html.fromstring(html)
+    except ValueError:
+        return lxml_html.fromstring(html.encode("utf-8"), parser=lxml_html.HTMLParser(encoding="utf-8"))
+
+
+def _first(found: List[Any]) -> Any:
+    return found[0] if found else None
+
+
+def _text(node: Any) -> str:
+    return str(node.text_content())
+
+
+def _race_card_lxml(html: str) -> Optional[List[Dict[str, Any]]]:
+    root = _lxml_root(html)
+    entries = []
+
+    shutuba_table = _first(_SHUTUBA_TABLE(root))
+    if shutuba_table is None:
+        return None
+
+    for row in _HORSE_LIST(shutuba_table):
+        try:
+            frame_td = _first(_WAKU(row))
+            frame_text = _text(frame_td).strip() if frame_td is not None else ""
+            frame_number = int(frame_text) if frame_text.isdigit() else None
+
+            umaban_td = _first(_UMABAN(row))
+            umaban_text = _text(umaban_td).strip() if umaban_td is not None else ""
+            umaban = int(umaban_text) if umaban_text.isdigit() else None
+
+            horse_info_td = _first(_HORSE_INFO(row))
+            horse_id = None
+            horse_name = "Unknown"
+            if horse_info_td is not None:
+                a_tag = _first(horse_info_td.xpath(".//a"))
+                if a_tag is not None:
+                    horse_name = _text(a_tag).strip()
+                    m = re.search(r'/horse/(\d+)', a_tag.get('href', ''))
+                    if m:
+                        horse_id = m.group(1)
+
+            jockey_td = _first(_JOCKEY(row))
+            weight = 0.0
+            jockey_name = "Unknown"
+            if jockey_td is not None:
+                jockey_a = _first(jockey_td.xpath(".//a"))
+                if jockey_a is not None:
+                    jockey_name = _text(jockey_a).strip()
+                weight_m = re.search(r'(\d{2}\.\d)', _text(jockey_td))
+                if weight_m:
+                    weight = float(weight_m.group(1))
+
+            odds_td = _first(_ODDS(row))
+            odds = None
+            popularity = None
+            if odds_td is not None:
+                odds_m = re.search(r'(\d+\.\d+)', _text(odds_td).strip())
+                if odds_m:
+                    odds = float(odds_m.group(1))
+
+            pop_td = _first(_POPULARITY(row))
+            if pop_td is not None and _text(pop_td).strip().isdigit():
+                popularity = int(_text(pop_td).strip())
+
+            if not horse_id:
+                continue
+
+            entries.append({
+                "horse_id": horse_id,
+                "horse_name": horse_name,
+                "frame_number": frame_number,
+                "horse_number": umaban,
+                "weight_carried": weight,
+                "jockey": jockey_name,
+                "odds": odds,
+                "popularity": popularity
+            })
+
+        except Exception as e:
+            print(f"  -> Error parsing row: {e}")
+            continue
+
+    return entries
+
+
+def _race_result_lxml(html: str) -> Dict[str, Any]:
+    root = _lxml_root(html)
+    title = _first(root.xpath("//title"))
+    race_data = _first(_RACE_DATA(root))
+    race_data_span = _first(race_data.xpath(".//span")) if race_data is not None else None
+    lap_td = _first(_LAP_CELL(root))
+
+    rows = []
+    results_table = _first(_RACE_TABLE(root))
+    if results_table is not None:
+        for row in results_table.xpath(".//tr")[1:]:
+            cols = row.xpath(".//td")
+            horse_a = _first(cols[3].xpath(".//a")) if len(cols) > 3 else None
+            href = horse_a.get('href', '') if horse_a is not None else ''
+            rows.append({
+                "cells": [_text(td).strip() for td in cols],
+                "horse_id": href.strip('/').split('/')[-1] if '/horse/' in href else None,
+                "horse_name": _text(horse_a).strip() if horse_a is not None else None,
+            })
+
+    return {
+        "title": _text(title) if title is not None else "",
+        "race_data": _text(race_data_span).strip() if race_data_span is not None else None,
+        "lap_time": _text(lap_td).strip() if lap_td is not None else None,
+        "rows": rows,
+    }
+
+
+def _horse_page_lxml(h_html: str) -> Dict[str, Any]:
+    root = _lxml_root(h_html)
+
+    pedigree = None
+    blood_table = _first(_BLOOD_TABLE(root))
+    if blood_table is not None:
+        tds = blood_table.xpath(".//td")
+        if len(tds) >= 4:
+            pedigree = [_text(td).strip().replace('\n', '') for td in (tds[0], tds[2], tds[3])]
+
+    career_race_ids = []
+    career_table = _first(_CAREER_TABLE(root))
+    if career_table is not None:
+        for row in career_table.xpath(".//tr")[1:]:
+            cols = row.xpath(".//td")
+            if len(cols) > 20:
+                r_a = _first(cols[4].xpath(".//a"))
+                href = r_a.get('href', '') if r_a is not None else ''
+                if 'race' in href:
+                    r_id = href.strip('/').split('/')[-1]
+                    if r_id.isdigit():
+                        career_race_ids.append(r_id)
+    return {"pedigree": pedigree, "career_race_ids": career_race_ids}
+
+
+def _calendar_lxml(html: str) -> List[str]:
+    return _race_ids_from_hrefs(str(href) for href in _lxml_root(html).xpath("//a/@href"))
+
+
+_BACKENDS = {
+    "bs4": {"race_card": _race_card_bs4, "race_result": _race_result_bs4, "horse_page": _horse_page_bs4,
+            "calendar": _calendar_bs4},
+    "lxml": {"race_card": _race_card_lxml, "race_result": _race_result_lxml, "horse_page": _horse_page_lxml,
+             "calendar": _calendar_lxml},
+}
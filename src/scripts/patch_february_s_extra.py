@@ -1,11 +1,11 @@
 import os
 import sys
 import re
-from bs4 import BeautifulSoup
 import mysql.connector
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.netkeiba_parsers import parse_race_result
 
 DB_CONFIG = {
     "host": "db",
@@ -48,46 +48,39 @@ def patch_extra_columns(crawler, cursor):
     for rid in race_ids:
         print(f"Reading cached HTML for Race_ID: {rid} ...")
         url = f"https://db.netkeiba.com/race/{rid}"
-        html = crawler.fetch_html(url)
-        if not html:
+        page = crawler.fetch_parsed(url, parse_race_result)
+        if not page or not page["rows"]:
             continue
             
-        soup = BeautifulSoup(html, 'html.parser')
-        results_table = soup.find('table', class_='race_table_01')
-        if not results_table:
-            continue
-            
-        rows = results_table.find_all('tr')[1:]
-        for row in rows:
-            cols = row.find_all('td')
+        for row in page["rows"]:
+            cols = row["cells"]
             # 必要なカラムにアクセス可能かチェック（基本は21列ほどある）
             if len(cols) > 18:
                 # horse_id
-                horse_a = cols[3].find('a')
-                if not horse_a or '/horse/' not in horse_a['href']: continue
-                h_id = horse_a['href'].strip('/').split('/')[-1]
+                h_id = row["horse_id"]
+                if not h_id: continue
                 
                 # 1. frame (枠番)
-                frame_str = cols[1].text.strip()
+                frame_str = cols[1]
                 frame = int(frame_str) if frame_str.isdigit() else None
                 
                 # 2. carried_weight (斤量)
-                cw_str = cols[5].text.strip()
+                cw_str = cols[5]
                 cw = None
                 try: cw = float(cw_str)
                 except ValueError: pass
                 
                 # 3. jockey (騎手)
-                jockey_text = cols[6].text.strip().replace('\n', '')
+                jockey_text = cols[6].replace('\n', '')
                 
                 # 4. time (タイム秒数換算)
-                time_val = time_str_to_seconds(cols[7].text.strip())
+                time_val = time_str_to_seconds(cols[7])
                 
                 # 5. horse_weight (馬体重)
-                hw_val = extract_horse_weight(cols[14].text.strip())
+                hw_val = extract_horse_weight(cols[14])
                 
                 # 6. trainer (調教師)
-                trainer_text = cols[18].text.strip().replace('\n', '')
+                trainer_text = cols[18].replace('\n', '')
                 
                 cursor.execute("""
                     UPDATE race_result
@@ -6,6 +6,7 @@ import mysql.connector
 # srcディレクトリへのパスを追加
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.netkeiba_parsers import parse_race_result
 
 DB_CONFIG = {
     "host": "db",
@@ -52,32 +53,25 @@ def parse_odds_and_popularity_from_race(crawler, cursor):
         print(f"Reading cached HTML for Race_ID: {rid} ...")
         url = f"https://db.netkeiba.com/race/{rid}"
         # キャッシュ優先 (force_refresh=False)
-        html = crawler.fetch_html(url)
-        if not html:
-            continue
-            
-        soup = BeautifulSoup(html, 'html.parser')
-        results_table = soup.find('table', class_='race_table_01')
-        if not results_table:
+        page = crawler.fetch_parsed(url, parse_race_result)
+        if not page or not page["rows"]:
             continue
             
-        rows = results_table.find_all('tr')[1:]
-        for row in rows:
-            cols = row.find_all('td')
+        for row in page["rows"]:
+            cols = row["cells"]
             if len(cols) > 13:
                 # horse_id
-                horse_a = cols[3].find('a')
-                if not horse_a or '/horse/' not in horse_a['href']: continue
-                h_id = horse_a['href'].strip('/').split('/')[-1]
+                h_id = row["horse_id"]
+                if not h_id: continue
                 
                 # odds (単勝) は12列目(index 12)
-                odds_str = cols[12].text.strip()
+                odds_str = cols[12]
                 odds = None
                 try: odds = float(odds_str)
                 except ValueError: pass
                 
                 # popularity (人気) は13列目(index 13)
-                pop_str = cols[13].text.strip()
+                pop_str = cols[13]
                 pop = None
                 if pop_str.isdigit(): pop = int(pop_str)
                 
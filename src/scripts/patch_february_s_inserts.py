@@ -1,12 +1,13 @@
 import os
 import sys
 import re
-from bs4 import BeautifulSoup
 import mysql.connector
 
 # srcディレクトリへのパスを追加
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.netkeiba_parsers import parse_race_result
+from src.scripts.form_snapshot import refresh_form_snapshot
 
 DB_CONFIG = {
     "host": "db",
@@ -28,21 +29,20 @@ def main():
     cursor = conn.cursor()
 
     race_ids = ["202105010811", "202205010811", "202305010811", "202405010811", "202505010811"]
+    # 成績を書き込んだ馬（直近5走スナップショットの差分更新対象）
+    touched_horse_ids = set()
 
     for rid in race_ids:
         print(f"Applying patch for Race_ID: {rid} ...")
         url = f"https://db.netkeiba.com/race/{rid}"
         # DB上のキャッシュHTMLを読み込む（force_refresh=Falseがデフォルト）
-        html = crawler.fetch_html(url)
-        if not html:
+        page = crawler.fetch_parsed(url, parse_race_result)
+        if page is None:
             print(f"  -> Failed to read HTML for {rid}")
             continue
-
-        soup = BeautifulSoup(html, 'html.parser')
         
         # --- 日付とlap_timeの抽出 ---
-        title = soup.find('title')
-        title_text = title.text if title else ""
+        title_text = page["title"]
         date_str = None
         m = re.search(r'(\d{4})年(\d{1,2})月(\d{1,2})日', title_text)
         if m:
@@ -50,8 +50,7 @@ def main():
         else:
             date_str = f"{rid[:4]}-02-20"  # fallback
             
-        lap_td = soup.find('td', class_='race_lap_cell')
-        lap_time = lap_td.text.strip() if lap_td else None
+        lap_time = page["lap_time"]
 
         # race_eventをINSERT IGNOREで枠作成
         cursor.execute('''
@@ -65,31 +64,27 @@ def main():
         print(f"  -> Merged race_event: {rid}, date: {date_str}, lap: {lap_time}")
 
         # --- race_result の抽出 ---
-        results_table = soup.find('table', class_='race_table_01')
-        if results_table:
-            rows = results_table.find_all('tr')[1:]
-            for row in rows:
-                cols = row.find_all('td')
+        if page["rows"]:
+            for row in page["rows"]:
+                cols = row["cells"]
                 if len(cols) > 11:
                     # 着順
-                    rank_str = cols[0].text.strip()
+                    rank_str = cols[0]
                     rank = None
                     if rank_str.isdigit():
                         rank = int(rank_str)
                     
                     # horse_id
-                    horse_a = cols[3].find('a')
-                    if not horse_a or '/horse/' not in horse_a['href']:
+                    h_id = row["horse_id"]
+                    if not h_id:
                         continue
-                    # "https://db.netkeiba.com/horse/2018105027/" -> strip('/') -> "horse/2018105027" -> split('/') -> ["horse", "2018105027"]
-                    h_id = horse_a['href'].strip('/').split('/')[-1]
 
 
                     # passing_order
-                    passing = cols[10].text.strip()
+                    passing = cols[10]
 
                     # last_3f
-                    last_3f_str = cols[11].text.strip()
+                    last_3f_str = cols[11]
                     last_3f = None
                     try:
                         last_3f = float(last_3f_str)
@@ -97,7 +92,7 @@ def main():
                         pass # 数値変換不可の場合はNULL
 
                     # horse への最低限の登録（外部キー制約回避用。名前も分かる範囲で入れる）
-                    horse_name = horse_a.text.strip()
+                    horse_name = row["horse_name"]
                     cursor.execute('''
                         INSERT IGNORE INTO horse (horse_id, name) VALUES (%s, %s)
                     ''', (h_id, horse_name))
@@ -116,6 +111,10 @@ def main():
                             last_3f=COALESCE(%s, last_3f)
                         WHERE race_event_id=%s AND horse_id=%s
                     ''', (rank, passing, last_3f, rid, h_id))
+                    touched_horse_ids.add(h_id)
+
+    written = refresh_form_snapshot(cursor, touched_horse_ids)
+    print(f"Refreshed form snapshot for {len(touched_horse_ids)} horses ({written} rows)")
 
     conn.commit()
     cursor.close()
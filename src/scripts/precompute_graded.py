@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import argparse
+from datetime import date
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.api.core.database import get_db_connection
+from src.api.services.analysis_context import AnalysisContext
+from src.api.services.inference import InferenceService
+from src.api.services.inference_cache import InferenceCache
+from src.api.services.validator import ValidatorService, ValidationException
+
+
+def fetch_upcoming_targets(since: str, grades):
+    """開催日が since 以降の重賞（race_master.grade が対象グレード）の (race_event_id, race_date) 一覧"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        format_strings = ','.join(['%s'] * len(grades))
+        cursor.execute(f"""
+            SELECT re.race_event_id, re.race_date
+            FROM race_event re
+            JOIN race_master rm ON rm.race_master_id = re.race_master_id
+            WHERE re.race_date >= %s AND rm.grade IN ({format_strings})
+            ORDER BY re.race_date, re.race_event_id
+        """, (since, *grades))
+        return [(rid, str(race_date)) for rid, race_date in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="今後の重賞の推論結果を事前計算し、推論キャッシュを温める（夜間ジョブ）")
+    parser.add_argument("--since", default=date.today().isoformat(), help="対象とする開催日の下限（YYYY-MM-DD）")
+    parser.add_argument("--grades", default="G1,G2,G3", help="対象グレード（カンマ区切り）")
+    args = parser.parse_args()
+
+    targets = fetch_upcoming_targets(args.since, [g for g in args.grades.split(",") if g])
+    print(f"Upcoming graded races: {len(targets)}")
+    if not targets:
+        return
+
+    cache = InferenceCache(InferenceService.CATALOGUE_VERSION)
+    started = time.time()
+    # 過去開催・出走馬・直近5走は全対象の和集合を1回だけ読み込み、対象ごとのスコープはメモリ上から組み立てる
+    with AnalysisContext() as context:
+        context.load(targets)
+        print(f"Context loaded in {time.time() - started:.1f}s: {context.metrics()}")
+
+        for target in targets:
+            scope = context.scope(*target)
+            try:
+                ValidatorService.validate_scope(scope)
+            except ValidationException as ve:
+                print(f"  {target[0]} ({target[1]}): skipped ({ve.message})")
+                context.release([target])
+                continue
+
+            history_event_ids = [race.race_event_id for race in scope.historical_races]
+            cached, cache_hit = cache.get_or_compute(
+                history_event_ids,
+                lambda: {
+                    "history_count": len(scope.historical_races),
+                    "inference_results": InferenceService.run_inference(scope.historical_races),
+                }
+            )
+            adopted = cached["inference_results"]["adopted_conditions"]
+            scored = InferenceService.score_entries(scope.current_entries, adopted)
+            top = scored[0]["name"] if scored else "-"
+            print(f"  {target[0]} ({target[1]}): {len(adopted)} conditions, top pick {top}"
+                  f"{' (cached)' if cache_hit else ''}")
+
+            # 処理済みの対象は解放し、他の対象と共有していない過去開催・特徴量もあわせて手放す
+            context.release([target])
+
+        print(f"Remaining context after release: {context.metrics()}")
+
+    print(f"Precomputed {len(targets)} races in {time.time() - started:.1f}s, cache {cache.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# srcディレクトリへのパスを追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.scripts.form_snapshot import refresh_form_snapshot
+
+# 何件（レース・馬）分を溜めてから1トランザクションで書き込むか
+INGEST_BATCH_SIZE = 50
+
+# race_master は結果ページから特定できないため、取り込み時はダミー（import_kaggle と同じ扱い）
+UNKNOWN_RACE_MASTER = "UNKNOWN"
+
+# 結果表（race_table_01）の列位置
+COL_RANK, COL_FRAME, COL_SEX_AGE, COL_WEIGHT, COL_JOCKEY, COL_TIME = 0, 1, 4, 5, 6, 7
+COL_PASSING, COL_ODDS, COL_POPULARITY, COL_HORSE_WEIGHT, COL_TRAINER = 10, 12, 13, 14, 18
+
+SURFACES = {"芝": "芝", "ダ": "ダート", "障": "障害"}
+
+# executemany は mysql.connector 側で複数行の INSERT ... VALUES (...), (...) にまとめて送られる
+HORSE_UPSERT = """
+    INSERT INTO horse (horse_id, name, sex, birth_year)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        name=VALUES(name),
+        sex=COALESCE(VALUES(sex), sex),
+        birth_year=COALESCE(birth_year, VALUES(birth_year))
+"""
+
+PEDIGREE_UPSERT = """
+    INSERT INTO horse (horse_id, name, sire, dam, damsire)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE sire=VALUES(sire), dam=VALUES(dam), damsire=VALUES(damsire)
+"""
+
+RACE_EVENT_UPSERT = """
+    INSERT INTO race_event (
+        race_event_id, race_master_id, race_date, race_year, course_id,
+        distance, surface, track_condition, lap_time
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        race_date=COALESCE(VALUES(race_date), race_date),
+        race_year=COALESCE(VALUES(race_year), race_year),
+        course_id=COALESCE(course_id, VALUES(course_id)),
+        distance=COALESCE(VALUES(distance), distance),
+        surface=COALESCE(VALUES(surface), surface),
+        track_condition=COALESCE(VALUES(track_condition), track_condition),
+        lap_time=COALESCE(VALUES(lap_time), lap_time)
+"""
+
+RACE_RESULT_UPSERT = """
+    INSERT INTO race_result (
+        race_event_id, horse_id, `rank`, frame, odds, popularity,
+        carried_weight, horse_weight, last_3f, time, jockey, trainer, passing_order
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        `rank`=VALUES(`rank`), frame=VALUES(frame), odds=VALUES(odds),
+        popularity=VALUES(popularity), carried_weight=VALUES(carried_weight),
+        horse_weight=VALUES(horse_weight), last_3f=COALESCE(VALUES(last_3f), last_3f),
+        time=VALUES(time), jockey=VALUES(jockey), trainer=VALUES(trainer),
+        passing_order=VALUES(passing_order)
+"""
+
+
+def _to_int(text: str) -> Optional[int]:
+    return int(text) if text.isdigit() else None
+
+def _to_float(text: str) -> Optional[float]:
+    try:
+        return float(text.replace(',', ''))
+    except ValueError:
+        return None
+
+def _race_time(text: str) -> Optional[float]:
+    """走破タイム（"1:35.0" または "59.8"）を秒に変換する"""
+    if ':' in text:
+        minutes, seconds = text.split(':', 1)
+        if minutes.isdigit() and _to_float(seconds) is not None:
+            return int(minutes) * 60 + float(seconds)
+        return None
+    return _to_float(text)
+
+def _cell(cells: List[str], index: int) -> str:
+    return cells[index] if len(cells) > index else ""
+
+def race_event_row(race_id: str, page: Dict[str, Any]) -> Tuple:
+    """パース済みの結果ページから race_event の1行を作る（日付はタイトル、距離・馬場は条件行から）"""
+    race_date = None
+    m = re.search(r'(\d{4})年(\d{1,2})月(\d{1,2})日', page["title"])
+    if m:
+        race_date = f"{m.group(1)}-{m.group(2).zfill(2)}-{m.group(3).zfill(2)}"
+    race_year = int(race_date[:4]) if race_date else int(race_id[:4])
+
+    distance = surface = track_condition = None
+    race_data = page.get("race_data") or ""
+    m = re.search(r'(芝|ダ|障)\D*?(\d+)m', race_data)
+    if m:
+        surface = SURFACES[m.group(1)]
+        distance = int(m.group(2))
+    m = re.search(r'(?:芝|ダート)\s*:\s*(\S+)', race_data)
+    if m:
+        track_condition = m.group(1)
+
+    # レースIDの5〜6桁目は競馬場コード（"05" = 東京）
+    return (race_id, UNKNOWN_RACE_MASTER, race_date, race_year, race_id[4:6],
+            distance, surface, track_condition, page["lap_time"])
+
+def race_result_rows(race_id: str, page: Dict[str, Any], race_year: int) -> Tuple[List[Tuple], List[Tuple]]:
+    """結果表の各行から (race_result の行, horse の行) を作る（horse_id が取れない行は除く）"""
+    results, horses = [], []
+    for row in page["rows"]:
+        h_id = row["horse_id"]
+        cells = row["cells"]
+        if not h_id or len(cells) <= COL_TIME:
+            continue
+        sex_age = _cell(cells, COL_SEX_AGE)
+        age = _to_int(sex_age[1:])
+        horse_weight = re.match(r'(\d+)', _cell(cells, COL_HORSE_WEIGHT))
+        # 調教師は "[西] 名前" の形式で所属が前に付く
+        trainer = re.sub(r'^\[.\]\s*', '', _cell(cells, COL_TRAINER)) or None
+
+        results.append((
+            race_id, h_id,
+            _to_int(_cell(cells, COL_RANK)),
+            _to_int(_cell(cells, COL_FRAME)),
+            _to_float(_cell(cells, COL_ODDS)),
+            _to_int(_cell(cells, COL_POPULARITY)),
+            _to_float(_cell(cells, COL_WEIGHT)),
+            int(horse_weight.group(1)) if horse_weight else None,
+            # last_3f はスキーマがINTだが結果表は秒数のためNULLとする（import_kaggle と同じ扱い）
+            None,
+            _race_time(_cell(cells, COL_TIME)),
+            _cell(cells, COL_JOCKEY) or None,
+            trainer,
+            _cell(cells, COL_PASSING) or None,
+        ))
+        horses.append((h_id, row["horse_name"] or h_id, sex_age[:1] or None,
+                       race_year - age if age is not None else None))
+    return results, horses
+
+
+class RaceIngestBuffer:
+    """
+    パース済みのレース結果・血統を溜めておき、batch_size 件（レース・馬）ごとに1トランザクションで書き込む。
+    ※ 書き込みは表ごとの複数行 upsert にまとめ、成績を書いた馬の直近5走スナップショットも同じトランザクションで更新する。
+    ※ 各段階（行への変換 / 書き込み / スナップショット / コミット）の所要時間を timings に積算する。
+    """
+
+    def __init__(self, conn, batch_size: int = INGEST_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        # 書き込み待ちの項目（frontier の CrawlItem など。flush が成功したら呼び出し側で完了にする）
+        self.items: List[Any] = []
+        self.timings = {"transform": 0.0, "write": 0.0, "snapshot": 0.0, "commit": 0.0}
+        self.written = {"race_event": 0, "race_result": 0, "horse": 0, "pedigree": 0}
+        self._horses: Dict[str, Tuple] = {}
+        self._events: List[Tuple] = []
+        self._results: List[Tuple] = []
+        self._pedigrees: Dict[str, Tuple] = {}
+
+    def add_race(self, item: Any, race_id: str, page: Dict[str, Any]):
+        started = time.perf_counter()
+        event = race_event_row(race_id, page)
+        results, horses = race_result_rows(race_id, page, event[3])
+        self._events.append(event)
+        self._results.extend(results)
+        for horse in horses:
+            self._horses[horse[0]] = horse
+        self.items.append(item)
+        self.timings["transform"] += time.perf_counter() - started
+
+    def add_pedigree(self, item: Any, horse_id: str, pedigree: List[str]):
+        sire, dam, damsire = pedigree
+        self._pedigrees[horse_id] = (horse_id, f"Horse_{horse_id}", sire, dam, damsire)
+        self.items.append(item)
+
+    def is_full(self) -> bool:
+        return len(self.items) >= self.batch_size
+
+    def flush(self) -> List[Any]:
+        """
+        溜めた行を書き込んでコミットし、書き込んだ項目を返す。
+        失敗した場合はロールバックして例外を送出する（どちらの場合もバッファは空になる）。
+        """
+        items = self.items
+        if not items:
+            return items
+        cursor = self.conn.cursor()
+        try:
+            started = time.perf_counter()
+            # 外部キーの向きに合わせて horse → race_event → race_result の順に書く
+            if self._horses:
+                cursor.executemany(HORSE_UPSERT, list(self._horses.values()))
+            if self._pedigrees:
+                cursor.executemany(PEDIGREE_UPSERT, list(self._pedigrees.values()))
+            if self._events:
+                cursor.executemany(RACE_EVENT_UPSERT, self._events)
+            if self._results:
+                cursor.executemany(RACE_RESULT_UPSERT, self._results)
+            self.timings["write"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            if self._horses:
+                refresh_form_snapshot(cursor, self._horses.keys())
+            self.timings["snapshot"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            self.conn.commit()
+            self.timings["commit"] += time.perf_counter() - started
+        except Exception:
+            self.conn.rollback()
+            raise
+        else:
+            self.written["race_event"] += len(self._events)
+            self.written["race_result"] += len(self._results)
+            self.written["horse"] += len(self._horses)
+            self.written["pedigree"] += len(self._pedigrees)
+        finally:
+            cursor.close()
+            self.items = []
+            self._horses, self._events, self._results, self._pedigrees = {}, [], [], {}
+        return items
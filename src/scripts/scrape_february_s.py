@@ -7,6 +7,9 @@ import mysql.connector
 # srcディレクトリへのパスを追加
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 from src.scripts.crawl_netkeiba import NetkeibaCrawler
+from src.scripts.fetch_scheduler import FetchScheduler
+from src.scripts.netkeiba_parsers import parse_horse_page, parse_race_result
+from src.scripts.form_snapshot import refresh_form_snapshot
 
 DB_CONFIG = {
     "host": "db",
@@ -34,42 +37,30 @@ def scrape_trend_data(crawler):
     for rid in race_ids:
         print(f"Scraping Trend for Race_ID: {rid} ...")
         url = f"https://db.netkeiba.com/race/{rid}"
-        html = crawler.fetch_html(url)
-        if not html: 
+        # 結果表・ラップ・タイトルだけを逐次抽出してパースする（パース結果はパッチスクリプトと共有）
+        page = crawler.fetch_parsed(url, parse_race_result)
+        if page is None: 
             print(f"  -> Failed to fetch {rid}")
             continue
-            
-        soup = BeautifulSoup(html, 'html.parser')
         
         # 1. ラップタイムの抽出
-        lap_td = soup.find('td', class_='race_lap_cell')
-        lap_time = lap_td.text.strip() if lap_td else None
+        lap_time = page["lap_time"]
         if lap_time:
             cursor.execute("UPDATE race_event SET lap_time=%s WHERE race_event_id=%s", (lap_time, rid))
             print(f"  -> Extracted lap time: {lap_time}")
             
         # 2. 通過順位と馬場状態の抽出
-        # 馬場状態 (Track Condition)
-        diary_snap = soup.find('div', class_='data_intro')
-        if diary_snap:
-            text = diary_snap.text
-            if '芝:' in text or 'ダ:' in text:
-                # 簡易判定
-                pass # すでに race_event にはKaggleから入っているので一旦スキップしてもよい
+        # 馬場状態 (Track Condition) はすでに race_event にKaggleから入っているのでスキップ
                 
         # 各馬の通過順位
-        results_table = soup.find('table', class_='race_table_01')
-        if results_table:
-            rows = results_table.find_all('tr')[1:] # ヘッダー除外
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) > 10:
-                    horse_a_tag = cols[3].find('a')
-                    if horse_a_tag and '/horse/' in horse_a_tag['href']:
-                        h_id = horse_a_tag['href'].split('/')[-2]
-                        # 通過順は通常10または11列目（<div>または直接テキスト）
-                        passing = cols[10].text.strip()
-                        cursor.execute("UPDATE race_result SET passing_order=%s WHERE race_event_id=%s AND horse_id=%s", (passing, rid, h_id))
+        if page["rows"]:
+            for row in page["rows"]:
+                cols = row["cells"]
+                if len(cols) > 10 and row["horse_id"]:
+                    h_id = row["horse_id"]
+                    # 通過順は通常10または11列目（<div>または直接テキスト）
+                    passing = cols[10]
+                    cursor.execute("UPDATE race_result SET passing_order=%s WHERE race_event_id=%s AND horse_id=%s", (passing, rid, h_id))
             print(f"  -> Extracted passing orders for horses in {rid}")
             
     conn.commit()
@@ -118,24 +109,18 @@ def scrape_horse_data(crawler):
     total_race_results_synced = 0
     total_pedigree_synced = 0
     
-    for h_id in horse_ids:
-        h_url = f"https://db.netkeiba.com/horse/{h_id}"
-        print(f"Scraping horse profile for {h_id} ...")
-        h_html = crawler.fetch_html(h_url)
-        if not h_html: continue
-        
-        h_soup = BeautifulSoup(h_html, 'html.parser')
-        
-        # 1. 5代血統パース
-        blood_table = h_soup.find('table', class_='blood_table')
-        if blood_table:
-            # 簡易パース：最初のtdがsire、真ん中あたりがdam
-            tds = blood_table.find_all('td')
-            if len(tds) >= 3:
-                sire = tds[0].text.strip().replace('\n', '')
-                dam = tds[2].text.strip().replace('\n', '')
-                damsire = tds[3].text.strip().replace('\n', '')
-                
+    # 取得はスケジューラーに予約し、パースは待機と並行して進める（DB書き込みは完了順にこのスレッドで行う）
+    horse_urls = {f"https://db.netkeiba.com/horse/{h_id}": h_id for h_id in horse_ids}
+    with FetchScheduler(crawler) as scheduler:
+        for h_url, parsed in scheduler.fetch_many(horse_urls, parser=parse_horse_page):
+            h_id = horse_urls[h_url]
+            print(f"Scraped horse profile for {h_id}")
+            if parsed is None: continue
+            pedigree, career_race_ids = parsed["pedigree"], parsed["career_race_ids"]
+            
+            # 1. 5代血統
+            if pedigree:
+                sire, dam, damsire = pedigree
                 cursor.execute("""
                     INSERT IGNORE INTO horse (horse_id, name, sire, dam, damsire)
                     VALUES (%s, %s, %s, %s, %s)
@@ -143,31 +128,23 @@ def scrape_horse_data(crawler):
                 """, (h_id, f"Horse_{h_id}", sire, dam, damsire))
                 total_pedigree_synced += 1
                 
-        # 2. 全キャリアの成績テーブル同期
-        career_table = h_soup.find('table', class_='db_h_race_results')
-        if career_table:
-            rows = career_table.find_all('tr')[1:]
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) > 20: # 成績行には多数の列がある
-                    r_a = cols[4].find('a')
-                    if r_a and 'race' in r_a['href']:
-                        # /race/2025xxx/ の形式
-                        r_id = r_a['href'].strip('/').split('/')[-1]
-                        if r_id.isdigit():
-                            # レース成績として登録 (最低限のモック同期)
-                            # 実運用では各種データをcols[]から変換して流し込む
-                            total_race_results_synced += 1
-                            # 今回はカウントのみ・または簡易INSERT IGNOREで処理
-                            cursor.execute("""
-                                INSERT IGNORE INTO race_event (race_event_id, race_master_id) 
-                                VALUES (%s, 'UNKNOWN')
-                            """, (r_id,))
-                            cursor.execute("""
-                                INSERT IGNORE INTO race_result (race_event_id, horse_id, `rank`) 
-                                VALUES (%s, %s, %s)
-                            """, (r_id, h_id, 0)) # rank等は本当は抽出する
+            # 2. 全キャリアの成績テーブル同期
+            for r_id in career_race_ids:
+                # レース成績として登録 (最低限のモック同期)
+                # 実運用では各種データをcols[]から変換して流し込む
+                total_race_results_synced += 1
+                # 今回はカウントのみ・または簡易INSERT IGNOREで処理
+                cursor.execute("""
+                    INSERT IGNORE INTO race_event (race_event_id, race_master_id) 
+                    VALUES (%s, 'UNKNOWN')
+                """, (r_id,))
+                cursor.execute("""
+                    INSERT IGNORE INTO race_result (race_event_id, horse_id, `rank`) 
+                    VALUES (%s, %s, %s)
+                """, (r_id, h_id, 0)) # rank等は本当は抽出する
                             
+    # 同期した馬の直近5走スナップショットを差分更新
+    refresh_form_snapshot(cursor, horse_ids)
     conn.commit()
     cursor.close()
     conn.close()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from src.scripts.crawl_frontier import CrawlFrontier
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        print(f"Error: {message}")
+        sys.exit(1)
+
+
+def status_of(frontier: CrawlFrontier, kind: str, key: str) -> tuple:
+    return frontier._conn.execute(
+        "SELECT status, attempts, priority, available_at FROM frontier WHERE kind = ? AND item_key = ?", (kind, key)
+    ).fetchone()
+
+
+def main():
+    print("Checking crawl frontier state transitions...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with CrawlFrontier(os.path.join(tmp_dir, "frontier.sqlite3")) as frontier:
+            # 重複除去: 同じ呼び出し内・登録済みの項目はどちらも追加しない
+            check(frontier.enqueue("race", ["r1", "r2", "r1"], 2) == 2, "enqueue should add 2 unique items")
+            check(frontier.enqueue("race", ["r2", "r3"], 2) == 1, "enqueue should skip already queued items")
+            check(frontier.pending_count("race") == 3, "3 races should be pending")
+
+            # 優先度の引き上げ: 待ちの項目を高い優先度で登録し直すと先に取り出される（低い優先度では下げない）
+            frontier.enqueue("race", ["r3"], 1)
+            frontier.enqueue("race", ["r1"], 5)
+            check(status_of(frontier, "race", "r3")[2] == 1, "re-enqueue with higher priority should raise it")
+            check(status_of(frontier, "race", "r1")[2] == 2, "re-enqueue with lower priority should not lower it")
+
+            # 取り出し順: 優先度 → 登録順
+            order = [item.key for item in frontier.lease("race", limit=3)]
+            check(order == ["r3", "r1", "r2"], f"lease order should be priority then insertion, got {order}")
+            check(frontier.lease("race") == [], "leased items should not be leased again")
+            check(frontier.pending_count("race") == 3, "leased items still count as pending")
+
+            # complete: done になり、以後取り出されない
+            frontier.enqueue("done", ["d1"], 1)
+            done = frontier.lease("done")[0]
+            frontier.complete(done)
+            check(status_of(frontier, "done", "d1")[0] == "done", "complete should mark the item done")
+            check(frontier.enqueue("done", ["d1"], 1) == 0, "completed items should not be re-added")
+
+            # 期限切れのリースは次の lease で取り出し直される
+            frontier.enqueue("expire", ["e1"], 1)
+            first = frontier.lease("expire", lease_seconds=0.01)[0]
+            time.sleep(0.05)
+            again = frontier.lease("expire")
+            check([i.key for i in again] == ["e1"], "expired lease should be recovered")
+            check(again[0].attempts == first.attempts + 1, "re-leasing an expired item counts as another attempt")
+
+            # fail: バックオフ付きで待ちに戻り、MAX_ATTEMPTS 回目で failed になる
+            frontier.enqueue("retry", ["f1"], 1)
+            item = frontier.lease("retry")[0]
+            before = time.time()
+            frontier.fail(item, "boom")
+            status, attempts, _, available_at = status_of(frontier, "retry", "f1")
+            check(status == "pending" and attempts == 1, "first failure should go back to pending")
+            check(available_at >= before + CrawlFrontier.RETRY_BACKOFF, "failure should apply the retry backoff")
+            check(frontier.lease("retry") == [], "backed-off items should not be leased before available_at")
+            for attempt in range(2, CrawlFrontier.MAX_ATTEMPTS + 1):
+                frontier._conn.execute("UPDATE frontier SET available_at = 0 WHERE item_key = 'f1'")
+                item = frontier.lease("retry")[0]
+                check(item.attempts == attempt, f"attempts should be {attempt}")
+                frontier.fail(item, "boom")
+                _, _, _, available_at = status_of(frontier, "retry", "f1")
+                if attempt < CrawlFrontier.MAX_ATTEMPTS:
+                    expected = CrawlFrontier.RETRY_BACKOFF * (2 ** (attempt - 1))
+                    check(available_at - time.time() > expected - 5, f"backoff after attempt {attempt} should double")
+            check(status_of(frontier, "retry", "f1")[0] == "failed", "MAX_ATTEMPTS failures should mark the item failed")
+            check(frontier.requeue_failed("retry") == 1, "requeue_failed should return failed items")
+            check(status_of(frontier, "retry", "f1")[:2] == ("pending", 0), "requeued items should reset attempts")
+
+            # fail(retry=False) は試行回数に関係なく failed
+            frontier.enqueue("permanent", ["p1"], 1)
+            frontier.fail(frontier.lease("permanent")[0], "gone", retry=False)
+            check(status_of(frontier, "permanent", "p1")[0] == "failed", "fail(retry=False) should mark failed")
+
+            # release: 試行回数を戻して待ちに戻す
+            frontier.enqueue("release", ["x1"], 1)
+            item = frontier.lease("release")[0]
+            frontier.release(item)
+            check(status_of(frontier, "release", "x1")[:2] == ("pending", 0), "release should roll back attempts")
+            check(frontier.lease("release")[0].attempts == 1, "released item should be leasable again")
+
+            stats = frontier.stats()
+            check(stats["race"] == {"leased": 3}, f"unexpected stats for race: {stats.get('race')}")
+
+    print("\nCrawl frontier tests Completed Successfully.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import threading
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from src.scripts import fetch_scheduler
+from src.scripts.crawl_netkeiba import HostTokenBucket
+from src.scripts.fetch_scheduler import FetchScheduler
+
+# 礼儀ルールの待機を短くして検証する（送信間隔 = 読み込み + 事前 = 0.2秒、403/429 の停止 = 1秒）
+fetch_scheduler.PRE_SLEEP_RANGE = (0.1, 0.1)
+fetch_scheduler.POST_SLEEP_RANGE = (0.1, 0.1)
+fetch_scheduler.DEAD_SLEEP_RANGE = (1.0, 1.0)
+FetchScheduler.RETRY_BACKOFF = 0.3
+GAP = 0.2
+# time.time() の粒度・スレッド切り替えの揺れ
+SLACK = 0.02
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        print(f"Error: {message}")
+        sys.exit(1)
+
+
+class StubCrawler:
+    """NetkeibaCrawler の代わり: キャッシュは辞書、request_once は送信時刻を記録して応答を返す"""
+
+    base_url = "https://db.netkeiba.com"
+
+    def __init__(self, cached=None, errors=None):
+        self.cached = cached or {}
+        # URL → 送信ごとに送出する例外のリスト（尽きたら正常応答）
+        self.errors = {url: list(e) for url, e in (errors or {}).items()}
+        self.rate_limit = HostTokenBucket(state_file=None)
+        self.requests = []
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self._lock = threading.Lock()
+
+    def read_cache_many(self, urls, force_refresh=False, max_age=None):
+        return {url: self.cached[url] for url in urls if url in self.cached}
+
+    def request_once(self, url):
+        host = FetchScheduler.host_key(url)
+        with self._lock:
+            started = time.time()
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self.in_flight[host])
+        try:
+            time.sleep(0.05)
+            errors = self.errors.get(url)
+            if errors:
+                raise errors.pop(0)
+            return f"<html>{url}</html>"
+        finally:
+            with self._lock:
+                self.in_flight[host] -= 1
+                self.requests.append((host, url, started, time.time()))
+
+    def parse(self, url, html, parser):
+        return parser(html)
+
+
+def http_error(status_code: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code}", response=response)
+
+
+def starts_for(crawler: StubCrawler, host: str):
+    return sorted((started, ended, url) for h, url, started, ended in crawler.requests if h == host)
+
+
+def check_cache_hits():
+    urls = [f"https://db.netkeiba.com/horse/{i}" for i in range(5)]
+    crawler = StubCrawler(cached={url: f"cached {url}" for url in urls})
+    with FetchScheduler(crawler) as scheduler:
+        results = dict(scheduler.fetch_many(urls))
+        check(results == crawler.cached, "cache hits should complete with the cached HTML")
+        check(not scheduler._hosts, "cache hits should not be queued for the dispatcher")
+    check(crawler.requests == [], "cache hits should not send requests")
+    check(scheduler.stats["cache_hits"] == 5 and scheduler.stats["requests"] == 0, f"unexpected stats: {scheduler.stats}")
+
+
+def check_per_host_spacing():
+    netkeiba = [f"https://db.netkeiba.com/race/{i}" for i in range(3)] + ["https://race.netkeiba.com/top/calendar.html"]
+    other = [f"https://example.com/page/{i}" for i in range(3)]
+    crawler = StubCrawler()
+    started = time.time()
+    with FetchScheduler(crawler) as scheduler:
+        results = dict(scheduler.fetch_many(netkeiba + other, parser=len))
+    check(len(results) == 7 and all(results.values()), "all URLs should be fetched and parsed")
+    check(max(crawler.max_in_flight.values()) == 1, f"only one request per host may be in flight: {crawler.max_in_flight}")
+
+    for host in ("netkeiba.com", "example.com"):
+        sent = starts_for(crawler, host)
+        for (_, prev_end, _), (next_start, _, url) in zip(sent, sent[1:]):
+            check(next_start - prev_end >= GAP - SLACK, f"{url} was sent {next_start - prev_end:.3f}s after the previous request")
+    # db.netkeiba.com と race.netkeiba.com は同じホストとして1本ずつ送る
+    check(len(starts_for(crawler, "netkeiba.com")) == 4, "netkeiba subdomains should share one host queue")
+    # ホストが違えば互いの待ちには影響しない（4件 + 3件の直列より明らかに短い）
+    elapsed = time.time() - started
+    check(elapsed < 6 * GAP + 7 * 0.05, f"hosts should be fetched in parallel (took {elapsed:.2f}s)")
+
+
+def check_retry_backoff():
+    url = "https://db.netkeiba.com/race/retry"
+    crawler = StubCrawler(errors={url: [requests.exceptions.ConnectionError("reset")]})
+    with FetchScheduler(crawler) as scheduler:
+        html = scheduler.submit(url).result(timeout=10)
+    check(html == f"<html>{url}</html>", "retried request should complete with the HTML")
+    sent = starts_for(crawler, "netkeiba.com")
+    check(len(sent) == 2, f"expected 1 retry, got {len(sent) - 1}")
+    gap = sent[1][0] - sent[0][1]
+    check(gap >= FetchScheduler.RETRY_BACKOFF - SLACK, f"retry should wait for the backoff ({gap:.3f}s)")
+    check(scheduler.stats["retries"] == 1 and scheduler.stats["failures"] == 0, f"unexpected stats: {scheduler.stats}")
+
+
+def check_dead_hold():
+    blocked = "https://db.netkeiba.com/race/blocked"
+    after = "https://db.netkeiba.com/race/after"
+    other = "https://example.com/page/0"
+    crawler = StubCrawler(errors={blocked: [http_error(429)]})
+    with FetchScheduler(crawler) as scheduler:
+        first = scheduler.submit(blocked)
+        check(first.result(timeout=10) == "", "403/429 should complete with an empty page without retrying")
+        held_at = time.time()
+        rest = scheduler.submit_many([after, other])
+        check(rest[other].result(timeout=10) != "", "other hosts should not be held")
+        other_done = time.time()
+        rest[after].result(timeout=10)
+    check(other_done - held_at < 0.5, "other hosts should be fetched without waiting for the hold")
+    sent = starts_for(crawler, "netkeiba.com")
+    check([url for _, _, url in sent] == [blocked, after], "blocked URL should not be retried")
+    hold = sent[1][0] - sent[0][1]
+    check(hold >= fetch_scheduler.DEAD_SLEEP_RANGE[0] - SLACK, f"host should be held after 429 ({hold:.3f}s)")
+
+
+def check_close_waits_for_parse():
+    """close() はHTML取得の完了後に登録されるパースまで待ってからパース用プールを止める"""
+    class SlowCacheCrawler(StubCrawler):
+        def read_cache_many(self, urls, force_refresh=False, max_age=None):
+            # パースの予約（done-callback の登録）が済んでからキャッシュヒットで完了させる
+            time.sleep(0.1)
+            return super().read_cache_many(urls, force_refresh, max_age)
+
+    url = "https://db.netkeiba.com/horse/cached"
+    crawler = SlowCacheCrawler(cached={url: "cached"})
+    scheduler = FetchScheduler(crawler)
+    forget = scheduler._forget
+
+    def slow_forget(url):
+        # 予約の解除（close() の終了条件）からパースの登録までの間に close() が進むようにする
+        forget(url)
+        time.sleep(0.2)
+
+    scheduler._forget = slow_forget
+    result = scheduler.submit(url, parser=len)
+    scheduler.close()
+    check(result.done(), "close() returned before the parse result completed")
+    check(result.result() == len("cached"), "parse result should survive close()")
+
+
+def main():
+    print("Checking FetchScheduler politeness guarantees...")
+    for check_fn in (check_cache_hits, check_per_host_spacing, check_retry_backoff, check_dead_hold,
+                     check_close_waits_for_parse):
+        check_fn()
+        print(f"  {check_fn.__name__}: ok")
+    print("\nFetch scheduler tests Completed Successfully.")
+
+
+if __name__ == "__main__":
+    main()
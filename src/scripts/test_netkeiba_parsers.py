@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from src.scripts import netkeiba_parsers
+from src.scripts.netkeiba_parsers import parse_calendar_race_ids, parse_horse_page, parse_race_card, parse_race_result
+
+# 保存済みHTML（fixtures/netkeiba/*.html）と、その期待値（同名の .json。BeautifulSoup 実装の出力）
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "netkeiba")
+
+# ファイル名の接頭辞 → パーサー
+PARSERS = {
+    "race_": parse_race_result,
+    "shutuba_": parse_race_card,
+    "horse_": parse_horse_page,
+    "calendar_": parse_calendar_race_ids,
+}
+
+
+def load_fixtures():
+    for name in sorted(os.listdir(FIXTURE_DIR)):
+        if not name.endswith(".html"):
+            continue
+        parser = next(p for prefix, p in PARSERS.items() if name.startswith(prefix))
+        with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as f:
+            yield name, parser, f.read()
+
+
+def main():
+    # --update: BeautifulSoup 実装の出力で期待値を作り直す（パーサーの仕様を変えたときだけ使う）
+    update = "--update" in sys.argv
+    backends = ["bs4"] + (["lxml"] if netkeiba_parsers.lxml_html is not None else [])
+    print(f"Checking parsers against golden files (backends: {', '.join(backends)})...")
+
+    failed = False
+    for name, parser, html in load_fixtures():
+        golden_path = os.path.join(FIXTURE_DIR, name[:-len(".html")] + ".json")
+        if update:
+            with open(golden_path, "w", encoding="utf-8") as f:
+                json.dump(parser(html, backend="bs4"), f, ensure_ascii=False, indent=2)
+                f.write("\n")
+        with open(golden_path, "r", encoding="utf-8") as f:
+            expected = json.load(f)
+
+        timings = []
+        for backend in backends:
+            started = time.perf_counter()
+            for _ in range(20):
+                result = parser(html, backend=backend)
+            timings.append(f"{backend} {(time.perf_counter() - started) / 20 * 1000:.2f}ms")
+            # キャッシュと同じく JSON を通した値で比較する（tuple と list などの差を吸収）
+            if json.loads(json.dumps(result, ensure_ascii=False)) != expected:
+                print(f"Error: {parser.__name__} ({backend}) does not match {os.path.basename(golden_path)}")
+                failed = True
+        # 対象要素だけの逐次抽出（EUC-JP のバイト列を小さなチャンクで流す）からも同じ結果になること
+        if netkeiba_parsers.etree is not None and hasattr(parser, "stream_targets"):
+            raw = html.encode("euc-jp")
+            chunks = (raw[i:i + 1024] for i in range(0, len(raw), 1024))
+            fragment = netkeiba_parsers.extract_fragment(chunks, "euc-jp", parser.stream_targets)
+            for backend in backends:
+                if json.loads(json.dumps(parser(fragment, backend=backend), ensure_ascii=False)) != expected:
+                    print(f"Error: {parser.__name__} ({backend}) on the streamed fragment does not match {os.path.basename(golden_path)}")
+                    failed = True
+            timings.append(f"fragment {len(fragment)}/{len(html)} chars")
+        print(f"  {name}: {', '.join(timings)}")
+
+    # 空文字列（取得失敗）はどの実装でも同じ扱い
+    for backend in backends:
+        if parse_race_card("", backend=backend) is not None or parse_horse_page("", backend=backend) is not None:
+            print(f"Error: empty HTML should parse to None ({backend})")
+            failed = True
+        if parse_race_result("", backend=backend) != {"title": "", "race_data": None, "lap_time": None, "rows": []}:
+            print(f"Error: empty race result page should have no rows ({backend})")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print("\nParser golden tests Completed Successfully.")
+
+
+if __name__ == "__main__":
+    main()
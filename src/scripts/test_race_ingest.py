@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from src.scripts.race_ingest import RaceIngestBuffer, race_event_row, race_result_rows
+
+# パーサーの期待値（test_netkeiba_parsers.py と同じ golden file）をそのまま入力に使う
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "netkeiba")
+RACE_ID = "202405010811"
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        print(f"Error: {message}")
+        sys.exit(1)
+
+
+class StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def executemany(self, query, rows):
+        self.conn.statements.append(query.split()[2])
+        if self.conn.fail_on and self.conn.fail_on in query:
+            raise RuntimeError("write failed")
+
+    def execute(self, query, params=()):
+        self.conn.statements.append(query.split()[0])
+
+    def fetchone(self):
+        # horse_form_snapshot の存在確認（テーブルあり）
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    def __init__(self, fail_on: str = None):
+        self.fail_on = fail_on
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def main():
+    print("Checking race result page -> DB row mapping...")
+    with open(os.path.join(FIXTURE_DIR, f"race_{RACE_ID}.json"), "r", encoding="utf-8") as f:
+        page = json.load(f)
+
+    event = race_event_row(RACE_ID, page)
+    # (race_event_id, race_master_id, race_date, race_year, course_id, distance, surface, track_condition, lap_time)
+    check(event[2:8] == ("2024-02-18", 2024, "05", 1600, "ダート", "良"), f"unexpected race_event row: {event}")
+    check(event[8] == page["lap_time"], "lap_time should be copied from the page")
+
+    results, horses = race_result_rows(RACE_ID, page, event[3])
+    check(len(results) == len(page["rows"]), f"expected {len(page['rows'])} results, got {len(results)}")
+    # (race_event_id, horse_id, rank, frame, odds, popularity, carried_weight, horse_weight,
+    #  last_3f, time, jockey, trainer, passing_order)
+    first = results[0]
+    check(first[1] == page["rows"][0]["horse_id"], "horse_id should come from the horse link")
+    check(first[2:6] == (1, 1, 1.5, 1), f"rank/frame/odds/popularity mismatch: {first[2:6]}")
+    # last_3f（INT列）には結果表の秒数を丸めて入れず、NULL のままにする
+    check(first[6:10] == (56.0, 470, None, 95.0), f"weight/horse_weight/last_3f/time mismatch: {first[6:10]}")
+    check(first[10:] == ("騎手0", "調教師0", "1-1"), f"jockey/trainer/passing mismatch: {first[10:]}")
+    check(horses[0] == (first[1], "ペプチドナイル", "牝", 2020), f"unexpected horse row: {horses[0]}")
+
+    print("Checking RaceIngestBuffer flush / rollback...")
+    conn = StubConnection()
+    buffer = RaceIngestBuffer(conn, batch_size=2)
+    buffer.add_race("item-1", RACE_ID, page)
+    check(not buffer.is_full(), "buffer should not be full after 1 of 2 items")
+    buffer.add_pedigree("item-2", first[1], ["父", "母", "母父"])
+    check(buffer.is_full(), "buffer should be full after 2 of 2 items")
+    check(buffer.flush() == ["item-1", "item-2"], "flush should return the written items")
+    check(conn.statements[:4] == ["horse", "horse", "race_event", "race_result"],
+          f"unexpected write order: {conn.statements}")
+    check(conn.commits == 1 and conn.rollbacks == 0, "successful flush should commit once")
+    check(buffer.written["race_result"] == len(results), "written counts should include the flushed results")
+
+    conn = StubConnection(fail_on="INTO race_result")
+    buffer = RaceIngestBuffer(conn)
+    buffer.add_race("item-1", RACE_ID, page)
+    try:
+        buffer.flush()
+        check(False, "flush should re-raise write errors")
+    except RuntimeError:
+        pass
+    check(conn.rollbacks == 1 and conn.commits == 0, "failed flush should roll back without committing")
+    check(buffer.items == [] and buffer.written["race_result"] == 0, "failed flush should empty the buffer without counting")
+    check(buffer.flush() == [], "flush after a failure should have nothing left to write")
+
+    print("\nRace ingest tests Completed Successfully.")
+
+
+if __name__ == "__main__":
+    main()